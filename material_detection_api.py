@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import cv2
 import numpy as np
 import pytesseract
@@ -6,33 +6,544 @@ import re
 from PIL import Image, ImageEnhance, ImageFilter
 import requests
 from io import BytesIO
-import easyocr
 import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration, CLIPProcessor, CLIPModel
-from ultralytics import YOLO
+try:
+    import tesserocr  # ixtiyoriy: Tesseract'ni jarayon ichida ishlatish uchun
+except ImportError:
+    tesserocr = None
+try:
+    import onnxruntime  # ixtiyoriy: eksport qilingan ONNX modellar uchun
+except ImportError:
+    onnxruntime = None
 import base64
 import json
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import math
+import itertools
+import random
+from functools import lru_cache, partial
+import os
+import sys
+import time
+import hashlib
+import uuid
+import zipfile
+import argparse
+import shutil
+import threading
+import queue
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
 
 app = Flask(__name__)
 
-# AI Models ni yuklash
-print("Loading enhanced AI models...")
-reader = easyocr.Reader(['ru'])
+# OCR executor sozlamalari: 'process' | 'thread' | 'serial'
+OCR_EXECUTOR = os.environ.get('OCR_EXECUTOR', 'process')
+OCR_MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', '0')) or (os.cpu_count() or 1)
+# Process pool worker'larini yaratish usuli: Flask/torch thread'lari ishlayotgan jarayonni
+# fork qilish deadlock'ga olib kelishi mumkin, shuning uchun 'forkserver' (Windows'da 'spawn')
+OCR_PROCESS_START_METHOD = os.environ.get(
+    'OCR_PROCESS_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+# OCR rejimi: 'full' (barcha variant × config) | 'cascade' (to'yinganda to'xtash)
+OCR_MODES = ('full', 'cascade')
+OCR_MODE = os.environ.get('OCR_MODE', 'full')
+OCR_CASCADE_PATIENCE = int(os.environ.get('OCR_CASCADE_PATIENCE', '6'))
+OCR_CASCADE_CONFIDENCE = float(os.environ.get('OCR_CASCADE_CONFIDENCE', '0.9'))
+# Katta formatli (A0/A1) skanlar uchun tile'lab OCR: 'auto' (katta bo'lsa) | 'off'
+OCR_TILING_MODES = ('auto', 'off')
+OCR_TILING = os.environ.get('OCR_TILING', 'auto')
+# A1 @300dpi ~ 7016×9933 px; 12 MP kamera rasmlari (4000×3000) tile'lanmaydi va upscale_2x saqlanadi
+TILE_TRIGGER_PX = int(os.environ.get('TILE_TRIGGER_PX', '7000'))
+TILE_SIZE = int(os.environ.get('TILE_SIZE', '1600'))
+TILE_OVERLAP = int(os.environ.get('TILE_OVERLAP', '192'))
+# Matn hududlarini topib, faqat ularni OCR qilish: 'off' | 'morphology' | 'easyocr'
+TEXT_REGION_MODES = ('off', 'morphology', 'easyocr')
+TEXT_REGIONS = os.environ.get('TEXT_REGIONS', 'off')
+TEXT_REGION_PADDING = int(os.environ.get('TEXT_REGION_PADDING', '8'))
+# Bir vaqtda xotirada turadigan preprocessing variantlari uchun chegara
+PREPROCESSING_MEMORY_BUDGET_MB = int(os.environ.get('PREPROCESSING_MEMORY_BUDGET_MB', '1024'))
+# Natijalar keshi: xotiradagi LRU + diskdagi (restartdan keyin ham saqlanadi) qatlam
+# So'rovdagi ``cache``: 'use' | 'refresh' (qayta hisoblab yozish) | 'bypass'
+CACHE_MODES = ('use', 'refresh', 'bypass')
+RESULT_CACHE_MEMORY_ITEMS = int(os.environ.get('RESULT_CACHE_MEMORY_ITEMS', '128'))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'detect_materials'))
+RESULT_CACHE_DISK_MB = int(os.environ.get('RESULT_CACHE_DISK_MB', '512'))
+# Qayta siqilgan/boshqa o'lchamdagi bir xil sxemalarni perceptual hash orqali topish:
+# 'return' (saqlangan natijani qaytarish) | 'seed' (cascade'ni saqlangan materiallar bilan boshlash) | 'off'
+# Sxemalar bir-biriga o'xshash, shuning uchun default o'chirilgan: 'return' boshqa chizma natijasini qaytarishi mumkin
+NEAR_DUPLICATE_MODES = ('off', 'return', 'seed')
+NEAR_DUPLICATE_MODE = os.environ.get('NEAR_DUPLICATE_MODE', 'off')
+NEAR_DUPLICATE_SIMILARITY = float(os.environ.get('NEAR_DUPLICATE_SIMILARITY', '0.9'))
+# Pipeline o'zgarsa oshiriladi: eski kesh yozuvlari avtomatik eskiradi
+PIPELINE_VERSION = '2.1.0'
+# Tesseract backend: 'auto' (tesserocr bo'lsa o'sha) | 'tesserocr' | 'subprocess'
+TESSERACT_BACKEND = os.environ.get('TESSERACT_BACKEND', 'auto')
+# Model inference backend'lari: 'torch' | 'torch_int8' | 'onnx' | 'onnx_int8'
+MODEL_BACKENDS = {
+    'blip': os.environ.get('BLIP_BACKEND', 'torch'),
+    'clip': os.environ.get('CLIP_BACKEND', 'torch'),
+    'yolo': os.environ.get('YOLO_BACKEND', 'torch'),
+}
+# Asinxron job'lar: alohida worker pool, natijalar saqlanish muddati
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', '3600'))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '64'))
+# Tahlil sessiyalari: dekodlangan rasm + natija id bo'yicha qayta ishlatiladi
+ANALYSIS_SESSION_TTL_SECONDS = int(os.environ.get('ANALYSIS_SESSION_TTL_SECONDS', '1800'))
+ANALYSIS_SESSION_MAX = int(os.environ.get('ANALYSIS_SESSION_MAX', '64'))
+ANALYSIS_SESSION_MEMORY_MB = int(os.environ.get('ANALYSIS_SESSION_MEMORY_MB', '1024'))
+# Vaqt byudjeti: mijozning 60 s timeout'idan oldin javob qaytishi uchun (0 - o'chirilgan)
+PIPELINE_TIME_BUDGET_S = float(os.environ.get('PIPELINE_TIME_BUDGET_S', '50'))
+# Deadline'dan oldin material extraction va javob uchun qoldiriladigan vaqt
+DEADLINE_RESERVE_S = float(os.environ.get('DEADLINE_RESERVE_S', '2'))
+# Tahlil chuqurligi profili (ANALYSIS_PROFILES): 'fast' | 'balanced' | 'exhaustive'
+ANALYSIS_PROFILE = os.environ.get('ANALYSIS_PROFILE', 'exhaustive')
+# Batch (bir nechta rasm yoki ZIP): bir vaqtda ishlanadigan rasmlar soni va cheklovlar
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '4'))
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', '50'))
+BATCH_MAX_FILE_MB = int(os.environ.get('BATCH_MAX_FILE_MB', '50'))
+# ZIP ichidagi rasmlarning ochilgandagi umumiy hajmi va image_urls yuklash vaqti
+BATCH_MAX_TOTAL_MB = int(os.environ.get('BATCH_MAX_TOTAL_MB', '500'))
+BATCH_URL_TIMEOUT_S = float(os.environ.get('BATCH_URL_TIMEOUT_S', '15'))
+# Streaming: hodisa bo'lmasa shuncha soniyada keep-alive (uzilgan mijozni aniqlash uchun ham)
+STREAM_KEEPALIVE_SECONDS = float(os.environ.get('STREAM_KEEPALIVE_SECONDS', '15'))
+# Thumbnail gating: arzon CLIP + OCR probe og'ir stage'larni o'tkazib yuborishi mumkin: 'auto' | 'off'
+GATING_MODES = ('auto', 'off')
+GATING_MODE = os.environ.get('GATING_MODE', 'auto')
+# CLIP processor qisqa tomonni 224px'ga keltiradi: thumbnail undan kichik bo'lmasligi kerak
+GATE_THUMBNAIL_PX = int(os.environ.get('GATE_THUMBNAIL_PX', '224'))
+GATE_OCR_PX = int(os.environ.get('GATE_OCR_PX', '1600'))
+GATE_CONFIDENCE = float(os.environ.get('GATE_CONFIDENCE', '0.6'))
+GATE_MIN_MATERIALS = int(os.environ.get('GATE_MIN_MATERIALS', '3'))
+# Pipeline stage'lari (OCR, BLIP, CLIP, YOLO) parallel: 'on' | 'off'
+PIPELINE_CONCURRENCY = os.environ.get('PIPELINE_CONCURRENCY', 'on')
+PIPELINE_STAGE_WORKERS = int(os.environ.get('PIPELINE_STAGE_WORKERS', '16'))
+# Bir vaqtda ishlaydigan stage'lar soni (barcha request'lar bo'yicha) resurs turiga ko'ra
+STAGE_RESOURCE_LIMITS = {
+    'ocr': int(os.environ.get('OCR_STAGE_CONCURRENCY', '2')),
+    'vision': int(os.environ.get('VISION_STAGE_CONCURRENCY', '6')),
+}
+# So'rovlararo micro-batching: 'on' | 'off'
+MODEL_BATCHING = os.environ.get('MODEL_BATCHING', 'on')
+MODEL_BATCH_WINDOW_MS = float(os.environ.get('MODEL_BATCH_WINDOW_MS', '10'))
+MODEL_BATCH_MAX_SIZE = int(os.environ.get('MODEL_BATCH_MAX_SIZE', '8'))
+# Modellarni yuklash: 'background' (server darhol ishga tushadi, modellar fonda) |
+# 'lazy' (birinchi kerak bo'lganda) | 'eager' (server ochilishidan oldin)
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'background')
+# bundle_models bilan yaratilgan lokal model to'plami (bo'sh: hub/default yo'llar)
+MODEL_BUNDLE_DIR = os.environ.get('MODEL_BUNDLE_DIR', '')
+MODEL_EXPORT_DIR = os.environ.get('MODEL_EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'models'))
+
+BLIP_MODEL_ID = "Salesforce/blip-image-captioning-base"
+CLIP_MODEL_ID = "openai/clip-vit-base-patch32"
+YOLO_WEIGHTS = 'yolov8n.pt'
+
+
+class ModelNotReady(RuntimeError):
+    """Model hali yuklanmagan yoki yuklashda xatolik bo'lgan"""
+
+
+class ModelRegistry:
+    """Modellarni kerak bo'lganda yoki fonda yuklaydi va holatini kuzatadi.
+
+    Har bir model uchun holat: pending | loading | ready | failed, yuklash
+    vaqti, og'irliklar hajmi va xatolik matni. Yuklash alohida thread'da
+    bajariladi; ``get`` tayyor bo'lishini kutadi, ``available`` esa kutmaydi.
+    """
+
+    def __init__(self):
+        self._loaders = OrderedDict()
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+        self._state[name] = {'status': 'pending', 'value': None, 'event': threading.Event(),
+                             'load_seconds': None, 'memory_mb': None, 'error': None}
+
+    def _start(self, name):
+        with self._lock:
+            state = self._state[name]
+            if state['status'] != 'pending':
+                return state
+            state['status'] = 'loading'
+        threading.Thread(target=self._load, args=(name,), name=f'load-{name}', daemon=True).start()
+        return state
+
+    def _load(self, name):
+        state = self._state[name]
+        start = time.perf_counter()
+        print(f"⏳ {name} yuklanmoqda...")
+        try:
+            value = self._loaders[name]()
+            state['memory_mb'] = estimate_model_memory_mb(value)
+            state['value'] = value
+            state['status'] = 'ready'
+            print(f"✅ {name} tayyor ({time.perf_counter() - start:.1f} s)")
+        except Exception as e:
+            state['error'] = str(e)
+            state['status'] = 'failed'
+            print(f"❌ {name} yuklanmadi: {e}")
+        finally:
+            state['load_seconds'] = round(time.perf_counter() - start, 2)
+            state['event'].set()
+
+    def get(self, name, timeout=None):
+        """Tayyor modelni qaytaradi (kerak bo'lsa yuklanishini kutadi)"""
+        state = self._state[name]
+        if state['status'] != 'ready':
+            self._start(name)
+            state['event'].wait(timeout)
+            if state['status'] != 'ready':
+                raise ModelNotReady(f"{name}: {state['status']}" + (f" ({state['error']})" if state['error'] else ''))
+        return state['value']
+
+    def available(self, name):
+        """Model tayyormi; tayyor bo'lmasa kutmasdan yuklashni boshlab qo'yadi"""
+        self._start(name)
+        return self._state[name]['status'] == 'ready'
+
+    def is_ready(self, name):
+        return self._state[name]['status'] == 'ready'
+
+    def warm_up(self, names=None, wait=False):
+        names = list(names or self._loaders)
+        for name in names:
+            self._start(name)
+        if wait:
+            for name in names:
+                self._state[name]['event'].wait()
+
+    def reset_unfinished(self):
+        """Fork qilingan jarayonda: ota jarayondagi tugallanmagan yuklashlar bu yerda hech qachon tugamaydi"""
+        for name, state in self._state.items():
+            if state['status'] == 'loading':
+                self.register(name, self._loaders[name])
+
+    def info(self):
+        return {
+            name: {key: state[key] for key in ('status', 'load_seconds', 'memory_mb', 'error')}
+            for name, state in self._state.items()
+        }
+
+
+def estimate_model_memory_mb(value):
+    """Modeldagi og'irliklar hajmi (torch parametrlari/buffer'lari, ONNX fayllari)"""
+    seen = set()
+    total = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, torch.nn.Module):
+            for tensor in itertools.chain(obj.parameters(), obj.buffers()):
+                if id(tensor) not in seen:
+                    seen.add(id(tensor))
+                    total += tensor.numel() * tensor.element_size()
+        elif isinstance(obj, OnnxImageEncoder):
+            total += os.path.getsize(obj.path)
+        else:
+            # easyocr.Reader (detector/recognizer), ultralytics YOLO (model)
+            for attr in ('model', 'detector', 'recognizer'):
+                child = getattr(obj, attr, None)
+                if child is not None and id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+    return round(total / (1024 * 1024), 1)
+
+# --- Inference backend'lari ---
+# CLIP/BLIP uchun almashtiriladigan qism - image encoder (vision tower),
+# YOLO uchun - butun detektor. *_int8 backend'larda BLIP text decoder ham
+# torch dynamic int8 ga o'tkaziladi: generatsiya vaqtining asosiy qismi o'sha.
+
+MODEL_BACKEND_CHOICES = ('torch', 'torch_int8', 'onnx', 'onnx_int8')
+
+
+class ClipVisionEncoder(torch.nn.Module):
+    """pixel_values -> CLIP image features (get_image_features bilan bir xil)"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        pooled = self.vision_model(pixel_values=pixel_values)[1]
+        return self.visual_projection(pooled)
+
+
+class BlipVisionEncoder(torch.nn.Module):
+    """pixel_values -> BLIP ViT hidden states (decoder uchun image_embeds)"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values)[0]
+
+
+class OnnxImageEncoder:
+    """Eksport qilingan vision encoder'ni ONNX Runtime'da ishlatadi"""
+
+    def __init__(self, path):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.path = path
+
+    def __call__(self, pixel_values):
+        outputs = self.session.run(None, {self.input_name: pixel_values.numpy().astype(np.float32)})
+        return torch.from_numpy(outputs[0])
+
+
+def quantize_dynamic_int8(module):
+    """Linear qatlamlarni int8 ga o'tkazilgan nusxa (torch dynamic quantization)"""
+    return torch.quantization.quantize_dynamic(module.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def model_artifact_path(model_name, backend, export_dir=None):
+    """ONNX artefakt yo'li: <export_dir>/<model>.onnx yoki <model>_int8.onnx"""
+    suffix = '_int8' if backend.endswith('_int8') else ''
+    return os.path.join(export_dir or MODEL_EXPORT_DIR, f'{model_name}{suffix}.onnx')
+
+
+def resolve_model_backend(model_name, backend=None, export_dir=None):
+    """Ishlatiladigan backend: artefakt yoki onnxruntime bo'lmasa torch'ga qaytadi"""
+    backend = backend or MODEL_BACKENDS.get(model_name, 'torch')
+    if backend not in MODEL_BACKEND_CHOICES:
+        print(f"{model_name}: noma'lum backend '{backend}', torch ishlatiladi")
+        return 'torch'
+    if model_name == 'yolo' and backend == 'torch_int8':
+        # YOLO asosan Conv'lardan iborat, dynamic quantization unga ta'sir qilmaydi
+        print("yolo: torch_int8 qo'llab-quvvatlanmaydi, torch ishlatiladi")
+        return 'torch'
+    if backend.startswith('onnx'):
+        if onnxruntime is None:
+            print(f"{model_name}: onnxruntime o'rnatilmagan, torch ishlatiladi")
+            return 'torch'
+        path = model_artifact_path(model_name, backend, export_dir)
+        if not os.path.exists(path):
+            print(f"{model_name}: {path} topilmadi (export_models buyrug'ini ishga tushiring), torch ishlatiladi")
+            return 'torch'
+    return backend
+
+
+def build_model_runtime(model_name, backend, base, export_dir=None):
+    """Backend bo'yicha runtime: ``base`` (eager processor/model) ustiga encoder/detektor"""
+    runtime = dict(base, backend=backend)
+    if model_name == 'clip':
+        model = base['model']
+        if backend == 'torch':
+            runtime['image_encoder'] = ClipVisionEncoder(model).eval()
+        elif backend == 'torch_int8':
+            runtime['image_encoder'] = quantize_dynamic_int8(ClipVisionEncoder(model))
+        else:
+            runtime['image_encoder'] = OnnxImageEncoder(model_artifact_path('clip', backend, export_dir))
+        return runtime
+
+    if model_name == 'blip':
+        model = base['model']
+        if backend == 'torch':
+            runtime['image_encoder'] = BlipVisionEncoder(model).eval()
+        elif backend == 'torch_int8':
+            runtime['image_encoder'] = quantize_dynamic_int8(BlipVisionEncoder(model))
+        else:
+            runtime['image_encoder'] = OnnxImageEncoder(model_artifact_path('blip', backend, export_dir))
+        runtime['text_decoder'] = quantize_dynamic_int8(model.text_decoder) if backend.endswith('_int8') else model.text_decoder
+        return runtime
+
+    if model_name == 'yolo':
+        if backend == 'torch':
+            runtime['detector'] = base['model']
+        else:
+            from ultralytics import YOLO
+            runtime['detector'] = YOLO(model_artifact_path('yolo', backend, export_dir), task='detect')
+        return runtime
+
+    raise ValueError(f"Noma'lum model: {model_name}")
+
+
+def load_model_runtime(model_name, base):
+    """MODEL_BACKENDS bo'yicha runtime; backend yuklanmasa torch'ga qaytadi"""
+    backend = resolve_model_backend(model_name)
+    try:
+        return build_model_runtime(model_name, backend, base)
+    except Exception as e:
+        print(f"{model_name}: {backend} backend'ini yuklab bo'lmadi ({e}), torch ishlatiladi")
+        return build_model_runtime(model_name, 'torch', base)
+
+
+def bundled_model_path(model_name, bundle_dir=None):
+    """MODEL_BUNDLE_DIR ichidagi model papkasi yoki None"""
+    bundle_dir = bundle_dir or MODEL_BUNDLE_DIR
+    if not bundle_dir:
+        return None
+    path = os.path.join(bundle_dir, model_name)
+    if not os.path.isdir(path):
+        print(f"{model_name}: bundle'da yo'q ({path}), odatiy manbadan yuklanadi")
+        return None
+    return path
+
+
+def pretrained_source(model_name, model_id):
+    """from_pretrained uchun manba va argumentlar.
+
+    Bundle bo'lsa model faqat lokal papkadan (safetensors) yuklanadi:
+    hub'ga murojaat ham, yuklab olish ham yo'q.
+    """
+    path = bundled_model_path(model_name)
+    if path is None:
+        return model_id, {}
+    return path, {'local_files_only': True, 'use_safetensors': True, 'low_cpu_mem_usage': True}
+
+
+def _load_easyocr():
+    import easyocr
+    path = bundled_model_path('easyocr')
+    if path is None:
+        return easyocr.Reader(['ru'])
+    return easyocr.Reader(['ru'], model_storage_directory=path, download_enabled=False)
+
+
+def _load_blip():
+    # BLIP model for image understanding
+    from transformers import BlipForConditionalGeneration, BlipProcessor
+    source, kwargs = pretrained_source('blip', BLIP_MODEL_ID)
+    base = {
+        'processor': BlipProcessor.from_pretrained(source, local_files_only=bool(kwargs)),
+        'model': BlipForConditionalGeneration.from_pretrained(source, **kwargs).eval(),
+    }
+    return load_model_runtime('blip', base)
+
+
+def _load_clip():
+    # CLIP model for better classification; label embedding'lari shu yerda bir marta hisoblanadi
+    from transformers import CLIPModel, CLIPProcessor
+    source, kwargs = pretrained_source('clip', CLIP_MODEL_ID)
+    base = {
+        'processor': CLIPProcessor.from_pretrained(source, local_files_only=bool(kwargs)),
+        'model': CLIPModel.from_pretrained(source, **kwargs).eval(),
+    }
+    runtime = load_model_runtime('clip', base)
+    register_clip_label_sets(runtime)
+    return runtime
+
+
+def _load_yolo():
+    # YOLO model for object detection
+    from ultralytics import YOLO
+    path = bundled_model_path('yolo')
+    weights = os.path.join(path, os.path.basename(YOLO_WEIGHTS)) if path else YOLO_WEIGHTS
+    return load_model_runtime('yolo', {'model': YOLO(weights)})
+
+
+model_registry = ModelRegistry()
+model_registry.register('easyocr', _load_easyocr)
+model_registry.register('blip', _load_blip)
+model_registry.register('clip', _load_clip)
+model_registry.register('yolo', _load_yolo)
+
 
-# BLIP model for image understanding
-blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+class MicroBatcher:
+    """Parallel request'lardan kelgan inference chaqiruvlarini batch'larga yig'adi.
 
-# CLIP model for better classification
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+    Birinchi element kelgach MODEL_BATCH_WINDOW_MS davomida (yoki
+    max_batch_size to'lguncha) kutiladi, batch_fn bitta chaqiruvda
+    bajariladi va natijalar kutayotgan Future'larga qaytariladi. Modelni
+    faqat batcher thread'i chaqirgani uchun Flask thread'lari torch
+    intra-op pool'i uchun o'zaro raqobatlashmaydi.
+    """
 
-# YOLO model for object detection
-yolo_model = YOLO('yolov8n.pt')
+    def __init__(self, name, batch_fn, max_batch_size=None, window_ms=None):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size or MODEL_BATCH_MAX_SIZE
+        self.window = (MODEL_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'items': 0, 'largest_batch': 0}
 
-print("Enhanced AI models loaded successfully!")
+    def submit(self, item):
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'batcher-{self.name}', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            self.stats['batches'] += 1
+            self.stats['items'] += len(batch)
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+
+    def info(self):
+        batches = self.stats['batches']
+        return dict(self.stats, mean_batch=round(self.stats['items'] / batches, 2) if batches else 0.0)
+
+
+def encode_pixel_batch(items, encoder):
+    """Bir xil o'lchamdagi pixel_values'larni bitta forward'da encode qiladi"""
+    with torch.no_grad():
+        return list(encoder(torch.cat(items)).split(1))
+
+
+def build_model_batchers():
+    """Faol runtime'lar uchun batcher'lar (runtime har batch'da qayta o'qiladi)"""
+    if MODEL_BATCHING != 'on':
+        return {}
+    return {
+        'clip_encode': MicroBatcher('clip_encode', lambda items: encode_pixel_batch(items, model_registry.get('clip')['image_encoder'])),
+        'blip_encode': MicroBatcher('blip_encode', lambda items: encode_pixel_batch(items, model_registry.get('blip')['image_encoder'])),
+        # Har bir rasm caption + savollar = 11 prompt beradi
+        'blip_decode': MicroBatcher('blip_decode', lambda items: blip_decode_items(items),
+                                    max_batch_size=MODEL_BATCH_MAX_SIZE * 11),
+        'yolo': MicroBatcher('yolo', lambda items: yolo_detect_items(items)),
+    }
+
+
+model_batchers = build_model_batchers()
+
+
+def run_model_batched(name, items, runtime, direct_fn):
+    """Faol runtime uchun batcher orqali, aniq runtime berilsa to'g'ridan-to'g'ri"""
+    batcher = model_batchers.get(name) if runtime is None else None
+    if batcher is None:
+        return direct_fn(items)
+    futures = [batcher.submit(item) for item in items]
+    return [future.result() for future in futures]
 
 # Kolodets (well) uchun maxsus material patterns
 KOLODETS_MATERIALS = {
@@ -146,267 +657,1375 @@ KOLODETS_SCHEME_KEYWORDS = [
     'quduq', 'suv', 'kanalizatsiya', 'drenaj'
 ]
 
-def ultra_advanced_preprocessing(image):
-    """Eng ilg'or preprocessing usullari"""
-    processed_images = []
-    
-    # Original
-    processed_images.append(image)
-    
-    # Convert to PIL for advanced processing
-    pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    
-    # 1. Grayscale with different methods
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    processed_images.append(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
-    
-    # 2. Adaptive histogram equalization
+def _gray(ctx):
+    if 'gray' not in ctx:
+        ctx['gray'] = cv2.cvtColor(ctx['image'], cv2.COLOR_BGR2GRAY)
+    return ctx['gray']
+
+def _pil(ctx):
+    if 'pil' not in ctx:
+        ctx['pil'] = Image.fromarray(cv2.cvtColor(ctx['image'], cv2.COLOR_BGR2RGB))
+    return ctx['pil']
+
+def _variant_original(ctx):
+    return ctx['image']
+
+# 1. Grayscale with different methods
+def _variant_gray(ctx):
+    return _gray(ctx)
+
+# 2. Adaptive histogram equalization
+def _variant_clahe(ctx):
     clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(gray)
-    processed_images.append(cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR))
-    
-    # 3. Multiple noise reduction
-    denoised1 = cv2.fastNlMeansDenoising(gray, h=10)
-    processed_images.append(cv2.cvtColor(denoised1, cv2.COLOR_GRAY2BGR))
-    
-    denoised2 = cv2.bilateralFilter(gray, 9, 75, 75)
-    processed_images.append(cv2.cvtColor(denoised2, cv2.COLOR_GRAY2BGR))
-    
-    # 4. Sharpening with different kernels
+    return clahe.apply(_gray(ctx))
+
+# 3. Multiple noise reduction
+def _variant_denoise_nlm(ctx):
+    return cv2.fastNlMeansDenoising(_gray(ctx), h=10)
+
+def _variant_bilateral(ctx):
+    return cv2.bilateralFilter(_gray(ctx), 9, 75, 75)
+
+# 4. Sharpening with different kernels
+def _variant_sharpen_strong(ctx):
     kernel1 = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-    sharpened1 = cv2.filter2D(gray, -1, kernel1)
-    processed_images.append(cv2.cvtColor(sharpened1, cv2.COLOR_GRAY2BGR))
-    
+    return cv2.filter2D(_gray(ctx), -1, kernel1)
+
+def _variant_sharpen_soft(ctx):
     kernel2 = np.array([[0,-1,0], [-1,5,-1], [0,-1,0]])
-    sharpened2 = cv2.filter2D(gray, -1, kernel2)
-    processed_images.append(cv2.cvtColor(sharpened2, cv2.COLOR_GRAY2BGR))
-    
-    # 5. Morphological operations
+    return cv2.filter2D(_gray(ctx), -1, kernel2)
+
+# 5. Morphological operations
+def _variant_open(ctx):
     kernel = np.ones((3,3), np.uint8)
-    opened = cv2.morphologyEx(gray, cv2.MORPH_OPEN, kernel)
-    processed_images.append(cv2.cvtColor(opened, cv2.COLOR_GRAY2BGR))
-    
-    closed = cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel)
-    processed_images.append(cv2.cvtColor(closed, cv2.COLOR_GRAY2BGR))
-    
-    # 6. Edge detection
-    edges = cv2.Canny(gray, 50, 150)
-    processed_images.append(cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR))
-    
-    # 7. PIL-based enhancements
-    enhancer = ImageEnhance.Contrast(pil_image)
-    contrasted = enhancer.enhance(2.0)
-    processed_images.append(cv2.cvtColor(np.array(contrasted), cv2.COLOR_RGB2BGR))
-    
-    enhancer = ImageEnhance.Sharpness(pil_image)
-    sharpened_pil = enhancer.enhance(2.0)
-    processed_images.append(cv2.cvtColor(np.array(sharpened_pil), cv2.COLOR_RGB2BGR))
-    
-    # 8. Different scaling
-    height, width = image.shape[:2]
-    scaled_up = cv2.resize(image, (width*2, height*2), interpolation=cv2.INTER_CUBIC)
-    processed_images.append(scaled_up)
-    
-    return processed_images
+    return cv2.morphologyEx(_gray(ctx), cv2.MORPH_OPEN, kernel)
 
-def extract_text_with_all_engines(image):
-    """Barcha OCR engine'lardan foydalanish"""
-    all_texts = []
-    
-    # EasyOCR with different parameters
+def _variant_close(ctx):
+    kernel = np.ones((3,3), np.uint8)
+    return cv2.morphologyEx(_gray(ctx), cv2.MORPH_CLOSE, kernel)
+
+# 6. Edge detection
+def _variant_canny(ctx):
+    return cv2.Canny(_gray(ctx), 50, 150)
+
+# 7. PIL-based enhancements
+def _variant_contrast(ctx):
+    contrasted = ImageEnhance.Contrast(_pil(ctx)).enhance(2.0)
+    return cv2.cvtColor(np.array(contrasted), cv2.COLOR_RGB2BGR)
+
+def _variant_sharpness(ctx):
+    sharpened_pil = ImageEnhance.Sharpness(_pil(ctx)).enhance(2.0)
+    return cv2.cvtColor(np.array(sharpened_pil), cv2.COLOR_RGB2BGR)
+
+# 8. Different scaling
+def _variant_upscale_2x(ctx):
+    height, width = ctx['image'].shape[:2]
+    return cv2.resize(ctx['image'], (width*2, height*2), interpolation=cv2.INTER_CUBIC)
+
+# Preprocessing variantlari (shu tartibda yaratiladi)
+PREPROCESSING_VARIANTS = [
+    ('original', _variant_original),
+    ('gray', _variant_gray),
+    ('clahe', _variant_clahe),
+    ('denoise_nlm', _variant_denoise_nlm),
+    ('bilateral', _variant_bilateral),
+    ('sharpen_strong', _variant_sharpen_strong),
+    ('sharpen_soft', _variant_sharpen_soft),
+    ('open', _variant_open),
+    ('close', _variant_close),
+    ('canny', _variant_canny),
+    ('contrast', _variant_contrast),
+    ('sharpness', _variant_sharpness),
+    ('upscale_2x', _variant_upscale_2x),
+]
+PREPROCESSING_VARIANT_NAMES = [name for name, _ in PREPROCESSING_VARIANTS]
+
+def iter_preprocessed_variants(image, names=None):
+    """Variantlarni birma-bir yaratish (generator).
+
+    Har bir variant iste'molchi uni ishlatib bo'lgach xotiradan bo'shaydi;
+    faqat grayscale va PIL nusxasi barcha variantlar uchun umumiy saqlanadi.
+    Grayscale variantlar bir kanalli (H, W) massiv bo'lib qoladi: EasyOCR va
+    Tesseract ularni to'g'ridan-to'g'ri qabul qiladi, BGR nusxa kerak emas.
+    """
+    ctx = {'image': image}
+    for name, build in PREPROCESSING_VARIANTS:
+        if names is None or name in names:
+            yield name, build(ctx)
+
+def build_preprocessed_variant(ctx, name):
+    """Bitta variantni nomi bo'yicha yaratish (ctx iter_preprocessed_variants'dagi kabi)"""
+    return dict(PREPROCESSING_VARIANTS)[name](ctx)
+
+def ultra_advanced_preprocessing(image):
+    """Eng ilg'or preprocessing usullari"""
+    return [variant for _, variant in iter_preprocessed_variants(image)]
+
+TESSERACT_CONFIGS = [
+    '--oem 3 --psm 6 -l rus+eng',
+    '--oem 3 --psm 7 -l rus+eng',
+    '--oem 3 --psm 8 -l rus+eng',
+    '--oem 3 --psm 9 -l rus+eng',
+    '--oem 3 --psm 10 -l rus+eng',
+    '--oem 3 --psm 11 -l rus+eng',
+    '--oem 3 --psm 12 -l rus+eng',
+    '--oem 3 --psm 13 -l rus+eng',
+    '--oem 1 --psm 6 -l rus+eng',
+    '--oem 1 --psm 8 -l rus+eng',
+]
+
+def run_easyocr(image, regions=None):
+    """EasyOCR bilan matn olish.
+
+    ``regions`` — nisbiy (x0, y0, x1, y1) box'lar: berilsa CRAFT detektori
+    qayta ishlatilmaydi, faqat shu hududlar recognizer'dan o'tadi.
+    """
+    easyocr_text = []
     try:
-        results = reader.readtext(image, detail=1, paragraph=True)
-        easyocr_text = []
+        reader = get_easyocr_reader()
+        if regions:
+            height, width = image.shape[:2]
+            gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            horizontal_list = [
+                [int(x0 * width), int(x1 * width), int(y0 * height), int(y1 * height)]
+                for x0, y0, x1, y1 in regions
+            ]
+            results = reader.recognize(gray, horizontal_list=horizontal_list, free_list=[], detail=1, paragraph=False)
+        else:
+            results = reader.readtext(image, detail=1, paragraph=False)
         for (bbox, text, confidence) in results:
             if confidence > 0.2:  # Lower threshold for better recall
                 easyocr_text.append(text)
-        all_texts.extend(easyocr_text)
     except Exception as e:
         print(f"EasyOCR error: {e}")
-    
-    # Tesseract with extensive configs
-    tesseract_configs = [
-        '--oem 3 --psm 6 -l rus+eng',
-        '--oem 3 --psm 7 -l rus+eng',
-        '--oem 3 --psm 8 -l rus+eng',
-        '--oem 3 --psm 9 -l rus+eng',
-        '--oem 3 --psm 10 -l rus+eng',
-        '--oem 3 --psm 11 -l rus+eng',
-        '--oem 3 --psm 12 -l rus+eng',
-        '--oem 3 --psm 13 -l rus+eng',
-        '--oem 1 --psm 6 -l rus+eng',
-        '--oem 1 --psm 8 -l rus+eng',
-    ]
-    
-    for config in tesseract_configs:
+    return easyocr_text
+
+def easyocr_lines(image):
+    """EasyOCR qatorlari koordinatalari bilan: [(x0, y0, x1, y1, text), ...]"""
+    lines = []
+    for bbox, text, confidence in get_easyocr_reader().readtext(image, detail=1, paragraph=False):
+        if confidence > 0.2 and text.strip():
+            xs = [point[0] for point in bbox]
+            ys = [point[1] for point in bbox]
+            lines.append((int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys)), text.strip()))
+    return lines
+
+_tesseract_local = threading.local()
+
+def parse_tesseract_config(config):
+    """'--oem 3 --psm 6 -l rus+eng' -> (3, 6, 'rus+eng')"""
+    oem = re.search(r'--oem\s+(\d+)', config)
+    psm = re.search(r'--psm\s+(\d+)', config)
+    lang = re.search(r'-l\s+(\S+)', config)
+    return (
+        int(oem.group(1)) if oem else 3,
+        int(psm.group(1)) if psm else 3,
+        lang.group(1) if lang else 'eng'
+    )
+
+def resolve_tesseract_backend(backend=None):
+    """Ishlatiladigan Tesseract backend nomini aniqlash"""
+    backend = backend or TESSERACT_BACKEND
+    if backend == 'auto':
+        return 'tesserocr' if tesserocr is not None else 'subprocess'
+    if backend == 'tesserocr' and tesserocr is None:
+        print("tesserocr o'rnatilmagan, subprocess backend ishlatiladi")
+        return 'subprocess'
+    return backend
+
+def _get_tesseract_api(config):
+    """Har bir worker (thread/process) uchun (oem, psm, lang) bo'yicha tirik Tesseract handle"""
+    apis = getattr(_tesseract_local, 'apis', None)
+    if apis is None:
+        apis = _tesseract_local.apis = {}
+    key = parse_tesseract_config(config)
+    api = apis.get(key)
+    if api is None:
+        oem, psm, lang = key
+        api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=oem)
+        apis[key] = api
+    return api
+
+def _set_tesseract_image(api, image):
+    """numpy buffer'ni vaqtinchalik faylsiz Tesseract'ga berish"""
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+    api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+
+def _tesserocr_image_to_string(image, config):
+    """numpy buffer'ni vaqtinchalik fayl va yangi jarayonsiz tanib olish"""
+    api = _get_tesseract_api(config)
+    _set_tesseract_image(api, image)
+    try:
+        return api.GetUTF8Text()
+    finally:
+        api.Clear()
+
+def tesseract_lines(image, config, backend=None):
+    """Tesseract qatorlari koordinatalari bilan: [(x0, y0, x1, y1, text), ...]"""
+    lines = []
+    if resolve_tesseract_backend(backend) == 'tesserocr':
+        api = _get_tesseract_api(config)
+        _set_tesseract_image(api, image)
         try:
+            api.Recognize()
+            iterator = api.GetIterator()
+            if iterator is None:
+                return lines
+            level = tesserocr.RIL.TEXTLINE
+            for line in tesserocr.iterate_level(iterator, level):
+                text = line.GetUTF8Text(level)
+                box = line.BoundingBox(level)
+                if text and text.strip() and box:
+                    lines.append((box[0], box[1], box[2], box[3], text.strip()))
+            return lines
+        finally:
+            api.Clear()
+
+    data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+    grouped = OrderedDict()
+    for i, word in enumerate(data['text']):
+        if not word.strip():
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        x0, y0 = data['left'][i], data['top'][i]
+        x1, y1 = x0 + data['width'][i], y0 + data['height'][i]
+        if key in grouped:
+            bx0, by0, bx1, by1, words = grouped[key]
+            grouped[key] = (min(bx0, x0), min(by0, y0), max(bx1, x1), max(by1, y1), words + [word])
+        else:
+            grouped[key] = (x0, y0, x1, y1, [word])
+    for x0, y0, x1, y1, words in grouped.values():
+        lines.append((x0, y0, x1, y1, ' '.join(words)))
+    return lines
+
+def run_tesseract(image, config, backend=None):
+    """Bitta Tesseract konfiguratsiyasi bilan matn olish"""
+    try:
+        if resolve_tesseract_backend(backend) == 'tesserocr':
+            text = _tesserocr_image_to_string(image, config)
+        else:
             text = pytesseract.image_to_string(image, config=config)
-            if text.strip():
-                all_texts.append(text)
-        except Exception as e:
-            print(f"Tesseract error with config {config}: {e}")
-    
+        if text.strip():
+            return [text]
+    except Exception as e:
+        print(f"Tesseract error with config {config}: {e}")
+    return []
+
+def benchmark_tesseract_backends(image, repeat=3):
+    """subprocess (pytesseract) va in-process (tesserocr) backend'larini solishtirish"""
+    report = {'image_shape': list(image.shape), 'calls_per_run': len(TESSERACT_CONFIGS), 'backends': {}}
+    outputs = {}
+    for backend in ('subprocess', 'tesserocr'):
+        if backend == 'tesserocr' and tesserocr is None:
+            report['backends'][backend] = {'available': False}
+            continue
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs[backend] = [run_tesseract(image, config, backend=backend) for config in TESSERACT_CONFIGS]
+            timings.append(time.perf_counter() - start)
+        report['backends'][backend] = {
+            'available': True,
+            'best_s': round(min(timings), 3),
+            'mean_s': round(sum(timings) / len(timings), 3),
+            'per_call_ms': round(min(timings) / len(TESSERACT_CONFIGS) * 1000, 1),
+            'text_chars': sum(len(text) for texts in outputs[backend] for text in texts)
+        }
+    if len(outputs) == 2:
+        same = sum(1 for a, b in zip(outputs['subprocess'], outputs['tesserocr'])
+                   if [t.strip() for t in a] == [t.strip() for t in b])
+        report['identical_configs'] = f"{same}/{len(TESSERACT_CONFIGS)}"
+        report['speedup'] = round(report['backends']['subprocess']['best_s'] / max(report['backends']['tesserocr']['best_s'], 1e-9), 2)
+    return report
+
+def build_ocr_jobs(include_easyocr=None, tesseract_configs=None):
+    """Bitta variant uchun (engine, config) ishlari, natijalar shu tartibda yig'iladi.
+
+    EasyOCR hali yuklanayotgan bo'lsa (include_easyocr=None) faqat Tesseract ishlatiladi.
+    EasyOCR'ning config'i None yoki matn hududlari (qarang: run_easyocr).
+    """
+    if include_easyocr is None:
+        include_easyocr = model_registry.available('easyocr')
+    easyocr_jobs = [('easyocr', None)] if include_easyocr else []
+    return easyocr_jobs + [('tesseract', config) for config in (tesseract_configs or TESSERACT_CONFIGS)]
+
+def run_ocr_job(image, engine, config):
+    """Bitta (engine, config) ishini bajarish"""
+    if engine == 'easyocr':
+        return run_easyocr(image, config)
+    return run_tesseract(image, config)
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    stride = max(tile_size - overlap, 1)
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+def plan_tiles(shape, tiling='auto', tile_size=None, overlap=None):
+    """Katta rasm uchun bir-birini qoplaydigan tile'lar [(x0, y0, x1, y1), ...] yoki None"""
+    tile_size = tile_size or TILE_SIZE
+    overlap = TILE_OVERLAP if overlap is None else overlap
+    height, width = shape[:2]
+    if tiling == 'off' or max(height, width) <= TILE_TRIGGER_PX:
+        return None
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in _tile_starts(height, tile_size, overlap)
+        for x in _tile_starts(width, tile_size, overlap)
+    ]
+
+def run_tile_ocr_job(image, tile, engine, config):
+    """Bitta tile ustida OCR; qatorlar butun rasm koordinatalarida qaytariladi"""
+    x0, y0, x1, y1 = tile
+    crop = image[y0:y1, x0:x1]
+    try:
+        lines = easyocr_lines(crop) if engine == 'easyocr' else tesseract_lines(crop, config)
+    except Exception as e:
+        print(f"Tile OCR error ({engine} {config or ''} {tile}): {e}")
+        return []
+    return [(lx0 + x0, ly0 + y0, lx1 + x0, ly1 + y0, text) for lx0, ly0, lx1, ly1, text in lines]
+
+def reading_order(lines):
+    """Qatorlarni o'qish tartibida saralash: yuqoridan pastga, qator ichida chapdan o'ngga"""
+    if not lines:
+        return []
+    heights = sorted(max(line[3] - line[1], 1) for line in lines)
+    row_tolerance = heights[len(heights) // 2] / 2
+    rows = []
+    for line in sorted(lines, key=lambda l: (l[1] + l[3]) / 2):
+        center = (line[1] + line[3]) / 2
+        if rows and center - rows[-1][0] <= row_tolerance:
+            rows[-1][1].append(line)
+        else:
+            rows.append((center, [line]))
+    return [line for _, row in rows for line in sorted(row, key=lambda l: l[0])]
+
+def _overlap_ratio(box1, box2):
+    """Kesishma yuzasining kichik box yuzasiga nisbati"""
+    inter_w = min(box1[2], box2[2]) - max(box1[0], box2[0])
+    inter_h = min(box1[3], box2[3]) - max(box1[1], box2[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    smaller = min((box1[2] - box1[0]) * (box1[3] - box1[1]), (box2[2] - box2[0]) * (box2[3] - box2[1]))
+    return inter_w * inter_h / smaller if smaller > 0 else 0.0
+
+def merge_tile_lines(tile_results, tiles):
+    """Tile natijalarini birlashtirish: overlap zonasidagi takror qatorlarni olib tashlash.
+
+    Faqat bitta tile ichida yotgan qatorlar to'g'ridan-to'g'ri olinadi.
+    Overlap zonasiga tushgan qatorlar uzunidan qisqasiga qarab ko'rib
+    chiqiladi va boshqa tile'dan olingan qator bilan sezilarli kesishsa
+    tashlab yuboriladi, shunda tile chetida kesilgan nusxa emas, to'liq
+    nusxa qoladi.
+    """
+    kept = []
+    band = []
+    for index, (lines, tile) in enumerate(zip(tile_results, tiles)):
+        for line in lines:
+            shared_by = sum(1 for other in tiles if other[0] <= line[0] and other[1] <= line[1]
+                            and line[2] <= other[2] and line[3] <= other[3])
+            touches_other = any(_overlap_ratio(line, other) > 0 for j, other in enumerate(tiles) if j != index)
+            if touches_other or shared_by > 1:
+                band.append((index, line))
+            else:
+                kept.append(line)
+    band_kept = []
+    for index, line in sorted(band, key=lambda item: len(item[1][4]), reverse=True):
+        if not any(other_index != index and _overlap_ratio(line, other) > 0.5 for other_index, other in band_kept):
+            band_kept.append((index, line))
+    return [line[4] for line in reading_order(kept + [line for _, line in band_kept])]
+
+def _run_ocr_unit(image, engine, config, tiles):
+    """Bitta (engine, config) birligi: oddiy yoki tile'lab"""
+    if tiles is None:
+        return run_ocr_job(image, engine, config)
+    return merge_tile_lines([run_tile_ocr_job(image, tile, engine, config) for tile in tiles], tiles)
+
+def extract_text_with_all_engines(image, tiling='off', jobs=None):
+    """Barcha OCR engine'lardan foydalanish"""
+    tiles = plan_tiles(image.shape, tiling)
+    all_texts = []
+    for engine, config in jobs or build_ocr_jobs():
+        all_texts.extend(_run_ocr_unit(image, engine, config, tiles))
     return '\n'.join(all_texts)
 
-def enhanced_blip_analysis(image):
-    """Kuchaytirgan BLIP tahlili"""
+_ocr_executor = None
+_ocr_executor_lock = threading.Lock()
+# OCR worker jarayonida: EasyOCR registry orqali emas, jarayonning o'z nusxasidan
+_ocr_worker_process = False
+_worker_easyocr_reader = None
+
+def _init_ocr_worker():
+    """Worker jarayonlari bir-birining yadrolarini band qilmasligi uchun"""
+    global _ocr_worker_process
+    _ocr_worker_process = True
+    torch.set_num_threads(1)
+    cv2.setNumThreads(1)
+    model_registry.reset_unfinished()
+
+def get_easyocr_reader():
+    """EasyOCR Reader: server jarayonida registry'dan, OCR worker'ida birinchi
+    EasyOCR vazifasida bir marta yuklanadigan worker-local nusxa"""
+    global _worker_easyocr_reader
+    if not _ocr_worker_process:
+        return model_registry.get('easyocr')
+    if _worker_easyocr_reader is None:
+        _worker_easyocr_reader = _load_easyocr()
+    return _worker_easyocr_reader
+
+def get_ocr_executor():
+    """Umumiy OCR executor (barcha so'rovlar uchun bitta, concurrency chegaralangan).
+
+    Process pool OCR_PROCESS_START_METHOD bilan yaratiladi: worker'lar ota
+    jarayondagi thread'lar va model holatini meros qilib olmaydi, EasyOCR'ni
+    kerak bo'lganda o'zi yuklaydi (get_easyocr_reader).
+    """
+    global _ocr_executor
+    if OCR_EXECUTOR == 'serial' or OCR_MAX_WORKERS <= 1:
+        return None
+    with _ocr_executor_lock:
+        if _ocr_executor is None:
+            if OCR_EXECUTOR == 'thread':
+                _ocr_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS)
+            else:
+                _ocr_executor = ProcessPoolExecutor(
+                    max_workers=OCR_MAX_WORKERS,
+                    mp_context=multiprocessing.get_context(OCR_PROCESS_START_METHOD),
+                    initializer=_init_ocr_worker
+                )
+        return _ocr_executor
+
+def _reset_ocr_executor(executor):
+    """Buzilgan process pool'ni keyingi so'rov uchun qayta yaratishga tayyorlash"""
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is executor:
+            _ocr_executor = None
+    executor.shutdown(wait=False)
+
+def _share_image(image):
+    """Rasmni worker'larga nusxalamasdan berish uchun shared memory'ga joylash"""
+    shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[:] = image
+    return shm, (shm.name, image.shape, image.dtype.str)
+
+def _shared_memory_fits(nbytes):
+    """Docker'da /dev/shm odatda 64MB; sig'masa rasm oddiy pickle orqali yuboriladi"""
+    if not os.path.isdir('/dev/shm'):
+        return True
+    return shutil.disk_usage('/dev/shm').free > nbytes * 2
+
+def run_ocr_task(image_ref, engine, config, tile=None):
+    """Pool worker kirish nuqtasi: rasm yoki shared memory ref, ixtiyoriy tile"""
+    if not isinstance(image_ref, tuple):
+        if tile is None:
+            return run_ocr_job(image_ref, engine, config)
+        return run_tile_ocr_job(image_ref, tile, engine, config)
+    name, shape, dtype = image_ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return run_ocr_task(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf), engine, config, tile)
+    finally:
+        shm.close()
+
+def _prepare_image_ref(executor, image, shared):
+    """Rasmni executor uchun tayyorlash: process pool'ga shared memory orqali"""
+    if isinstance(executor, ProcessPoolExecutor) and _shared_memory_fits(image.nbytes):
+        shm, ref = _share_image(image)
+        shared.append(shm)
+        return ref
+    return image
+
+def _submit_ocr_unit(executor, image_ref, engine, config, tiles):
+    """Birlik vazifalarini yuborish: tile'siz bitta, aks holda har bir tile uchun bittadan"""
+    return [executor.submit(run_ocr_task, image_ref, engine, config, tile) for tile in (tiles or [None])]
+
+def _collect_ocr_unit(futures, tiles):
+    if tiles is None:
+        return futures[0].result()
+    return merge_tile_lines([future.result() for future in futures], tiles)
+
+def _run_ocr_unit_local(image_ref, engine, config, tiles):
+    """Pool buzilganda birlikni joriy jarayonda bajarish"""
+    if tiles is None:
+        return run_ocr_task(image_ref, engine, config)
+    return merge_tile_lines([run_ocr_task(image_ref, engine, config, tile) for tile in tiles], tiles)
+
+def _release_shared(shared):
+    for shm in shared:
+        shm.close()
+        shm.unlink()
+
+class PipelineCancelled(Exception):
+    """Mijoz natijani kutmay ketdi (masalan, stream yopildi): qolgan ish to'xtatiladi"""
+
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise PipelineCancelled("Tahlil bekor qilindi")
+
+
+# O'lchov bo'lmaganda (server yangi ishga tushgan) ishlatiladigan ehtiyotkor taxminlar, soniya.
+# ocr_step - record() saqlaydigan kattalik: bitta variant × config uchun 1 megapikselga
+# amortizatsiya qilingan devor vaqti (ketma-ket ~1 s/MP, OCR worker'lari parallel ishlaydi);
+# qolganlari bitta chaqiruv uchun
+OCR_CONCURRENCY = 1 if OCR_EXECUTOR == 'serial' else max(OCR_MAX_WORKERS, 1)
+STAGE_TIME_DEFAULTS = {'ocr_step': 1.0 / OCR_CONCURRENCY, 'blip_item': 1.5, 'yolo': 1.0, 'clip': 0.5}
+
+
+def _megapixels(image):
+    return image.shape[0] * image.shape[1] / 1e6
+
+
+class StageTimeStats:
+    """Ish turlari davomiyligining sirg'anuvchi o'rtachasi (EMA), deadline rejalashtirish uchun.
+
+    Nomlar: 'ocr_step' (bitta variant × config, amortizatsiya qilingan),
+    'blip_item' (bitta caption/savol), 'yolo', 'clip'. ``megapixels``
+    bilan yozilgan vaqt megapiksel uchun saqlanadi va taxmin ham shu
+    hajmga ko'paytiriladi: kichik rasmdagi o'lchov A0 skanni yolg'on
+    "sig'adi" qilmaydi. O'lchov bo'lmasa STAGE_TIME_DEFAULTS ishlatiladi.
+    """
+
+    def __init__(self, alpha=0.3, defaults=None):
+        self.alpha = alpha
+        self.defaults = STAGE_TIME_DEFAULTS if defaults is None else defaults
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, megapixels=None):
+        if megapixels is not None:
+            seconds /= max(megapixels, 0.01)
+        with self._lock:
+            previous = self._values.get(name)
+            self._values[name] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def estimate(self, name, megapixels=None):
+        seconds = self._values.get(name, self.defaults.get(name, 0.0))
+        return seconds * megapixels if megapixels is not None else seconds
+
+    def info(self):
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self._values.items()}
+
+
+stage_time_stats = StageTimeStats()
+
+
+class Deadline:
+    """So'rovning vaqt byudjeti: qolgan vaqt va byudjet uchun tashlab ketilgan ishlar.
+
+    ``remaining()`` DEADLINE_RESERVE_S zaxirasini hisobga oladi. Ixtiyoriy
+    ishlar (qo'shimcha variant/PSM, VQA savollari, YOLO) boshlanishidan oldin
+    ``allows(taxminiy_soniya)`` bilan tekshiriladi; ishlayotgan OCR yoki model
+    chaqiruvi to'xtatilmaydi, shuning uchun kafolat taxminlar aniqligiga bog'liq.
+    """
+
+    def __init__(self, seconds, reserve=None, end=None):
+        self.seconds = seconds
+        self.reserve = DEADLINE_RESERVE_S if reserve is None else reserve
+        self.started = time.perf_counter()
+        self.end = end if end is not None else self.started + seconds
+        self.skipped = []
+        self._lock = threading.Lock()
+
+    def child(self):
+        """Shu deadline'gacha bo'lgan alohida hisob (masalan, batch'dagi har bir rasm uchun)"""
+        return Deadline(self.end - time.perf_counter(), self.reserve, self.end)
+
+    def remaining(self):
+        return self.end - time.perf_counter() - self.reserve
+
+    def allows(self, estimated_seconds):
+        return self.remaining() > estimated_seconds
+
+    def skip(self, item, reason):
+        with self._lock:
+            self.skipped.append({'item': item, 'reason': reason})
+        print(f"Deadline: {item} o'tkazib yuborildi ({reason})")
+
+    def info(self):
+        with self._lock:
+            skipped = list(self.skipped)
+        return {
+            'budget_ms': round(self.seconds * 1000, 1),
+            'elapsed_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'partial': bool(skipped),
+            'skipped': skipped,
+        }
+
+def extract_text_from_variants(images, memory_budget_mb=None, tiling='off', jobs=None, on_text=None, cancel_event=None,
+                               deadline=None):
+    """Variant × engine × config ishlarini pool bo'ylab tarqatish.
+
+    ``images`` generator bo'lishi mumkin: variantlar kerak bo'lganda olinadi
+    va bir vaqtda ishlanayotgan variantlar hajmi ``memory_budget_mb``dan
+    oshsa, eng eskisi tugashi kutiladi. Katta variantlar ``tiling``
+    yoqilgan bo'lsa tile'larga bo'linib, har bir tile alohida vazifa
+    sifatida yuboriladi. Har bir variant uchun matn ketma-ket rejimdagi
+    bilan bir xil tartibda yig'iladi, shuning uchun natija executor turiga
+    bog'liq emas. ``on_text(index, text)`` har bir variant matni tayyor
+    bo'lishi bilan chaqiriladi; ``cancel_event`` o'rnatilsa yangi variantlar
+    yuborilmaydi va navbatdagilari bekor qilinadi. ``deadline`` berilsa,
+    navbatdagi variant byudjetga sig'maydigan bo'lganda qolganlari olinmaydi:
+    natija ro'yxati kiruvchi variantlardan qisqa bo'ladi.
+    """
+    jobs = jobs or build_ocr_jobs()
+    executor = get_ocr_executor()
+    started = time.perf_counter()
+    submitted_mp = 0.0
+
+    def fits(queued_mp, img):
+        # Birinchi variant har doim olinadi: aks holda o'lchov yozilmaydi va taxmin hech qachon aniqlashmaydi
+        if deadline is None or not submitted_mp:
+            return True
+        megapixels = (queued_mp + _megapixels(img)) * len(jobs)
+        return deadline.allows(stage_time_stats.estimate('ocr_step', megapixels))
+
+    def record(texts):
+        if texts and submitted_mp:
+            stage_time_stats.record('ocr_step', time.perf_counter() - started, megapixels=submitted_mp * len(jobs))
+        return texts
+
+    if executor is None:
+        texts = []
+        for img in images:
+            check_cancelled(cancel_event)
+            if not fits(0, img):
+                break
+            submitted_mp += _megapixels(img)
+            texts.append(extract_text_with_all_engines(img, tiling, jobs))
+            if on_text is not None:
+                on_text(len(texts) - 1, texts[-1])
+        return record(texts)
+
+    budget = (PREPROCESSING_MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb) * 1024 * 1024
+    texts = []
+    pending = deque()  # (ref, tiles, units, shared, nbytes, megapixels)
+    in_flight = 0
+
+    def collect_oldest():
+        nonlocal in_flight
+        ref, tiles, units, shared, nbytes, _ = pending[0]
+        texts.append('\n'.join(text for futures in units for text in _collect_ocr_unit(futures, tiles)))
+        pending.popleft()
+        _release_shared(shared)
+        in_flight -= nbytes
+        if on_text is not None:
+            on_text(len(texts) - 1, texts[-1])
+
+    try:
+        for img in images:
+            check_cancelled(cancel_event)
+            if not fits(sum(entry[5] for entry in pending), img):
+                break
+            while pending and in_flight + img.nbytes > budget:
+                collect_oldest()
+            shared = []
+            tiles = plan_tiles(img.shape, tiling)
+            ref = _prepare_image_ref(executor, img, shared)
+            units = [_submit_ocr_unit(executor, ref, engine, config, tiles) for engine, config in jobs]
+            pending.append((ref, tiles, units, shared, img.nbytes, _megapixels(img)))
+            submitted_mp += _megapixels(img)
+            in_flight += img.nbytes
+            del img
+            # Tugagan variantlarni darhol bo'shatish
+            while pending and all(future.done() for futures in pending[0][2] for future in futures):
+                collect_oldest()
+        while pending:
+            check_cancelled(cancel_event)
+            collect_oldest()
+        return record(texts)
+    except PipelineCancelled:
+        for _, _, units, _, _, _ in pending:
+            for futures in units:
+                for future in futures:
+                    future.cancel()
+        raise
+    except BrokenProcessPool as e:
+        # Qolgan ish ketma-ket, lekin xuddi shu cancel/deadline tekshiruvlari bilan
+        print(f"OCR process pool error, falling back to serial: {e}")
+        _reset_ocr_executor(executor)
+        while pending:
+            check_cancelled(cancel_event)
+            ref, tiles, _, shared, _, megapixels = pending.popleft()
+            if deadline is not None and not deadline.allows(stage_time_stats.estimate('ocr_step', megapixels * len(jobs))):
+                _release_shared(shared)
+                return texts
+            texts.append('\n'.join(text for engine, config in jobs for text in _run_ocr_unit_local(ref, engine, config, tiles)))
+            _release_shared(shared)
+            if on_text is not None:
+                on_text(len(texts) - 1, texts[-1])
+        for img in images:
+            check_cancelled(cancel_event)
+            if not fits(0, img):
+                break
+            texts.append(extract_text_with_all_engines(img, tiling, jobs))
+            if on_text is not None:
+                on_text(len(texts) - 1, texts[-1])
+        return texts
+    finally:
+        for _, _, _, shared, _, _ in pending:
+            _release_shared(shared)
+
+# Cascade tartibi: avval arzon va ko'p material beradigan variant/config'lar
+CASCADE_VARIANT_ORDER = [
+    'gray', 'clahe', 'original', 'sharpen_soft', 'bilateral', 'contrast',
+    'sharpness', 'denoise_nlm', 'sharpen_strong', 'close', 'open', 'upscale_2x', 'canny'
+]
+CASCADE_JOB_ORDER = [
+    '--oem 3 --psm 6 -l rus+eng',
+    '--oem 3 --psm 11 -l rus+eng',
+    '--oem 1 --psm 6 -l rus+eng',
+    '--oem 3 --psm 12 -l rus+eng',
+    'easyocr',
+    '--oem 3 --psm 7 -l rus+eng',
+    '--oem 3 --psm 13 -l rus+eng',
+    '--oem 3 --psm 8 -l rus+eng',
+    '--oem 1 --psm 8 -l rus+eng',
+    '--oem 3 --psm 9 -l rus+eng',
+    '--oem 3 --psm 10 -l rus+eng',
+]
+# Nisbiy narx: upscale 4× piksel, EasyOCR bitta Tesseract chaqiruvidan ancha og'ir
+CASCADE_VARIANT_COST = {'upscale_2x': 4.0, 'denoise_nlm': 1.5}
+# Variantning manbaga nisbatan piksellar soni (deadline taxminlari uchun)
+VARIANT_PIXEL_SCALE = {'upscale_2x': 4.0}
+CASCADE_JOB_COST = {'easyocr': 5.0}
+
+def build_cascade_steps(variant_names, jobs=None):
+    """(variant_index, job_index) juftliklarini narx × unumdorlik bo'yicha tartiblash"""
+    jobs = jobs or build_ocr_jobs()
+    steps = []
+    for vi, name in enumerate(variant_names):
+        v_rank = CASCADE_VARIANT_ORDER.index(name) if name in CASCADE_VARIANT_ORDER else len(CASCADE_VARIANT_ORDER)
+        for ji, (engine, config) in enumerate(jobs):
+            job_key = engine if engine == 'easyocr' else config
+            j_rank = CASCADE_JOB_ORDER.index(job_key) if job_key in CASCADE_JOB_ORDER else len(CASCADE_JOB_ORDER)
+            cost = CASCADE_VARIANT_COST.get(name, 1.0) * CASCADE_JOB_COST.get(engine, 1.0)
+            steps.append(((v_rank + 1) * (j_rank + 1) * cost, vi, ji))
+    steps.sort()
+    return [(vi, ji) for _, vi, ji in steps]
+
+def estimate_text_confidence(materials, text_length):
+    """calculate_overall_confidence'ning faqat matnga tegishli qismi (0.4 / 0.2 vaznlar)"""
+    if not materials:
+        return 0.0
+    material_confidence = sum(m['confidence'] for m in materials) / len(materials)
+    text_quality = min(text_length / 1000, 1.0)
+    return (material_confidence * 0.4 + text_quality * 0.2) / 0.6
+
+def cascade_extract_text(image, variant_names=None, patience=None, confidence_target=None, memory_budget_mb=None,
+                         seed_signatures=None, tiling='off', jobs=None, on_step=None, cancel_event=None, deadline=None):
+    """OCR'ni bosqichma-bosqich bajarish va natija to'yinganda to'xtash.
+
+    Har bir qadamdan keyin yangi matndan materiallar ajratiladi; ketma-ket
+    ``patience`` qadam davomida yangi (material, o'lcham) chiqmasa yoki
+    ishonchlilik ``confidence_target``ga yetsa, qolgan qadamlar tashlab
+    ketiladi. Parallel executor'da qadamlar to'lqin bilan bajariladi va
+    to'xtash faqat to'lqin chegarasida tekshiriladi. Variantlar kerak
+    bo'lganda yaratiladi va xotira chegarasidan oshsa, eng eskisi chiqarib
+    yuboriladi (kerak bo'lsa qayta yaratiladi). ``seed_signatures`` — oldin
+    topilgan (material, o'lcham) juftliklari (masalan, o'xshash sxemadan):
+    ular "allaqachon ko'rilgan" hisoblanadi. ``image`` o'rniga matn
+    hududlari ro'yxati berilsa, har bir qadam barcha hududlar ustida
+    bajariladi. ``on_step(vi, ji, text)`` har bir qadam matni bilan
+    chaqiriladi; ``cancel_event`` va ``deadline`` (keyingi to'lqin byudjetga
+    sig'maydimi) to'lqin chegarasida tekshiriladi.
+    """
+    sources = image if isinstance(image, (list, tuple)) else [image]
+    variant_names = variant_names or PREPROCESSING_VARIANT_NAMES
+    patience = OCR_CASCADE_PATIENCE if patience is None else patience
+    confidence_target = OCR_CASCADE_CONFIDENCE if confidence_target is None else confidence_target
+    budget = (PREPROCESSING_MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb) * 1024 * 1024
+    jobs = jobs or build_ocr_jobs()
+    steps = build_cascade_steps(variant_names, jobs)
+    executor = get_ocr_executor()
+    wave_size = OCR_MAX_WORKERS if executor is not None else 1
+
+    ctxs = [{'image': source} for source in sources]
+    source_mp = sum(_megapixels(source) for source in sources)
+    step_mp = lambda vi: source_mp * VARIANT_PIXEL_SCALE.get(variant_names[vi], 1.0)
+    variants = OrderedDict()  # vi -> ([(ref, tiles, shared), ...], nbytes)
+    in_memory = 0
+
+    def acquire_variant(vi, protected):
+        nonlocal in_memory
+        if vi in variants:
+            variants.move_to_end(vi)
+            return variants[vi][0]
+        built = [build_preprocessed_variant(ctx, variant_names[vi]) for ctx in ctxs]
+        nbytes = sum(variant.nbytes for variant in built)
+        for old_vi in list(variants):
+            if in_memory + nbytes <= budget:
+                break
+            if old_vi not in protected:
+                old_entries, old_nbytes = variants.pop(old_vi)
+                for _, _, old_shared in old_entries:
+                    _release_shared(old_shared)
+                in_memory -= old_nbytes
+        entries = []
+        for variant in built:
+            shared = []
+            ref = _prepare_image_ref(executor, variant, shared) if executor is not None else variant
+            entries.append((ref, plan_tiles(variant.shape, tiling), shared))
+        variants[vi] = (entries, nbytes)
+        in_memory += nbytes
+        return entries
+
+    results = {}
+    seen = set(seed_signatures or ())
+    materials = []
+    text_length = 0
+    idle_steps = 0
+    stopped_by = 'exhausted'
     try:
+        position = 0
+        while position < len(steps) and stopped_by == 'exhausted':
+            check_cancelled(cancel_event)
+            wave = steps[position:position + wave_size]
+            wave_mp = sum(step_mp(vi) for vi, _ in wave)
+            # Birinchi to'lqin har doim bajariladi (taxmin o'lchovsiz qolmasligi uchun)
+            if deadline is not None and results and not deadline.allows(stage_time_stats.estimate('ocr_step', wave_mp)):
+                stopped_by = 'deadline'
+                break
+            wave_start = time.perf_counter()
+            position += len(wave)
+            protected = {vi for vi, _ in wave}
+            if executor is None:
+                wave_results = [
+                    [text for ref, tiles, _ in acquire_variant(vi, protected) for text in _run_ocr_unit_local(ref, *jobs[ji], tiles)]
+                    for vi, ji in wave
+                ]
+            else:
+                submitted = [
+                    [(_submit_ocr_unit(executor, ref, *jobs[ji], tiles), tiles) for ref, tiles, _ in acquire_variant(vi, protected)]
+                    for vi, ji in wave
+                ]
+                wave_results = [
+                    [text for futures, tiles in step for text in _collect_ocr_unit(futures, tiles)]
+                    for step in submitted
+                ]
+            stage_time_stats.record('ocr_step', time.perf_counter() - wave_start, megapixels=wave_mp)
+
+            for (vi, ji), texts in zip(wave, wave_results):
+                results[(vi, ji)] = texts
+                step_text = '\n'.join(texts)
+                text_length += len(step_text)
+                if on_step is not None:
+                    on_step(vi, ji, step_text)
+                new_materials = extract_materials_from_enhanced_text(step_text, KOLODETS_MATERIALS)
+                materials.extend(new_materials)
+                signatures = {(m['name'].lower(), m['size']) for m in new_materials}
+                if signatures - seen:
+                    seen |= signatures
+                    idle_steps = 0
+                else:
+                    idle_steps += 1
+                if confidence_target and estimate_text_confidence(materials, text_length) >= confidence_target:
+                    stopped_by = 'confidence'
+                elif seen and idle_steps >= patience:
+                    stopped_by = 'saturation'
+    except BrokenProcessPool as e:
+        print(f"OCR process pool error in cascade, falling back to full serial OCR: {e}")
+        _reset_ocr_executor(executor)
+        variant_texts = [''] * len(variant_names)
+        stopped_by = 'exhausted'
+        for vi, name in enumerate(variant_names):
+            check_cancelled(cancel_event)
+            # Birinchi variant har doim bajariladi (asosiy cascade'dagi birinchi to'lqin kabi)
+            if deadline is not None and vi and not deadline.allows(stage_time_stats.estimate('ocr_step', step_mp(vi) * len(jobs))):
+                stopped_by = 'deadline'
+                break
+            variant_texts[vi] = '\n'.join(
+                extract_text_with_all_engines(build_preprocessed_variant(ctx, name), tiling, jobs) for ctx in ctxs
+            )
+        steps_run = vi * len(jobs) if stopped_by == 'deadline' else len(steps)
+        return variant_texts, {'mode': 'full', 'fallback': str(e), 'stopped_by': stopped_by,
+                               'steps_run': steps_run, 'steps_total': len(steps)}
+    finally:
+        for entries, _ in variants.values():
+            for _, _, shared in entries:
+                _release_shared(shared)
+
+    variant_texts = [
+        '\n'.join(text for ji in range(len(jobs)) for text in results.get((vi, ji), []))
+        for vi in range(len(variant_names))
+    ]
+    cascade_info = {
+        'mode': 'cascade',
+        'steps_run': len(results),
+        'steps_total': len(steps),
+        'stopped_by': stopped_by,
+        'unique_materials': len(seen)
+    }
+    return variant_texts, cascade_info
+
+def _merge_boxes(boxes):
+    """Kesishgan (padding bilan) box'larni bitta box'ga birlashtirish"""
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for other in result:
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    other[0], other[1] = min(other[0], box[0]), min(other[1], box[1])
+                    other[2], other[3] = max(other[2], box[2]), max(other[3], box[3])
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return [tuple(box) for box in boxes]
+
+def detect_text_regions(image, method='morphology', padding=None):
+    """Matn hududlarini original rasmda bir marta topish: [(x0, y0, x1, y1), ...] o'qish tartibida.
+
+    'easyocr' — EasyOCR'ning CRAFT detektori (recognition'siz);
+    'morphology' — gradient + Otsu + gorizontal closing: chiziqlar va
+    bo'sh qog'oz tashlanadi, zich belgilar guruhi qoladi.
+    """
+    padding = TEXT_REGION_PADDING if padding is None else padding
+    height, width = image.shape[:2]
+    boxes = []
+    if method == 'easyocr':
+        horizontal_list, free_list = model_registry.get('easyocr').detect(image)
+        for x_min, x_max, y_min, y_max in horizontal_list[0]:
+            boxes.append((x_min, y_min, x_max, y_max))
+        for polygon in free_list[0]:
+            xs = [point[0] for point in polygon]
+            ys = [point[1] for point in polygon]
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    else:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+        _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        connected = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+        contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w < 8 or h < 6 or h > height * 0.15:
+                continue
+            # Matn zich, chizmadagi aylana/ramkalar esa siyrak
+            if cv2.countNonZero(connected[y:y + h, x:x + w]) / float(w * h) < 0.3:
+                continue
+            boxes.append((x, y, x + w, y + h))
+    padded = [
+        (max(int(x0) - padding, 0), max(int(y0) - padding, 0), min(int(x1) + padding, width), min(int(y1) + padding, height))
+        for x0, y0, x1, y1 in boxes
+    ]
+    return [line[:4] for line in reading_order([box + ('',) for box in _merge_boxes(padded)])]
+
+def compose_text_regions(image, regions, gap=None):
+    """Matn hududlarini bitta OCR manbasiga yig'ish -> (rasm, layout, nisbiy box'lar).
+
+    Hududlar o'qish tartibida oq fon ustida ustma-ust teriladi ('mosaic'):
+    har bir variant × config bitta Tesseract chaqiruvi bo'ladi va bir qatorda
+    turgan hududlar matni aralashmaydi. Mosaic asl rasmdan katta chiqsa,
+    hududlardan tashqarisi oq rangga bo'yalgan asl rasm ishlatiladi ('mask').
+    Box'lar EasyOCR recognizer'i uchun natijaviy rasm o'lchamiga nisbatan.
+    """
+    gap = TEXT_REGION_PADDING * 2 if gap is None else gap
+    height, width = image.shape[:2]
+    mosaic_width = max(x1 - x0 for x0, y0, x1, y1 in regions) + gap * 2
+    mosaic_height = sum(y1 - y0 for x0, y0, x1, y1 in regions) + gap * (len(regions) + 1)
+    background = np.full((1, 1) + image.shape[2:], 255, dtype=image.dtype)
+    if mosaic_width * mosaic_height < width * height:
+        composed = np.repeat(np.repeat(background, mosaic_height, axis=0), mosaic_width, axis=1)
+        boxes = []
+        y = gap
+        for x0, y0, x1, y1 in regions:
+            composed[y:y + y1 - y0, gap:gap + x1 - x0] = image[y0:y1, x0:x1]
+            boxes.append((gap, y, gap + x1 - x0, y + y1 - y0))
+            y += y1 - y0 + gap
+        layout = 'mosaic'
+    else:
+        composed = np.repeat(np.repeat(background, height, axis=0), width, axis=1)
+        for x0, y0, x1, y1 in regions:
+            composed[y0:y1, x0:x1] = image[y0:y1, x0:x1]
+        boxes = regions
+        layout = 'mask'
+    out_height, out_width = composed.shape[:2]
+    relative = tuple(
+        (x0 / out_width, y0 / out_height, x1 / out_width, y1 / out_height) for x0, y0, x1, y1 in boxes
+    )
+    return composed, layout, relative
+
+# Kolodets-specific questions
+BLIP_QUESTIONS = [
+    "What construction materials are visible in this technical drawing?",
+    "What pipes or tubes can you see in this scheme?",
+    "Are there any concrete rings or cylinders?",
+    "What metal objects or fittings are present?",
+    "Is this a water well or sewage system diagram?",
+    "What circular or cylindrical objects are shown?",
+    "Are there any valves or connection points?",
+    "What measurements or dimensions are visible?",
+    "Are there any covers or lids shown?",
+    "What type of construction scheme is this?"
+]
+
+
+@lru_cache(maxsize=64)
+def _tokenize_blip_questions(tokenizer, bos_token_id, questions):
+    return tuple(
+        (bos_token_id,) + tuple(tokenizer(question)['input_ids'][1:-1])
+        for question in questions
+    )
+
+
+def blip_question_prompts(questions=tuple(BLIP_QUESTIONS), runtime=None):
+    """Savollarning decoder prompt'lari: BlipForConditionalGeneration.generate
+    bilan bir xil - [CLS] o'rniga BOS, oxirgi [SEP] tashlanadi.
+    Kesh tokenizer bo'yicha: boshqa (yoki qayta yuklangan) runtime eski token'larni olmaydi"""
+    blip = runtime or model_registry.get('blip')
+    bos_token_id = blip['model'].config.text_config.bos_token_id
+    return _tokenize_blip_questions(blip['processor'].tokenizer, bos_token_id, tuple(questions))
+
+
+def blip_encode_image(pil_image, runtime=None):
+    """Rasmni bir marta preprocess qilib ViT encoder'dan o'tkazadi"""
+    blip = runtime or model_registry.get('blip')
+    pixel_values = blip['processor'](images=pil_image, return_tensors="pt")['pixel_values']
+    return run_model_batched('blip_encode', [pixel_values], runtime,
+                             lambda items: encode_pixel_batch(items, blip['image_encoder']))[0]
+
+
+def blip_decode(image_embeds, prompts, max_length, runtime=None):
+    """Bir xil uzunlikdagi prompt'lar uchun bitta batch'da decode"""
+    runtime = runtime or model_registry.get('blip')
+    text_config = runtime['model'].config.text_config
+    input_ids = torch.tensor(prompts, dtype=torch.long)
+    encoder_states = image_embeds.expand(len(prompts), -1, -1)
+    with torch.no_grad():
+        out = runtime['text_decoder'].generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            eos_token_id=text_config.sep_token_id,
+            pad_token_id=text_config.pad_token_id,
+            encoder_hidden_states=encoder_states,
+            encoder_attention_mask=torch.ones(encoder_states.size()[:-1], dtype=torch.long),
+            max_length=max_length,
+        )
+    return [runtime['processor'].decode(row, skip_special_tokens=True) for row in out]
+
+
+def group_decode_items(items):
+    """(image_embeds, prompt, max_length) elementlari indekslarini (prompt uzunligi, max_length)
+    bo'yicha guruhlash: [(max_length, [indekslar]), ...]"""
+    groups = defaultdict(list)
+    for index, (_, prompt, max_length) in enumerate(items):
+        groups[(len(prompt), max_length)].append(index)
+    return [(max_length, indices) for (_, max_length), indices in groups.items()]
+
+
+def blip_decode_items(items, runtime=None):
+    """(image_embeds, prompt, max_length) elementlari (bir yoki bir nechta rasmdan).
+
+    Savollar token uzunligi va max_length bo'yicha guruhlanib decode qilinadi:
+    BLIP decoder pozitsiyalarni attention mask'dan emas, absolyut indeksdan
+    oladi, shuning uchun padding javoblarni o'zgartirib yuborardi.
+    """
+    decoded = [""] * len(items)
+    for max_length, indices in group_decode_items(items):
+        try:
+            image_embeds = torch.cat([items[i][0] for i in indices])
+            texts = blip_decode(image_embeds, [items[i][1] for i in indices], max_length, runtime)
+            for index, text in zip(indices, texts):
+                decoded[index] = text
+        except Exception as e:
+            print(f"BLIP decode error ({len(indices)} prompt): {e}")
+    return decoded
+
+
+def enhanced_blip_analysis(image, runtime=None, questions=None, cancel_event=None):
+    """Kuchaytirgan BLIP tahlili.
+
+    Rasm bir marta encode qilinadi; caption va savollar shu image embedding
+    ustida decode qilinadi (blip_decode_items). ``questions`` berilmasa
+    BLIP_QUESTIONS ishlatiladi (bo'sh ro'yxat - faqat caption).
+    Decode bir xil uzunlikdagi prompt guruhlari bilan yuboriladi va
+    ``cancel_event`` har bir guruhdan oldin tekshiriladi.
+    """
+    questions = tuple(BLIP_QUESTIONS if questions is None else questions)
+    try:
+        check_cancelled(cancel_event)
         pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        
-        # General captioning
-        inputs = blip_processor(pil_image, return_tensors="pt")
-        out = blip_model.generate(**inputs, max_length=100)
-        caption = blip_processor.decode(out[0], skip_special_tokens=True)
-        
-        # Kolodets-specific questions
-        specific_questions = [
-            "What construction materials are visible in this technical drawing?",
-            "What pipes or tubes can you see in this scheme?",
-            "Are there any concrete rings or cylinders?",
-            "What metal objects or fittings are present?",
-            "Is this a water well or sewage system diagram?",
-            "What circular or cylindrical objects are shown?",
-            "Are there any valves or connection points?",
-            "What measurements or dimensions are visible?",
-            "Are there any covers or lids shown?",
-            "What type of construction scheme is this?"
-        ]
-        
-        answers = []
-        for question in specific_questions:
-            try:
-                inputs = blip_processor(pil_image, question, return_tensors="pt")
-                out = blip_model.generate(**inputs, max_length=80)
-                answer = blip_processor.decode(out[0], skip_special_tokens=True)
-                answers.append(answer)
-            except Exception as e:
-                print(f"BLIP QA error for question '{question}': {e}")
-                answers.append("")
-        
+        image_embeds = blip_encode_image(pil_image, runtime)
+
+        # General captioning + Kolodets-specific questions
+        bos_token_id = (runtime or model_registry.get('blip'))['model'].config.text_config.bos_token_id
+        items = [(image_embeds, (bos_token_id,), 100)]
+        items += [(image_embeds, prompt, 80) for prompt in blip_question_prompts(questions, runtime)]
+        decoded = [""] * len(items)
+        for _, indices in group_decode_items(items):
+            check_cancelled(cancel_event)
+            texts = run_model_batched('blip_decode', [items[i] for i in indices], runtime,
+                                      lambda batch: blip_decode_items(batch, runtime))
+            for index, text in zip(indices, texts):
+                decoded[index] = text
+
         return {
-            'caption': caption,
-            'qa_results': answers,
-            'questions': specific_questions
+            'caption': decoded[0],
+            'qa_results': decoded[1:],
+            'questions': list(questions)
         }
+    except PipelineCancelled:
+        raise
     except Exception as e:
         print(f"BLIP analysis error: {e}")
         return {'caption': '', 'qa_results': [], 'questions': []}
 
-def clip_based_classification(image):
-    """CLIP model bilan klassifikatsiya"""
-    try:
-        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        
-        # Kolodets-specific class labels
-        class_labels = [
+# CLIP label to'plamlari: har biri o'z label'lari va prompt shablonlari bilan.
+# Bir nechta shablon berilsa (prompt ensemble), har label uchun ularning
+# o'rtacha embedding'i olinadi - request vaqtida narxi o'zgarmaydi.
+CLIP_LABEL_SETS = {
+    'kolodets': {
+        'labels': [
             "concrete ring", "concrete cylinder", "water well", "sewage system",
             "pipe", "tube", "fitting", "valve", "manhole cover", "bottom plate",
             "technical drawing", "construction scheme", "plumbing diagram",
             "water supply system", "drainage system"
-        ]
-        
-        inputs = clip_processor(text=class_labels, images=pil_image, return_tensors="pt", padding=True)
-        outputs = clip_model(**inputs)
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1)
-        
-        # Get top 5 classifications
-        top_probs, top_indices = torch.topk(probs, 5)
-        
-        classifications = []
-        for i in range(5):
-            classifications.append({
-                'label': class_labels[top_indices[0][i]],
-                'confidence': float(top_probs[0][i])
-            })
-        
-        return classifications
+        ],
+        'templates': ['{}'],
+    },
+    # Gating uchun hujjat turi; bir xil image embedding ustida qo'shimcha matritsa ko'paytmasi
+    'document_type': {
+        'labels': [
+            "a typed specification table", "a printed bill of materials",
+            "a technical drawing", "an engineering construction scheme", "a hand-drawn sketch of a well",
+            "a photo of people", "a photo of nature", "a screenshot of a website", "a photo of food"
+        ],
+        'templates': ['{}', 'an image of {}', 'a scanned page with {}'],
+    },
+}
+
+class ClipLabelRegistry:
+    """Label to'plamlarining normallashtirilgan CLIP text embedding'lari.
+
+    Text tower faqat ro'yxatga olishda (startup yoki katalog o'zgarganda)
+    ishlaydi; request vaqtida faqat vision tower va matritsa ko'paytmasi.
+    """
+
+    def __init__(self):
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(labels, templates, runtime):
+        with torch.no_grad():
+            embeddings = []
+            for template in templates:
+                prompts = [template.format(label) for label in labels]
+                inputs = runtime['processor'](text=prompts, return_tensors="pt", padding=True)
+                features = runtime['model'].get_text_features(**inputs)
+                embeddings.append(features / features.norm(dim=-1, keepdim=True))
+            embedding = torch.stack(embeddings).mean(dim=0)
+            return embedding / embedding.norm(dim=-1, keepdim=True)
+
+    def register(self, name, labels, templates=('{}',), runtime=None):
+        """Label to'plamini kodlab saqlaydi; o'zgarmagan bo'lsa qayta kodlamaydi"""
+        labels = list(labels)
+        templates = list(templates)
+        with self._lock:
+            current = self._sets.get(name)
+            if current and current['labels'] == labels and current['templates'] == templates:
+                return current
+            entry = {
+                'labels': labels,
+                'templates': templates,
+                'embeddings': self._encode(labels, templates, runtime or model_registry.get('clip')),
+            }
+            self._sets[name] = entry
+            return entry
+
+    def get(self, name):
+        entry = self._sets.get(name)
+        if entry is None:
+            config = CLIP_LABEL_SETS[name]
+            entry = self.register(name, config['labels'], config.get('templates', ('{}',)))
+        return entry
+
+    def names(self):
+        return list(self._sets)
+
+clip_label_registry = ClipLabelRegistry()
+
+def clip_image_embedding(pil_image, runtime=None):
+    """Rasmning normallashtirilgan CLIP image embedding'i (faqat vision tower)"""
+    clip = runtime or model_registry.get('clip')
+    pixel_values = clip['processor'](images=pil_image, return_tensors="pt")['pixel_values']
+    features = run_model_batched('clip_encode', [pixel_values], runtime,
+                                 lambda items: encode_pixel_batch(items, clip['image_encoder']))[0]
+    with torch.no_grad():
+        return features / features.norm(dim=-1, keepdim=True)
+
+def classify_clip_embedding(image_embedding, label_set='kolodets', top_k=5, runtime=None):
+    """Tayyor image embedding'ni label to'plami bo'yicha baholaydi"""
+    entry = clip_label_registry.get(label_set)
+    clip = runtime or model_registry.get('clip')
+    with torch.no_grad():
+        logits = clip['model'].logit_scale.exp() * image_embedding @ entry['embeddings'].t()
+        probs = logits.softmax(dim=1)
+        top_probs, top_indices = torch.topk(probs, min(top_k, len(entry['labels'])))
+
+    return [
+        {'label': entry['labels'][int(index)], 'confidence': float(prob)}
+        for prob, index in zip(top_probs[0], top_indices[0])
+    ]
+
+def clip_based_classification(image, label_set='kolodets', top_k=5, runtime=None):
+    """CLIP model bilan klassifikatsiya"""
+    try:
+        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        image_embedding = clip_image_embedding(pil_image, runtime)
+        return classify_clip_embedding(image_embedding, label_set, top_k, runtime)
     except Exception as e:
         print(f"CLIP classification error: {e}")
         return []
 
-def advanced_yolo_detection(image):
-    """Kuchaytirgan YOLO detection"""
+def register_clip_label_sets(runtime=None):
+    """CLIP_LABEL_SETS'dagi barcha to'plamlarni oldindan kodlaydi (CLIP yuklanganda)"""
+    for name, config in CLIP_LABEL_SETS.items():
+        try:
+            clip_label_registry.register(name, config['labels'], config.get('templates', ('{}',)), runtime)
+        except Exception as e:
+            print(f"CLIP label set '{name}' encoding error: {e}")
+
+# Ko'rinish uchun confidence chegaralari; model faqat eng pastida bir marta ishlaydi
+YOLO_CONF_THRESHOLDS = [0.25, 0.35, 0.45, 0.55]
+YOLO_DEDUP_IOU = 0.5
+
+# Map YOLO classes to construction materials
+YOLO_MATERIAL_MAPPING = {
+    'bottle': 'Труба ПНД',
+    'cup': 'Муфта соединительная',
+    'bowl': 'Заглушка',
+    'cell phone': 'Люк',
+    'laptop': 'Схема',
+    'book': 'Техническая документация',
+    'scissors': 'Инструмент',
+    'spoon': 'Фитинг',
+    'knife': 'Уплотнитель'
+}
+
+
+def _yolo_result_arrays(results):
+    boxes, confidences, class_ids = [], [], []
+    for result in results:
+        if result.boxes is None or len(result.boxes) == 0:
+            continue
+        boxes.append(result.boxes.xyxy.cpu().numpy())
+        confidences.append(result.boxes.conf.cpu().numpy())
+        class_ids.append(result.boxes.cls.cpu().numpy().astype(int))
+
+    if not boxes:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+    return np.concatenate(boxes), np.concatenate(confidences), np.concatenate(class_ids)
+
+
+def yolo_detect_items(items, runtime=None):
+    """(image, conf) elementlari: bir xil conf'dagilar bitta predict chaqiruvida"""
+    runtime = runtime or model_registry.get('yolo')
+    detector = runtime['detector']
+    groups = defaultdict(list)
+    for index, (_, conf) in enumerate(items):
+        groups[conf].append(index)
+
+    arrays = [None] * len(items)
+    for conf, indices in groups.items():
+        if runtime['backend'] == 'torch':
+            results = detector([items[i][0] for i in indices], conf=conf)
+            for index, result in zip(indices, results):
+                arrays[index] = _yolo_result_arrays([result])
+        else:
+            # Eksport qilingan ONNX grafi batch=1 statik shaklda
+            for index in indices:
+                arrays[index] = _yolo_result_arrays(detector(items[index][0], conf=conf))
+    return arrays
+
+
+def yolo_detection_arrays(image, conf, detector=None):
+    """Bitta forward pass: (xyxy, confidence, class_id) numpy massivlari"""
+    if detector is not None:
+        return _yolo_result_arrays(detector(image, conf=conf))
+    return run_model_batched('yolo', [(image, conf)], None, yolo_detect_items)[0]
+
+
+def advanced_yolo_detection(image, thresholds=None, detector=None, cancel_event=None):
+    """Kuchaytirgan YOLO detection.
+
+    Yuqori chegaradagi pass'lar eng pastdagining qism to'plamini qaytaradi,
+    shuning uchun model bir marta ishlaydi va har bir chegara filtr bilan olinadi.
+    ``cancel_event`` forward pass'dan oldin va keyin tekshiriladi.
+    """
     try:
-        # Multiple confidence thresholds
-        thresholds = [0.25, 0.35, 0.45, 0.55]
-        all_objects = []
-        
-        for thresh in thresholds:
-            results = yolo_model(image, conf=thresh)
-            
-            for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        class_id = int(box.cls[0])
-                        confidence = float(box.conf[0])
-                        class_name = yolo_model.names[class_id]
-                        bbox = box.xyxy[0].tolist()
-                        
-                        # Map YOLO classes to construction materials
-                        material_mapping = {
-                            'bottle': 'Труба ПНД',
-                            'cup': 'Муфта соединительная',
-                            'bowl': 'Заглушка',
-                            'cell phone': 'Люк',
-                            'laptop': 'Схема',
-                            'book': 'Техническая документация',
-                            'scissors': 'Инструмент',
-                            'spoon': 'Фитинг',
-                            'knife': 'Уплотнитель'
-                        }
-                        
-                        if class_name in material_mapping:
-                            all_objects.append({
-                                'class': class_name,
-                                'material': material_mapping[class_name],
-                                'confidence': confidence,
-                                'bbox': bbox,
-                                'threshold': thresh
-                            })
-        
-        # Remove duplicates based on bbox overlap
+        check_cancelled(cancel_event)
+        thresholds = sorted(thresholds or YOLO_CONF_THRESHOLDS)
+        boxes, confidences, class_ids = yolo_detection_arrays(image, thresholds[0], detector)
+        check_cancelled(cancel_event)
+
+        class_names = (detector or model_registry.get('yolo')['detector']).names
+        names = [class_names[int(class_id)] for class_id in class_ids]
+        mapped = np.array([name in YOLO_MATERIAL_MAPPING for name in names], dtype=bool)
+        indices = np.flatnonzero(mapped)
+        keep = indices[nms_indices(boxes[indices], confidences[indices], YOLO_DEDUP_IOU)]
+
+        threshold_array = np.array(thresholds)
         unique_objects = []
-        for obj in all_objects:
-            is_duplicate = False
-            for existing in unique_objects:
-                if calculate_iou(obj['bbox'], existing['bbox']) > 0.5:
-                    if obj['confidence'] > existing['confidence']:
-                        unique_objects.remove(existing)
-                    else:
-                        is_duplicate = True
-                    break
-            if not is_duplicate:
-                unique_objects.append(obj)
-        
+        for index in sorted(keep):
+            confidence = float(confidences[index])
+            unique_objects.append({
+                'class': names[index],
+                'material': YOLO_MATERIAL_MAPPING[names[index]],
+                'confidence': confidence,
+                'bbox': boxes[index].tolist(),
+                'threshold': thresholds[0],
+                # Obyekt saqlanib qoladigan eng qat'iy chegara
+                'max_threshold': float(threshold_array[threshold_array <= confidence].max()),
+            })
+
         return unique_objects
+    except PipelineCancelled:
+        raise
     except Exception as e:
         print(f"YOLO detection error: {e}")
         return []
 
-def calculate_iou(box1, box2):
-    """Intersection over Union hisoblash"""
-    x1_min, y1_min, x1_max, y1_max = box1
-    x2_min, y2_min, x2_max, y2_max = box2
-    
-    # Intersection area
-    inter_x_min = max(x1_min, x2_min)
-    inter_y_min = max(y1_min, y2_min)
-    inter_x_max = min(x1_max, x2_max)
-    inter_y_max = min(y1_max, y2_max)
-    
-    if inter_x_max <= inter_x_min or inter_y_max <= inter_y_min:
-        return 0.0
-    
-    inter_area = (inter_x_max - inter_x_min) * (inter_y_max - inter_y_min)
-    
-    # Union area
-    area1 = (x1_max - x1_min) * (y1_max - y1_min)
-    area2 = (x2_max - x2_min) * (y2_max - y2_min)
-    union_area = area1 + area2 - inter_area
-    
-    return inter_area / union_area if union_area > 0 else 0.0
+def pairwise_iou(boxes_a, boxes_b):
+    """xyxy box'lar orasidagi IoU matritsasi (len(a) x len(b))"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter_area = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union_area = area_a[:, None] + area_b[None, :] - inter_area
+
+    return np.divide(inter_area, union_area, out=np.zeros_like(inter_area), where=union_area > 0)
+
+def nms_indices(boxes, scores, iou_threshold):
+    """Greedy NMS: confidence bo'yicha saqlangan box indekslari"""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=int)
+
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    iou = pairwise_iou(boxes[order], boxes[order])
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for position in range(len(order)):
+        if suppressed[position]:
+            continue
+        keep.append(order[position])
+        suppressed |= iou[position] > iou_threshold
+
+    return np.array(keep, dtype=int)
 
 def intelligent_material_extraction(combined_text, blip_results, clip_results, yolo_objects):
     """Aqlli material extraction"""
@@ -457,8 +2076,163 @@ def intelligent_material_extraction(combined_text, blip_results, clip_results, y
     
     return unique_materials, is_kolodets
 
+QUANTITY_PATTERNS = [
+    re.compile(r'(\d+)\s*(?:шт|штук|дона|pc|pieces|комплект)'),
+    re.compile(r'количество\s*[:-]?\s*(\d+)'),
+    re.compile(r'qty\s*[:-]?\s*(\d+)'),
+    re.compile(r'к[-]во\s*[:-]?\s*(\d+)'),
+]
+
+@lru_cache(maxsize=4096)
+def _material_quantity_pattern(material_name_lower):
+    return re.compile(r'(\d+)\s*' + re.escape(material_name_lower))
+
+def _pattern_anchor(pattern):
+    """Pattern mos kelishi uchun qatorda albatta bo'lishi kerak bo'lgan boshlang'ich literal"""
+    anchor = ''
+    for ch in pattern:
+        if ch in '\\()[]{}.*+?|^$':
+            if ch in '?*{' and anchor:
+                anchor = anchor[:-1]  # oldingi belgi ixtiyoriy
+            break
+        anchor += ch
+    return anchor
+
+class MaterialMatcher:
+    """pattern_source (masalan KOLODETS_MATERIALS) uchun bir marta kompilyatsiya qilingan matcher.
+
+    Pattern'larning boshlang'ich literal qismlari (anchor) va keyword'lar
+    yuklashda bitta indeksga yig'iladi: har bir qator uchun avval qaysi
+    anchor'lar uchragani aniqlanadi va faqat o'shalarning pattern'lari
+    ishga tushiriladi.
+    Kategoriya/pattern/keyword tartibi saqlangani uchun natija eski
+    per-pattern tsikl bilan aynan bir xil.
+    """
+
+    def __init__(self, pattern_source):
+        self.categories = []
+        terms = []
+        self.unanchored = False
+        for category, data in pattern_source.items():
+            patterns = []
+            for pattern in data['patterns']:
+                anchor = _pattern_anchor(pattern)
+                if anchor:
+                    terms.append(anchor)
+                else:
+                    self.unanchored = True
+                patterns.append((re.compile(pattern, re.IGNORECASE), anchor))
+            keywords = []
+            for keyword in data['keywords']:
+                terms.append(keyword)
+                escaped = re.escape(keyword)
+                keywords.append((keyword, [
+                    re.compile(r'(?:' + escaped + r').*?(\d+)(?:[-.](\d+))?(?:\s*мм)?'),
+                    re.compile(r'(\d+)(?:[-.](\d+))?\s*.*?' + escaped),
+                    re.compile(r'ø\s*(\d+).*?' + escaped),
+                    re.compile(r'd\s*(\d+).*?' + escaped),
+                ]))
+            self.categories.append((category, data.get('unit', 'дона'), patterns, keywords))
+
+        # Anchor'lar literal bo'lgani uchun C darajasidagi substring qidiruvi
+        # lookahead alternation'dan ancha tez (har pozitsiyada backtracking yo'q)
+        self.terms = sorted(set(terms), key=len, reverse=True)
+        self.needles = [(term, term.lower()) for term in self.terms]
+
+    def terms_in(self, line_lower):
+        """Qatorda uchragan anchor/keyword'lar to'plami"""
+        return {term for term, needle in self.needles if needle in line_lower}
+
+    def extract(self, text):
+        materials = []
+        for line in text.split('\n'):
+            line = line.strip()
+            if len(line) < 2:
+                continue
+            line_lower = line.lower()
+            found = self.terms_in(line_lower)
+            if not found and not self.unanchored:
+                continue
+            for category, unit, patterns, keywords in self.categories:
+                for regex, anchor in patterns:
+                    if anchor and anchor not in found:
+                        continue
+                    for match in regex.finditer(line_lower):
+                        materials.append(self._pattern_material(match, line_lower, category, unit))
+                for keyword, size_patterns in keywords:
+                    if keyword in found and keyword in line_lower:
+                        materials.append(self._keyword_material(keyword, size_patterns, line_lower, category, unit))
+        return materials
+
+    @staticmethod
+    def _pattern_material(match, line_lower, category, unit):
+        material_name = match.group(0).title()
+        size = ""
+        quantity = 1
+        
+        # Enhanced size extraction
+        if match.groups():
+            size_parts = [g for g in match.groups() if g and g.isdigit()]
+            if len(size_parts) == 1:
+                size = f"Ø{size_parts[0]}мм"
+            elif len(size_parts) == 2:
+                size = f"{size_parts[0]}-{size_parts[1]}"
+        
+        # Enhanced quantity extraction
+        for qty_pattern in QUANTITY_PATTERNS + [_material_quantity_pattern(material_name.lower())]:
+            qty_match = qty_pattern.search(line_lower)
+            if qty_match:
+                quantity = int(qty_match.group(1))
+                break
+        
+        return {
+            'name': material_name,
+            'size': size or 'Стандарт',
+            'quantity': quantity,
+            'category': category,
+            'unit': unit,
+            'confidence': 0.9,
+            'source': 'text_pattern'
+        }
+
+    @staticmethod
+    def _keyword_material(keyword, size_patterns, line_lower, category, unit):
+        # Context-aware size detection
+        size = "Стандарт"
+        for size_pattern in size_patterns:
+            size_match = size_pattern.search(line_lower)
+            if size_match:
+                if size_match.group(2):
+                    size = f"{size_match.group(1)}-{size_match.group(2)}"
+                else:
+                    size = f"Ø{size_match.group(1)}мм"
+                break
+        
+        return {
+            'name': keyword.title(),
+            'size': size,
+            'quantity': 1,
+            'category': category,
+            'unit': unit,
+            'confidence': 0.7,
+            'source': 'text_keyword'
+        }
+
+_material_matchers = {}
+
+def get_material_matcher(pattern_source):
+    """pattern_source uchun kompilyatsiya qilingan matcher (bir marta quriladi)"""
+    matcher = _material_matchers.get(id(pattern_source))
+    if matcher is None:
+        matcher = _material_matchers[id(pattern_source)] = MaterialMatcher(pattern_source)
+    return matcher
+
 def extract_materials_from_enhanced_text(text, pattern_source):
     """Kuchaytirgan text parsing"""
+    return get_material_matcher(pattern_source).extract(text)
+
+def _extract_materials_reference(text, pattern_source):
+    """Eski (har bir pattern uchun alohida re.finditer) parser: faqat benchmark va parity tekshiruvi uchun"""
     materials = []
     lines = text.split('\n')
     
@@ -547,6 +2321,40 @@ def extract_materials_from_enhanced_text(text, pattern_source):
     
     return materials
 
+def synthetic_ocr_dump(line_count, seed=0):
+    """Benchmark uchun OCR'ga o'xshash matn: asosan shovqin, orasida material qatorlari"""
+    rng = random.Random(seed)
+    vocabulary = [keyword for data in KOLODETS_MATERIALS.values() for keyword in data['keywords']]
+    noise = ['схема', 'узел', 'отм.', 'м', 'см', 'ГОСТ', 'лист', '|', '—', 'i1', 'ooo', 'раз', 'план']
+    suffixes = ['', ' 2 шт', ' кол-во: 3', ' qty 4', ' ø110', ' d160', ' 10-9', ' 15.6']
+    lines = []
+    for _ in range(line_count):
+        if rng.random() < 0.7:
+            lines.append(' '.join(rng.choice(noise + [str(rng.randint(1, 2000))]) for _ in range(rng.randint(1, 8))))
+        else:
+            lines.append(f"{rng.choice(noise)} {rng.choice(vocabulary)} {rng.randint(10, 200)}{rng.choice(suffixes)}".upper())
+    return '\n'.join(lines)
+
+def benchmark_material_matcher(text, repeat=3):
+    """Eski per-pattern parser va kompilyatsiya qilingan matcher'ni solishtirish"""
+    get_material_matcher(KOLODETS_MATERIALS)
+    timings = {'reference': [], 'compiled': []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reference = _extract_materials_reference(text, KOLODETS_MATERIALS)
+        timings['reference'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        compiled = extract_materials_from_enhanced_text(text, KOLODETS_MATERIALS)
+        timings['compiled'].append(time.perf_counter() - start)
+    return {
+        'lines': text.count('\n') + 1,
+        'materials': len(compiled),
+        'identical': reference == compiled,
+        'reference_s': round(min(timings['reference']), 3),
+        'compiled_s': round(min(timings['compiled']), 3),
+        'speedup': round(min(timings['reference']) / max(min(timings['compiled']), 1e-9), 2)
+    }
+
 def enhance_materials_with_context(materials, text, is_kolodets):
     """Kontekst asosida materiallarni yaxshilash"""
     enhanced_materials = []
@@ -588,135 +2396,1272 @@ def enhance_materials_with_context(materials, text, is_kolodets):
     
     return enhanced_materials
 
-def remove_duplicates_and_improve(materials):
-    """Dublikatlarni o'chirish va yaxshilash"""
-    # Group similar materials
-    grouped = defaultdict(list)
-    for material in materials:
-        key = f"{material['name'].lower()}_{material['size']}"
-        grouped[key].append(material)
+def remove_duplicates_and_improve(materials):
+    """Dublikatlarni o'chirish va yaxshilash"""
+    # Group similar materials
+    grouped = defaultdict(list)
+    for material in materials:
+        key = f"{material['name'].lower()}_{material['size']}"
+        grouped[key].append(material)
+    
+    unique_materials = []
+    for materials_group in grouped.values():
+        if len(materials_group) == 1:
+            unique_materials.append(materials_group[0])
+        else:
+            # Merge similar materials
+            best_material = max(materials_group, key=lambda x: x['confidence'])
+            total_quantity = sum(m['quantity'] for m in materials_group)
+            
+            best_material['quantity'] = total_quantity
+            best_material['confidence'] = min(best_material['confidence'] + 0.1, 1.0)
+            best_material['sources'] = list(set(m.get('source', 'unknown') for m in materials_group))
+            
+            unique_materials.append(best_material)
+    
+    # Sort by confidence and relevance
+    unique_materials.sort(key=lambda x: (x['confidence'], x['quantity']), reverse=True)
+    
+    return unique_materials
+
+class InvalidRequestOption(ValueError):
+    """So'rov parametri noto'g'ri: javob 400 bilan qaytadi"""
+
+@app.errorhandler(InvalidRequestOption)
+def invalid_request_option(e):
+    return jsonify({'success': False, 'error': str(e), 'error_type': 'InvalidRequestOption'}), 400
+
+def parse_number_option(name, value, cast, minimum=None, maximum=None):
+    """Son parametrini tekshirish: noto'g'ri tur yoki chegaradan tashqari bo'lsa InvalidRequestOption"""
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise InvalidRequestOption(f"{name}: {cast.__name__} kutilgan, {value!r} berildi")
+    if number != number or (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise InvalidRequestOption(f"{name}: {number} ruxsat etilgan oraliqdan tashqarida [{minimum}, {maximum}]")
+    return number
+
+def parse_choice_option(name, value, choices):
+    """Ro'yxatdagi qiymatlardan biri bo'lishi kerak bo'lgan parametr, aks holda InvalidRequestOption"""
+    if value not in choices:
+        raise InvalidRequestOption(f"{name}: {value!r} noma'lum (mumkin: {', '.join(choices)})")
+    return value
+
+def get_request_option(name, default=None):
+    """So'rov parametrini query string, form yoki JSON body'dan olish"""
+    value = request.args.get(name)
+    if value is None and request.form:
+        value = request.form.get(name)
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get(name)
+    return default if value is None else value
+
+class ResultCache:
+    """Tahlil natijalari keshi: xotirada LRU, diskda hajmi cheklangan qatlam.
+
+    Kalit rasmning dekodlangan piksel'lari, pipeline versiyasi va natijaga
+    ta'sir qiluvchi sozlamalardan hisoblanadi. Yozuvlar JSON matn sifatida
+    saqlanadi, shuning uchun har bir hit mustaqil nusxa qaytaradi.
+    """
+
+    def __init__(self, memory_items, disk_dir=None, disk_max_bytes=0):
+        self.memory_items = memory_items
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()  # key -> size, eng eski birinchi
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+        if self.disk_dir and self.disk_max_bytes > 0:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.json'):
+                    path = os.path.join(self.disk_dir, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+            for _, key, size in sorted(entries):
+                self._disk_index[key] = size
+                self._disk_bytes += size
+        except OSError as e:
+            print(f"Result cache disk tier disabled: {e}")
+            self.disk_dir = None
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _remember(self, key, payload):
+        self._memory[key] = payload
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def get(self, key, record_miss=True):
+        """(natija, 'memory' | 'disk') yoki (None, None).
+        ``record_miss=False`` - ichki tekshiruvlar (masalan, eskirgan near-duplicate kaliti) miss hisoblanmaydi"""
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return json.loads(payload), 'memory'
+            if self.disk_dir and key in self._disk_index:
+                try:
+                    with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                        payload = f.read()
+                    os.utime(self._disk_path(key))
+                    self._disk_index.move_to_end(key)
+                    self._remember(key, payload)
+                    self.stats['disk_hits'] += 1
+                    return json.loads(payload), 'disk'
+                except (OSError, ValueError) as e:
+                    print(f"Result cache read error for {key}: {e}")
+                    self._drop_disk(key)
+            if record_miss:
+                self.stats['misses'] += 1
+            return None, None
+
+    def put(self, key, result):
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, payload)
+            self.stats['stores'] += 1
+            if not self.disk_dir:
+                return
+            size = len(payload.encode('utf-8'))
+            if size > self.disk_max_bytes:
+                return
+            try:
+                tmp_path = self._disk_path(key) + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                print(f"Result cache write error for {key}: {e}")
+                return
+            if key in self._disk_index:
+                self._disk_bytes -= self._disk_index.pop(key)
+            self._disk_index[key] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self.disk_max_bytes and self._disk_index:
+                self._drop_disk(next(iter(self._disk_index)))
+                self.stats['evictions'] += 1
+
+    def _drop_disk(self, key):
+        self._disk_bytes -= self._disk_index.pop(key, 0)
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def invalidate(self, key=None):
+        """Bitta kalitni yoki (key=None bo'lsa) butun keshni o'chirish; o'chirilganlar soni"""
+        with self._lock:
+            keys = [key] if key else list(set(self._memory) | set(self._disk_index))
+            removed = 0
+            for k in keys:
+                found = self._memory.pop(k, None) is not None
+                if self.disk_dir and k in self._disk_index:
+                    self._drop_disk(k)
+                    found = True
+                removed += int(found)
+            self.stats['invalidations'] += removed
+            return removed
+
+    def info(self):
+        with self._lock:
+            lookups = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                hit_rate=round((self.stats['memory_hits'] + self.stats['disk_hits']) / lookups, 3) if lookups else 0.0,
+                memory_entries=len(self._memory),
+                disk_entries=len(self._disk_index),
+                disk_bytes=self._disk_bytes
+            )
+
+result_cache = ResultCache(RESULT_CACHE_MEMORY_ITEMS, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MB * 1024 * 1024)
+
+# Natijaga ta'sir qilmaydigan sozlamalar kesh kalitiga kirmaydi
+CACHE_NEUTRAL_OPTIONS = {'memory_budget_mb'}
+
+def options_fingerprint(options):
+    """Natijaga ta'sir qiluvchi sozlamalarning qisqa hash'i"""
+    relevant = {k: v for k, v in options.items() if k not in CACHE_NEUTRAL_OPTIONS}
+    return hashlib.blake2b(json.dumps(relevant, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+def result_cache_key(image, options):
+    """Dekodlangan rasm + pipeline versiyasi + sozlamalar bo'yicha kesh kaliti"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{PIPELINE_VERSION}|{image.shape}|{image.dtype}|{options_fingerprint(options)}|".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+def perceptual_hash(image):
+    """64-bit pHash: normallashtirilgan 32×32 thumbnail DCT'sining past chastotali 8×8 qismi"""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(thumbnail)[:8, :8].flatten()
+    bits = low_freq > np.median(low_freq[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+class PerceptualHashIndex:
+    """64-bit perceptual hash'lar uchun multi-index hashing.
+
+    Hash 4 ta 16-bitli bo'lakka bo'linadi. Hamming masofa <= r bo'lsa,
+    pigeonhole prinsipiga ko'ra kamida bitta bo'lak r // 4 dan oshmaydigan
+    masofada bo'ladi, shuning uchun faqat shu bo'laklar qo'shnilari
+    jadvaldan olinadi va to'liq masofa faqat kandidatlar uchun hisoblanadi.
+    Yuz minglab yozuvda ham qidiruv bir necha yuz dict lookup bilan tugaydi.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self, path=None):
+        self.path = path
+        self._tables = [defaultdict(list) for _ in range(self.CHUNKS)]
+        self._entries = []  # (hash, value); o'chirilganlari None
+        self._positions = defaultdict(list)  # value -> _entries'dagi pozitsiyalar
+        self._known = set()
+        self._removed = 0
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) >= 2:
+                        self._add(int(parts[0], 16), tuple(parts[1:]))
+        except (OSError, ValueError) as e:
+            print(f"Perceptual hash index load error: {e}")
+
+    def _chunks(self, phash):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(phash >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _add(self, phash, value):
+        if (phash, value) in self._known:
+            return False
+        self._known.add((phash, value))
+        position = len(self._entries)
+        self._entries.append((phash, value))
+        self._positions[value].append(position)
+        for table, chunk in zip(self._tables, self._chunks(phash)):
+            table[chunk].append(position)
+        return True
+
+    def add(self, phash, value):
+        """value — satrlar tuple'i (diskka tab bilan ajratib yoziladi)"""
+        with self._lock:
+            if self._add(phash, value) and self.path:
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write('\t'.join((f"{phash:016x}",) + value) + '\n')
+                except OSError as e:
+                    print(f"Perceptual hash index write error: {e}")
+
+    def remove(self, values):
+        """value'larni indeksdan o'chirish; o'chirilganlar ko'payganda disk fayli qayta yoziladi"""
+        with self._lock:
+            for value in set(values):
+                for position in self._positions.pop(value, ()):
+                    self._known.discard(self._entries[position])
+                    self._entries[position] = None
+                    self._removed += 1
+            if self._removed > max(64, len(self._known) // 4):
+                self._compact()
+
+    def _compact(self):
+        live = [entry for entry in self._entries if entry is not None]
+        self._tables = [defaultdict(list) for _ in range(self.CHUNKS)]
+        self._entries = []
+        self._positions = defaultdict(list)
+        self._known = set()
+        self._removed = 0
+        for phash, value in live:
+            self._add(phash, value)
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for phash, value in live:
+                    f.write('\t'.join((f"{phash:016x}",) + value) + '\n')
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Perceptual hash index write error: {e}")
+
+    def _chunk_neighbours(self, chunk, radius):
+        yield chunk
+        for distance in range(1, radius + 1):
+            for bits in itertools.combinations(range(self.CHUNK_BITS), distance):
+                flipped = chunk
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def query(self, phash, max_distance):
+        """max_distance ichidagi yozuvlar: [(masofa, value), ...] yaqinidan boshlab"""
+        radius = max_distance // self.CHUNKS
+        with self._lock:
+            candidates = set()
+            for table, chunk in zip(self._tables, self._chunks(phash)):
+                for neighbour in self._chunk_neighbours(chunk, radius):
+                    candidates.update(table.get(neighbour, ()))
+            matches = []
+            for position in candidates:
+                if self._entries[position] is None:
+                    continue
+                entry_hash, value = self._entries[position]
+                distance = hamming_distance(entry_hash, phash)
+                if distance <= max_distance:
+                    matches.append((distance, value))
+        matches.sort()
+        return matches
+
+    def __len__(self):
+        return len(self._known)
+
+near_duplicate_index = PerceptualHashIndex(
+    os.path.join(result_cache.disk_dir, 'phash_index.tsv') if result_cache.disk_dir else None
+)
+
+def find_near_duplicate(image, options, exclude_key=None, similarity=None):
+    """O'xshash sxemaning keshdagi natijasi: (natija, info) yoki (None, None)"""
+    similarity = NEAR_DUPLICATE_SIMILARITY if similarity is None else similarity
+    max_distance = int((1.0 - similarity) * 64)
+    phash = perceptual_hash(image)
+    fingerprint = options_fingerprint(options)
+    stale = []
+    try:
+        for distance, (cache_key, entry_fingerprint) in near_duplicate_index.query(phash, max_distance):
+            if cache_key == exclude_key or entry_fingerprint != fingerprint:
+                continue
+            cached, tier = result_cache.get(cache_key, record_miss=False)
+            if cached is not None:
+                return cached, {
+                    'key': cache_key,
+                    'status': f'near_duplicate_{tier}',
+                    'distance': distance,
+                    'similarity': round(1.0 - distance / 64, 3)
+                }
+            # Kesh yozuvi chiqarib yuborilgan: indeksdagi kalit endi hech narsa bermaydi
+            stale.append((cache_key, entry_fingerprint))
+        return None, None
+    finally:
+        if stale:
+            near_duplicate_index.remove(stale)
+
+def remember_near_duplicate(image, options, cache_key):
+    near_duplicate_index.add(perceptual_hash(image), (cache_key, options_fingerprint(options)))
+
+def load_request_image():
+    """So'rovdan rasmni olish: (image, None) yoki (None, xato javobi)"""
+    image = None
+    
+    # Проверяем тип контента
+    content_type = request.content_type or ''
+    print(f"Content-Type: {content_type}")
+    
+    if 'multipart/form-data' in content_type and 'file' in request.files:
+        print("Обработка multipart/form-data файла...")
+        file = request.files['file']
+        if file.filename == '':
+            return None, (jsonify({'success': False, 'error': 'Файл не выбран'}), 400)
+        image_bytes = file.read()
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        
+    elif request.is_json:
+        print("Обработка JSON запроса...")
+        if 'image_url' in request.json:
+            image_url = request.json['image_url']
+            response = requests.get(image_url)
+            image = Image.open(BytesIO(response.content))
+            image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        elif 'image_base64' in request.json:
+            image_data = base64.b64decode(request.json['image_base64'])
+            image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        return None, (jsonify({'success': False, 'error': 'Неподдерживаемый тип контента'}), 400)
+
+    if image is None:
+        return None, (jsonify({'success': False, 'error': 'Не удалось загрузить изображение'}), 400)
+    return image, None
+
+# Tahlil chuqurligi profillari. None - to'liq ro'yxat (variantlar, config'lar,
+# savollar, chegaralar); ocr_mode/text_regions/gating berilmasa server default'i.
+# So'rovda aniq berilgan ocr_mode/text_regions/gating profildan ustun.
+ANALYSIS_PROFILES = {
+    # Xarita ekranlari uchun sub-second preview: bitta variant, ikki PSM, faqat CLIP.
+    # Gating probe va matn hududlarini qidirish bu yerda tejaganidan qimmat: o'chirilgan
+    'fast': {
+        'variants': ['gray'],
+        'tesseract_configs': ['--oem 3 --psm 6 -l rus+eng', '--oem 3 --psm 11 -l rus+eng'],
+        'easyocr': False,
+        'models': ['clip'],
+        'blip_questions': [],
+        'yolo_thresholds': [0.45],
+        'ocr_mode': 'cascade',
+        'text_regions': 'off',
+        'gating': 'off',
+    },
+    'balanced': {
+        'variants': ['gray', 'clahe', 'original', 'sharpen_soft', 'bilateral', 'contrast'],
+        'tesseract_configs': ['--oem 3 --psm 6 -l rus+eng', '--oem 3 --psm 11 -l rus+eng',
+                              '--oem 1 --psm 6 -l rus+eng', '--oem 3 --psm 12 -l rus+eng'],
+        'easyocr': True,
+        'models': ['blip', 'clip', 'yolo'],
+        'blip_questions': BLIP_QUESTIONS[:4],
+        'yolo_thresholds': [0.25, 0.45],
+        'ocr_mode': 'cascade',
+    },
+    # Verifikator ekrani: hamma variant × config, hamma model va savol.
+    # Gating stage'larni tashlab, OCR'ni cascade'ga tushirishi mumkin - bu yerda o'chirilgan
+    # (benchmark_analysis_profiles recall'ni aynan shu profilga nisbatan hisoblaydi)
+    'exhaustive': {
+        'variants': None,
+        'tesseract_configs': None,
+        'easyocr': True,
+        'models': ['blip', 'clip', 'yolo'],
+        'blip_questions': None,
+        'yolo_thresholds': None,
+        'gating': 'off',
+    },
+}
+
+def resolve_analysis_profile(name):
+    """Profil nomi -> pipeline sozlamalari (None'lar to'liq ro'yxat bilan almashtiriladi)"""
+    if name not in ANALYSIS_PROFILES:
+        raise InvalidRequestOption(f"Noma'lum profil: {name} (mavjud: {', '.join(ANALYSIS_PROFILES)})")
+    profile = ANALYSIS_PROFILES[name]
+    return {
+        'profile': name,
+        'variants': list(profile['variants'] or PREPROCESSING_VARIANT_NAMES),
+        'tesseract_configs': list(profile['tesseract_configs'] or TESSERACT_CONFIGS),
+        'easyocr': profile['easyocr'],
+        'models': list(profile['models']),
+        'blip_questions': list(BLIP_QUESTIONS if profile['blip_questions'] is None else profile['blip_questions']),
+        'yolo_thresholds': sorted(profile['yolo_thresholds'] or YOLO_CONF_THRESHOLDS),
+    }
+
+def build_detection_options(profile_name=None, get_option=lambda name, default: default):
+    """Profil va ``get_option(nom, default)`` (masalan, so'rov parametrlari) bo'yicha pipeline sozlamalari"""
+    profile_name = profile_name or ANALYSIS_PROFILE
+    options = resolve_analysis_profile(profile_name)
+    profile = ANALYSIS_PROFILES[profile_name]
+    options.update({
+        'ocr_mode': parse_choice_option(
+            'ocr_mode', get_option('ocr_mode', profile.get('ocr_mode', OCR_MODE)), OCR_MODES),
+        'cascade_patience': parse_number_option(
+            'cascade_patience', get_option('cascade_patience', OCR_CASCADE_PATIENCE), int, 1),
+        'cascade_confidence': parse_number_option(
+            'cascade_confidence', get_option('cascade_confidence', OCR_CASCADE_CONFIDENCE), float, 0.0, 1.0),
+        'memory_budget_mb': parse_number_option(
+            'memory_budget_mb', get_option('memory_budget_mb', PREPROCESSING_MEMORY_BUDGET_MB), int, 16),
+        'tiling': parse_choice_option('tiling', get_option('tiling', OCR_TILING), OCR_TILING_MODES),
+        'text_regions': parse_choice_option(
+            'text_regions', get_option('text_regions', profile.get('text_regions', TEXT_REGIONS)), TEXT_REGION_MODES),
+        'gating': parse_choice_option('gating', get_option('gating', profile.get('gating', GATING_MODE)), GATING_MODES),
+    })
+    return options
+
+def get_detection_options():
+    """So'rovdan pipeline sozlamalarini yig'ish (``profile`` + aniq berilgan parametrlar)"""
+    return build_detection_options(get_request_option('profile', ANALYSIS_PROFILE), get_request_option)
+
+_stage_semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in STAGE_RESOURCE_LIMITS.items()}
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+
+def get_stage_executor():
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is None:
+            _stage_executor = ThreadPoolExecutor(max_workers=PIPELINE_STAGE_WORKERS, thread_name_prefix='stage')
+        return _stage_executor
+
+
+class StageGraph:
+    """Kirish/chiqishlari e'lon qilingan stage'lar grafi.
+
+    Har bir stage natijasi uning nomi bilan saqlanadi va ``inputs``dagi
+    stage'lar natijalari pozitsion argument sifatida beriladi. Bog'liqliklari
+    tayyor bo'lgan stage'lar bir vaqtda ishga tushadi; ``resource`` bo'yicha
+    STAGE_RESOURCE_LIMITS'dagi cheklov barcha request'lar uchun umumiy.
+    """
+
+    # Ishlayotgan stage'larni kutishda cancel_event shu oraliqda tekshiriladi
+    cancel_poll_seconds = 0.5
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def add(self, name, fn, inputs=(), resource=None):
+        self.stages[name] = (fn, tuple(inputs), resource)
+        return self
+
+    @staticmethod
+    def _run_stage(fn, args, resource):
+        semaphore = _stage_semaphores.get(resource)
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            start = time.perf_counter()
+            result = fn(*args)
+            return result, time.perf_counter() - start
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def run(self, parallel=True, on_done=None, cancel_event=None):
+        """Natijalar {stage: natija} va vaqtlar {stage: ms}.
+
+        ``on_done(stage, natija, ms)`` har bir stage tugashi bilan chaqiriladi.
+        ``cancel_event`` o'rnatilsa yangi stage'lar boshlanmaydi, navbatdagilari
+        bekor qilinadi va PipelineCancelled ko'tariladi; ishlayotgan stage'lar
+        o'zi ``cancel_event``ni tekshirib to'xtaydi.
+        """
+        results = {}
+        timings = {}
+        if not parallel:
+            for name, (fn, inputs, resource) in self.stages.items():
+                check_cancelled(cancel_event)
+                results[name], seconds = self._run_stage(fn, [results[i] for i in inputs], resource)
+                timings[name] = round(seconds * 1000, 1)
+                if on_done is not None:
+                    on_done(name, results[name], timings[name])
+            return results, timings
+
+        executor = get_stage_executor()
+        pending = OrderedDict(self.stages)
+        running = {}
+        while pending or running:
+            if cancel_event is not None and cancel_event.is_set():
+                for future in running:
+                    future.cancel()
+                check_cancelled(cancel_event)
+            for name in [n for n, (_, inputs, _) in pending.items() if all(i in results for i in inputs)]:
+                fn, inputs, resource = pending.pop(name)
+                running[executor.submit(self._run_stage, fn, [results[i] for i in inputs], resource)] = name
+            if not running:
+                raise ValueError(f"Stage bog'liqliklari bajarilmaydi: {list(pending)}")
+            done, _ = wait(running, timeout=self.cancel_poll_seconds if cancel_event is not None else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], seconds = future.result()
+                timings[name] = round(seconds * 1000, 1)
+                if on_done is not None:
+                    on_done(name, results[name], timings[name])
+        return results, timings
+
+
+# document_type label'lari -> gating kategoriyasi
+GATE_DOCUMENT_CLASSES = {
+    "a typed specification table": 'specification',
+    "a printed bill of materials": 'specification',
+    "a technical drawing": 'drawing',
+    "an engineering construction scheme": 'drawing',
+    "a hand-drawn sketch of a well": 'drawing',
+    "a photo of people": 'unrelated',
+    "a photo of nature": 'unrelated',
+    "a screenshot of a website": 'unrelated',
+    "a photo of food": 'unrelated',
+}
+GATE_OCR_CONFIG = '--oem 3 --psm 6 -l rus+eng'
+
+# Birinchi mos kelgan qoida ishlatiladi; hech biri mos kelmasa hamma stage ishlaydi
+GATING_RULES = [
+    {
+        'name': 'unrelated_image',
+        'when': lambda probe: (probe['document_class'] == 'unrelated' and probe['document_confidence'] >= GATE_CONFIDENCE
+                               and probe['materials'] == 0 and probe['kolodets_keywords'] == 0),
+        'skip': ['blip', 'yolo'],
+        'ocr_mode': 'cascade',
+        'reason': "CLIP: qurilish sxemasi emas ({document_label}, {document_confidence:.0%}), OCR probe material topmadi",
+    },
+    {
+        'name': 'typed_specification',
+        'when': lambda probe: (probe['document_class'] == 'specification' and probe['document_confidence'] >= GATE_CONFIDENCE
+                               and probe['materials'] >= GATE_MIN_MATERIALS),
+        'skip': ['blip', 'yolo'],
+        'ocr_mode': 'cascade',
+        'reason': "Bosma spetsifikatsiya: OCR probe {materials} ta material topdi (CLIP: {document_label}, {document_confidence:.0%})",
+    },
+]
+
+
+def _resize_longest(image, size):
+    height, width = image.shape[:2]
+    scale = size / float(max(height, width))
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)), interpolation=cv2.INTER_AREA)
+
+
+def _resize_shortest(image, size):
+    """Qisqa tomon ``size`` bo'lguncha kichraytirish (CLIP processor'ining resize'i kabi)"""
+    height, width = image.shape[:2]
+    scale = size / float(min(height, width))
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(round(width * scale), size), max(round(height * scale), size)), interpolation=cv2.INTER_AREA)
+
+
+def run_gating_probe(image):
+    """Arzon birinchi qadam: thumbnail'da CLIP (ikki label to'plami) va bitta Tesseract o'tishi.
+
+    Thumbnail qisqa tomoni bo'yicha GATE_THUMBNAIL_PX'gacha kichraytiriladi:
+    CLIP processor'i shu o'lchamdan markaziy 224×224 kesadi, shuning uchun
+    natija asl rasmdagi CLIP bilan deyarli bir xil va to'liq stage o'rnini bosadi.
+    """
+    start = time.perf_counter()
+    probe = {'document_label': None, 'document_class': None, 'document_confidence': 0.0, 'clip_results': None}
+
+    if model_registry.available('clip'):
+        thumbnail = _resize_shortest(image, GATE_THUMBNAIL_PX)
+        try:
+            embedding = clip_image_embedding(Image.fromarray(cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB)))
+            probe['clip_results'] = classify_clip_embedding(embedding, 'kolodets')
+            document = classify_clip_embedding(embedding, 'document_type', top_k=1)[0]
+            probe['document_label'] = document['label']
+            probe['document_class'] = GATE_DOCUMENT_CLASSES.get(document['label'])
+            probe['document_confidence'] = document['confidence']
+        except Exception as e:
+            print(f"Gating CLIP error: {e}")
+
+    probe_image = _resize_longest(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), GATE_OCR_PX)
+    text = '\n'.join(run_tesseract(probe_image, GATE_OCR_CONFIG))
+    text_lower = text.lower()
+    probe['text_chars'] = len(text.strip())
+    probe['kolodets_keywords'] = sum(1 for keyword in KOLODETS_SCHEME_KEYWORDS if keyword in text_lower)
+    probe['materials'] = len({(m['name'].lower(), m['size']) for m in extract_materials_from_enhanced_text(text, KOLODETS_MATERIALS)})
+    probe['ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return probe
+
+
+def decide_stages(probe):
+    """GATING_RULES bo'yicha qaror: {'rule', 'skip': {stage: sabab}, 'ocr_mode'}"""
+    for rule in GATING_RULES:
+        if rule['when'](probe):
+            reason = rule['reason'].format(**probe)
+            return {'rule': rule['name'], 'skip': {stage: reason for stage in rule['skip']}, 'ocr_mode': rule.get('ocr_mode')}
+    return {'rule': 'full_analysis', 'skip': {}, 'ocr_mode': None}
+
+
+def run_ocr_stage(image, options, seed_signatures=None, on_event=None, cancel_event=None, deadline=None):
+    """OCR stage: matnli hududlar, tiling, cascade yoki to'liq OCR -> (variant_texts, ocr_info).
+
+    ``on_event`` berilsa 'preprocessing' xulosasi va har bir variant
+    (cascade'da har bir qadam) matni 'ocr_text' hodisasi sifatida yuboriladi.
+    ``deadline`` bo'yicha to'liq OCR byudjetga sig'masa, qadamlar cascade
+    tartibida (eng foydali variant/PSM avval) byudjet tugaguncha bajariladi.
+    """
+    # Ультра-продвинутая предобработка + извлечение текста.
+    # Варианты создаются лениво и освобождаются после OCR.
+    ocr_mode = 'cascade' if seed_signatures else options['ocr_mode']
+    memory_budget_mb = options['memory_budget_mb']
+    tiling = options.get('tiling', 'off')
+    # Порядок вариантов сохраняется как в PREPROCESSING_VARIANTS, профиль только фильтрует
+    selected_variants = options.get('variants') or PREPROCESSING_VARIANT_NAMES
+    variant_names = [name for name in PREPROCESSING_VARIANT_NAMES if name in selected_variants]
+    
+    # Поиск текстовых областей: дальше варианты и OCR работают только по вырезкам
+    ocr_sources = [image]
+    region_info = None
+    jobs = build_ocr_jobs(None if options.get('easyocr', True) else False, options.get('tesseract_configs'))
+    text_regions = options.get('text_regions', 'off')
+    if text_regions == 'easyocr' and not model_registry.available('easyocr'):
+        text_regions = 'morphology'
+    if text_regions != 'off':
+        regions = detect_text_regions(image, text_regions)
+        region_pixels = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        region_info = {
+            'method': text_regions,
+            'regions': len(regions),
+            'pixel_fraction': round(region_pixels / float(image.shape[0] * image.shape[1]), 3)
+        }
+        if regions:
+            # Все области в одном изображении: один вызов Tesseract на вариант × config,
+            # EasyOCR только распознаёт уже найденные области
+            composed, region_info['layout'], relative_boxes = compose_text_regions(image, regions)
+            ocr_sources = [composed]
+            tiling = 'off'
+            jobs = [(engine, relative_boxes if engine == 'easyocr' else config) for engine, config in jobs]
+        print(f"Текстовые области ({text_regions}): {len(regions)}, {region_info['pixel_fraction']:.0%} пикселей")
+    
+    if len(ocr_sources) == 1 and plan_tiles(image.shape, tiling):
+        # Большой лист: режем на тайлы, а 2× увеличение только умножает пиксели
+        if 'upscale_2x' in variant_names:
+            variant_names.remove('upscale_2x')
+        print(f"Крупноформатный скан {image.shape[1]}×{image.shape[0]}: OCR по {len(plan_tiles(image.shape, tiling))} тайлам")
+    print(f"OCR ({ocr_mode}): {len(variant_names)} вариантов × {len(jobs)} движков, executor={OCR_EXECUTOR} ({OCR_MAX_WORKERS}), бюджет {memory_budget_mb} МБ")
+    patience = options['cascade_patience']
+    confidence_target = options['cascade_confidence']
+    step_count = len(ocr_sources) * len(variant_names) * len(jobs)
+    full_ocr_mp = len(jobs) * sum(
+        _megapixels(source) * VARIANT_PIXEL_SCALE.get(name, 1.0) for source in ocr_sources for name in variant_names
+    )
+    if (ocr_mode == 'full' and deadline is not None
+            and not deadline.allows(stage_time_stats.estimate('ocr_step', full_ocr_mp))):
+        # To'liq OCR sig'maydi: hamma qadam, lekin foydalisi avval va deadline'da to'xtab
+        ocr_mode = 'cascade'
+        patience = step_count + 1
+        confidence_target = 0
+        print(f"Deadline: полный OCR (~{stage_time_stats.estimate('ocr_step', full_ocr_mp):.1f} с) не помещается, порядок cascade")
+    emit = on_event or (lambda event, data, stage_ms=None: None)
+    emit('preprocessing', {
+        'image_size': [image.shape[1], image.shape[0]],
+        'ocr_mode': ocr_mode,
+        'variants': variant_names,
+        'engines': sorted({engine for engine, _ in jobs}),
+        'ocr_jobs': len(jobs),
+        'sources': len(ocr_sources),
+        'tiles': len(plan_tiles(image.shape, tiling) or []) if len(ocr_sources) == 1 else 0,
+        'text_regions': region_info,
+    })
+    if ocr_mode == 'cascade':
+        variant_texts, ocr_info = cascade_extract_text(
+            ocr_sources if len(ocr_sources) > 1 else ocr_sources[0],
+            variant_names=variant_names,
+            patience=patience,
+            confidence_target=confidence_target,
+            memory_budget_mb=memory_budget_mb,
+            seed_signatures=seed_signatures,
+            tiling=tiling,
+            jobs=jobs,
+            on_step=lambda vi, ji, text: emit('ocr_text', {
+                'variant': variant_names[vi], 'engine': jobs[ji][0], 'config': jobs[ji][1] if jobs[ji][0] != 'easyocr' else None, 'text': text
+            }),
+            cancel_event=cancel_event,
+            deadline=deadline
+        )
+        print(f"Cascade: {ocr_info['steps_run']}/{ocr_info['steps_total']} шагов, остановка: {ocr_info['stopped_by']}")
+        if ocr_info.get('stopped_by') == 'deadline':
+            deadline.skip('ocr_steps', f"{ocr_info['steps_total'] - ocr_info['steps_run']} из {ocr_info['steps_total']} вариант × config")
+    else:
+        # Порядок: источник (область) × вариант; затем группируем по варианту
+        source_texts = extract_text_from_variants(
+            (variant for source in ocr_sources for _, variant in iter_preprocessed_variants(source, variant_names)),
+            memory_budget_mb=memory_budget_mb,
+            tiling=tiling,
+            jobs=jobs,
+            on_text=lambda index, text: emit('ocr_text', {
+                'variant': variant_names[index % len(variant_names)], 'source': index // len(variant_names), 'text': text
+            }),
+            cancel_event=cancel_event,
+            deadline=deadline
+        )
+        variant_count = len(variant_names)
+        if len(source_texts) < len(ocr_sources) * variant_count:
+            missing = len(ocr_sources) * variant_count - len(source_texts)
+            dropped = ', '.join(variant_names[len(source_texts):]) if len(ocr_sources) == 1 else f"{missing} область × вариант"
+            deadline.skip('ocr_variants', dropped)
+        variant_texts = [
+            '\n'.join(text for text in source_texts[vi::variant_count] if text.strip())
+            for vi in range(variant_count)
+        ]
+        ocr_info = {'mode': 'full', 'steps_run': len(source_texts) * len(jobs)}
+    ocr_info['engines'] = sorted({engine for engine, _ in jobs})
+    ocr_info['tiles'] = len(plan_tiles(image.shape, tiling) or []) if len(ocr_sources) == 1 else 0
+    if region_info:
+        ocr_info['text_regions'] = region_info
+    print(f"Обработано {len(variant_texts)} вариантов изображения")
+    return variant_texts, ocr_info
+
+def run_detection_pipeline(image, options, seed_materials=None, on_event=None, cancel_event=None, deadline=None):
+    """To'liq tahlil pipeline'i: OCR, BLIP, CLIP, YOLO va material extraction.
+
+    OCR va uchta model bir-biriga bog'liq emas, shuning uchun StageGraph
+    ularni parallel bajaradi; material extraction hammasini kutadi. Hali
+    yuklanmagan modellar kutilmaydi: ularning stage'i bo'sh natija beradi va
+    processing_info['models_unavailable']da ko'rsatiladi.
+    ``seed_materials`` (o'xshash sxema natijasi) berilsa OCR cascade
+    rejimida shu (material, o'lcham) juftliklaridan boshlanadi va OCR
+    topmagan seed materiallari natijaga ``near_duplicate`` manbasi bilan
+    qo'shiladi. ``on_event(hodisa, data,
+    stage_ms)`` har bir stage natijasini tayyor bo'lishi bilan oladi;
+    ``cancel_event`` o'rnatilsa qolgan ish to'xtatiladi (PipelineCancelled).
+    ``deadline`` (Deadline) berilsa ixtiyoriy ishlar - qo'shimcha
+    variant/PSM'lar, VQA savollari, YOLO - byudjetga sig'maganda tashlanadi
+    va natija ``partial`` deb belgilanadi.
+    """
+    emit = on_event or (lambda event, data, stage_ms=None: None)
+    seed_signatures = {(m['name'].lower(), m['size']) for m in seed_materials} if seed_materials else None
+    empty_blip = {'caption': '', 'qa_results': [], 'questions': []}
+
+    def budgeted_blip():
+        questions = options.get('blip_questions')
+        questions = list(BLIP_QUESTIONS if questions is None else questions)
+        item_seconds = stage_time_stats.estimate('blip_item')
+        if deadline is not None:
+            if not deadline.allows(item_seconds):
+                deadline.skip('blip', "нет времени даже на caption")
+                return empty_blip
+            fit = max(int(deadline.remaining() / item_seconds) - 1, 0) if item_seconds else len(questions)
+            if fit < len(questions):
+                deadline.skip('blip_questions', f"{len(questions) - fit} из {len(questions)} вопросов")
+                questions = questions[:fit]
+        start = time.perf_counter()
+        blip_results = enhanced_blip_analysis(image, questions=questions, cancel_event=cancel_event)
+        stage_time_stats.record('blip_item', (time.perf_counter() - start) / (1 + len(questions)))
+        return blip_results
+
+    def budgeted_yolo():
+        if deadline is not None and not deadline.allows(stage_time_stats.estimate('yolo')):
+            deadline.skip('yolo', f"~{stage_time_stats.estimate('yolo'):.1f} с не помещается в бюджет")
+            return []
+        start = time.perf_counter()
+        yolo_objects = advanced_yolo_detection(image, options.get('yolo_thresholds'), cancel_event=cancel_event)
+        stage_time_stats.record('yolo', time.perf_counter() - start)
+        return yolo_objects
+
+    def extraction(ocr, blip_results, clip_results, yolo_objects):
+        variant_texts, _ = ocr
+        combined_text = '\n'.join(text for text in variant_texts if text.strip())
+        print(f"Извлечение текста завершено. Длина: {len(combined_text)}")
+        print("Запуск интеллектуального извлечения материалов...")
+        return combined_text, intelligent_material_extraction(
+            combined_text, blip_results, clip_results, yolo_objects
+        )
+
+    # Profil ishlatmaydigan modellar kutilmaydi va degraded hisoblanmaydi
+    profile = options.get('profile', ANALYSIS_PROFILE)
+    models = options.get('models', ['blip', 'clip', 'yolo'])
+    used = (['easyocr'] if options.get('easyocr', True) else []) + list(models)
+    unavailable = [name for name in ('easyocr', 'blip', 'clip', 'yolo') if name in used and not model_registry.available(name)]
+    skipped = {name: f"{profile} profilida o'chirilgan" for name in ('blip', 'clip', 'yolo') if name not in models}
+
+    # Gating: thumbnail CLIP + OCR probe qaysi og'ir stage'lar kerakligini hal qiladi
+    gating = None
+    if options.get('gating', 'off') != 'off':
+        probe = run_gating_probe(image)
+        decision = decide_stages(probe)
+        gate_skipped = dict(decision['skip'])
+        if probe['clip_results'] is not None:
+            # CLIP baribir 224px'da ishlaydi: thumbnail natijasi to'liq stage o'rnini bosadi
+            gate_skipped['clip'] = "thumbnail CLIP natijasi qayta ishlatildi"
+        skipped.update(gate_skipped)
+        if decision['ocr_mode'] and options['ocr_mode'] != decision['ocr_mode']:
+            options = dict(options, ocr_mode=decision['ocr_mode'])
+        gating = {
+            'rule': decision['rule'],
+            'skipped': gate_skipped,
+            'ocr_mode': options['ocr_mode'],
+            'probe': {key: value for key, value in probe.items() if key != 'clip_results'},
+        }
+        print(f"Gating: {decision['rule']} ({probe['ms']} мс), пропуск: {list(gate_skipped)}")
+        emit('gating', gating, probe['ms'])
+        check_cancelled(cancel_event)
+
+    def model_stage(name, fn, empty):
+        if name in unavailable:
+            return lambda: empty
+        if name == 'clip' and gating and 'clip' in gating['skipped']:
+            return lambda: probe['clip_results']
+        if name in skipped:
+            return lambda: empty
+        return fn
+
+    graph = (StageGraph()
+             .add('ocr', lambda: run_ocr_stage(image, options, seed_signatures, on_event, cancel_event, deadline), resource='ocr')
+             .add('blip', model_stage('blip', budgeted_blip, empty_blip), resource='vision')
+             .add('clip', model_stage('clip', lambda: clip_based_classification(image), []), resource='vision')
+             .add('yolo', model_stage('yolo', budgeted_yolo, []), resource='vision')
+             .add('extraction', extraction, inputs=('ocr', 'blip', 'clip', 'yolo')))
+    def stage_done(name, result, stage_ms):
+        if name == 'ocr':
+            variant_texts, ocr_info = result
+            emit('ocr', {'ocr': ocr_info, 'text_length': sum(len(text) for text in variant_texts)}, stage_ms)
+        elif name == 'extraction':
+            materials, is_kolodets_scheme = result[1]
+            emit('extraction', {'total_materials': len(materials), 'is_kolodets_scheme': is_kolodets_scheme}, stage_ms)
+        else:
+            note = "model hali yuklanmagan" if name in unavailable else skipped.get(name)
+            emit(name, {'results': result, 'skipped': note}, stage_ms)
+
+    results, stage_timings = graph.run(parallel=PIPELINE_CONCURRENCY == 'on', on_done=stage_done, cancel_event=cancel_event)
+    print(f"Этапы (мс): {stage_timings}")
+    if unavailable:
+        print(f"Модели ещё не готовы, пропущены: {unavailable}")
+
+    variant_texts, ocr_info = results['ocr']
+    blip_results = results['blip']
+    clip_results = results['clip']
+    yolo_objects = results['yolo']
+    combined_text, (materials, is_kolodets_scheme) = results['extraction']
     
-    unique_materials = []
-    for materials_group in grouped.values():
-        if len(materials_group) == 1:
-            unique_materials.append(materials_group[0])
-        else:
-            # Merge similar materials
-            best_material = max(materials_group, key=lambda x: x['confidence'])
-            total_quantity = sum(m['quantity'] for m in materials_group)
-            
-            best_material['quantity'] = total_quantity
-            best_material['confidence'] = min(best_material['confidence'] + 0.1, 1.0)
-            best_material['sources'] = list(set(m.get('source', 'unknown') for m in materials_group))
-            
-            unique_materials.append(best_material)
+    # Cascade erta to'xtagan: o'xshash sxemada bor, lekin bu safar o'qilmagan materiallar saqlanadi
+    seeded_materials = []
+    if seed_materials:
+        found = {(m['name'].lower(), m['size']) for m in materials}
+        seeded_materials = [
+            dict({key: value for key, value in m.items() if key != 'sources'}, source='near_duplicate')
+            for m in seed_materials if (m['name'].lower(), m['size']) not in found
+        ]
+        materials = materials + seeded_materials
     
-    # Sort by confidence and relevance
-    unique_materials.sort(key=lambda x: (x['confidence'], x['quantity']), reverse=True)
+    # Расчет общей уверенности
+    overall_confidence = calculate_overall_confidence(materials, combined_text, blip_results, clip_results)
     
-    return unique_materials
+    # Генерация рекомендаций
+    recommendations = generate_recommendations(materials, is_kolodets_scheme, overall_confidence)
+    
+    print(f"Обнаружение завершено! Найдено {len(materials)} материалов с уверенностью {overall_confidence:.1%}")
+    deadline_info = deadline.info() if deadline is not None else None
+    if deadline_info and deadline_info['partial']:
+        print(f"Частичный результат за {deadline_info['elapsed_ms']} мс: {[item['item'] for item in deadline_info['skipped']]}")
+    
+    return {
+        'success': True,
+        'partial': bool(deadline_info and deadline_info['partial']),
+        'materials': materials,
+        'is_kolodets_scheme': is_kolodets_scheme,
+        'overall_confidence': overall_confidence,
+        'recommendations': recommendations,
+        'analysis_results': {
+            'detected_text': combined_text,
+            'blip_analysis': blip_results,
+            'clip_classification': clip_results,
+            'yolo_objects': yolo_objects,
+            'total_materials': len(materials),
+            'processing_info': {
+                'profile': {
+                    'name': profile,
+                    'variants': len(options.get('variants') or PREPROCESSING_VARIANT_NAMES),
+                    'tesseract_configs': len(options.get('tesseract_configs') or TESSERACT_CONFIGS),
+                    'models': [name for name in used if name not in skipped and name not in unavailable],
+                    'blip_questions': len(options.get('blip_questions', BLIP_QUESTIONS)),
+                    'yolo_thresholds': options.get('yolo_thresholds', YOLO_CONF_THRESHOLDS),
+                },
+                'processed_images': len(variant_texts),
+                'ocr': ocr_info,
+                'stages_ms': stage_timings,
+                'models_unavailable': unavailable,
+                'gating': gating,
+                'deadline': deadline_info,
+                'seeded_materials': len(seeded_materials),
+                'text_length': len(combined_text),
+                'blip_caption': blip_results.get('caption', ''),
+                'clip_top_class': clip_results[0]['label'] if clip_results else 'unknown',
+                'yolo_detections': len(yolo_objects)
+            }
+        }
+    }
+
+def get_request_deadline(default=None):
+    """So'rovdagi ``time_budget_s`` (yoki default) bo'yicha Deadline; 0 - byudjetsiz"""
+    seconds = parse_number_option('time_budget_s', get_request_option(
+        'time_budget_s', PIPELINE_TIME_BUDGET_S if default is None else default), float, 0.0)
+    return Deadline(seconds) if seconds > 0 else None
+
+def get_cache_options():
+    """So'rovdan kesh sozlamalari: cache=use (по умолчанию) | refresh | bypass"""
+    return {
+        'cache': parse_choice_option('cache', get_request_option('cache', 'use'), CACHE_MODES),
+        'near_duplicate': parse_choice_option(
+            'near_duplicate', get_request_option('near_duplicate', NEAR_DUPLICATE_MODE), NEAR_DUPLICATE_MODES),
+        'near_duplicate_similarity': parse_number_option(
+            'near_duplicate_similarity', get_request_option('near_duplicate_similarity', NEAR_DUPLICATE_SIMILARITY),
+            float, 0.0, 1.0),
+    }
+
+def benchmark_analysis_profiles(images, profiles=None, repeat=1):
+    """Profillar bo'yicha kechikish va recall (exhaustive natijasiga nisbatan).
+
+    Recall - exhaustive topgan (material, o'lcham) juftliklarining profil
+    ham topgan ulushi. Kesh ishlatilmaydi; modellar oldindan yuklanadi.
+    """
+    profiles = profiles or list(ANALYSIS_PROFILES)
+    model_registry.warm_up(wait=True)
+    signatures = lambda result: {(m['name'].lower(), m['size']) for m in result['materials']}
+    reference = [signatures(run_detection_pipeline(image, build_detection_options('exhaustive'))) for image in images]
+
+    report = {}
+    for name in profiles:
+        options = build_detection_options(name)
+        timings = []
+        recalls = []
+        found = []
+        for image, expected in zip(images, reference):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = run_detection_pipeline(image, options)
+                timings.append((time.perf_counter() - start) * 1000)
+            got = signatures(result)
+            recalls.append(len(got & expected) / len(expected) if expected else 1.0)
+            found.append(len(got))
+        timings.sort()
+        report[name] = {
+            'mean_ms': round(sum(timings) / len(timings), 1),
+            'p50_ms': round(timings[len(timings) // 2], 1),
+            'max_ms': round(timings[-1], 1),
+            'recall': round(sum(recalls) / len(recalls), 3),
+            'materials': round(sum(found) / len(found), 1),
+        }
+    return report
+
+def format_profile_benchmark(report):
+    """benchmark_analysis_profiles natijasi jadval ko'rinishida"""
+    lines = ['| profile | mean ms | p50 ms | max ms | recall | materials |', '|---|---|---|---|---|---|']
+    for name, row in report.items():
+        lines.append(f"| {name} | {row['mean_ms']} | {row['p50_ms']} | {row['max_ms']} | {row['recall']:.0%} | {row['materials']} |")
+    return '\n'.join(lines)
+
+def detect_materials_in_image(image, options, cache_options, on_event=None, cancel_event=None, deadline=None):
+    """Kesh, near-duplicate va pipeline: natija dict'i (request kontekstisiz, job'lar uchun ham)"""
+    cache_mode = cache_options['cache']
+    near_duplicate_mode = cache_options['near_duplicate']
+    cache_key = result_cache_key(image, options)
+    seed_materials = None
+    seed_info = None
+    if cache_mode == 'use':
+        cached, tier = result_cache.get(cache_key)
+        if cached is not None:
+            print(f"Результат найден в кэше ({tier})")
+            cached['analysis_results']['processing_info']['cache'] = {'key': cache_key, 'status': f'hit_{tier}'}
+            return cached
+        
+        # Почти-дубликат (пережатое/другое разрешение фото той же схемы)
+        if near_duplicate_mode in ('return', 'seed'):
+            similarity = cache_options['near_duplicate_similarity']
+            similar, similar_info = find_near_duplicate(image, options, exclude_key=cache_key, similarity=similarity)
+            if similar is not None and near_duplicate_mode == 'return':
+                print(f"Найден почти-дубликат (сходство {similar_info['similarity']:.0%})")
+                similar['analysis_results']['processing_info']['cache'] = similar_info
+                return similar
+            if similar is not None:
+                seed_materials = similar.get('materials', [])
+                seed_info = similar_info
+    
+    result = run_detection_pipeline(image, options, seed_materials=seed_materials,
+                                    on_event=on_event, cancel_event=cancel_event, deadline=deadline)
+    degraded = bool(result['analysis_results']['processing_info']['models_unavailable']) or result['partial']
+    if cache_mode != 'bypass' and not degraded and seed_info is None:
+        # Modellarsiz, deadline tufayli qisqartirilgan yoki seed'dan erta to'xtagan natija
+        # keshga yozilmaydi: kalitdagi sozlamalar to'liq tahlilni anglatadi
+        result_cache.put(cache_key, result)
+        remember_near_duplicate(image, options, cache_key)
+    result['analysis_results']['processing_info']['cache'] = {
+        'key': cache_key,
+        'status': 'miss' if cache_mode == 'use' else cache_mode
+    }
+    if seed_info:
+        result['analysis_results']['processing_info']['cache']['seeded_from'] = seed_info
+    return result
+
+class AnalysisSession:
+    """Bitta rasm tahlili: dekodlangan rasm, pipeline natijasi va hosilaviy tahlillar.
+
+    Natija (OCR matni, BLIP/CLIP/YOLO chiqishlari, materiallar) bir marta
+    hisoblanadi va faqat u to'liq bo'lmasa (partial yoki model yetishmagan)
+    yoki kesh chetlab o'tilsa qayta ishlanadi. Kolodets tahlili kabi
+    hosilaviy tahlillar ``derive`` bilan shu natija ustida bir marta quriladi.
+    """
+
+    def __init__(self, session_id, image, options):
+        self.id = session_id
+        self.image = image
+        self.options = options
+        self.result = None
+        self.derived = {}
+        self.created = self.last_used = time.time()
+        # Hozir pipeline'ni ishlatayotgan so'rovlar soni: bunday sessiya o'chirilmaydi
+        self.active = 0
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+
+    def is_complete(self):
+        return (self.result is not None and not self.result.get('partial')
+                and not self.result['analysis_results']['processing_info'].get('models_unavailable'))
+
+    def detection(self, cache_options, **kwargs):
+        """Pipeline natijasi; ``kwargs`` detect_materials_in_image'ga (on_event, cancel_event, deadline).
+
+        Bir sessiyada pipeline bir vaqtda bitta marta ishlaydi (``_compute_lock``);
+        ``_lock`` faqat natijani almashtirish uchun olinadi, shuning uchun
+        ``derive`` va ``summary`` pipeline tugashini kutmaydi. Saqlangan natija
+        qayta berilsa kesh holati 'session_hit' bo'lgan sayoz nusxa qaytadi.
+        """
+        with self._lock:
+            self.active += 1
+        try:
+            with self._compute_lock:
+                with self._lock:
+                    reuse = self.is_complete() and cache_options['cache'] == 'use'
+                    result = self.result
+                if not reuse:
+                    result = detect_materials_in_image(self.image, self.options, cache_options, **kwargs)
+                    with self._lock:
+                        self.result = result
+                        self.derived = {}
+                    return result
+        finally:
+            with self._lock:
+                self.active -= 1
+        processing_info = dict(result['analysis_results']['processing_info'],
+                               cache={'key': self.id, 'status': 'session_hit'})
+        return dict(result, analysis_results=dict(result['analysis_results'], processing_info=processing_info))
+
+    def derive(self, name, fn):
+        """``fn(natija)`` ning eslab qolingan qiymati"""
+        with self._lock:
+            if name not in self.derived:
+                self.derived[name] = fn(self.result)
+            return self.derived[name]
+
+    def summary(self):
+        result = self.result or {}
+        return {
+            'session_id': self.id,
+            'created': self.created,
+            'last_used': self.last_used,
+            'image_size': [self.image.shape[1], self.image.shape[0]],
+            'profile': self.options.get('profile'),
+            'analysed': self.result is not None,
+            'partial': bool(result.get('partial')),
+            'total_materials': len(result.get('materials', [])),
+            'derived': sorted(self.derived),
+        }
+
+
+class AnalysisSessionStore:
+    """Rasm (piksel'lar + sozlamalar) bo'yicha kalitlangan sessiyalar.
+
+    Sessiya id'si result_cache_key bilan bir xil, shuning uchun o'sha rasmni
+    qayta yuklash o'sha sessiyaga tushadi. Sessiyalar ``ttl`` soniya
+    ishlatilmasa yoki soni/rasmlar hajmi chegaradan oshsa (eng eskisi)
+    o'chiriladi. Hozir ochilayotgan/so'ralgan sessiya va pipeline'i
+    ishlayotgan (``active``) sessiyalar o'chirilmaydi: ular uchun chegara
+    vaqtincha oshib ketishi mumkin.
+    """
+
+    def __init__(self, max_sessions, ttl, memory_bytes):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0, 'expired': 0}
+
+    def _purge(self, keep=None):
+        """Muddati o'tgan va chegaradan ortiq (eng eskisi) sessiyalarni o'chirish.
+
+        ``keep`` (hozir ochilgan/so'ralgan sessiya) son va hajm chegarasi uchun,
+        ishlayotgan sessiyalar esa umuman o'chirilmaydi.
+        """
+        now = time.time()
+        expired = [sid for sid, session in self._sessions.items()
+                   if now - session.last_used > self.ttl and not session.active]
+        for sid in expired:
+            del self._sessions[sid]
+        self.stats['expired'] += len(expired)
+        count = len(self._sessions)
+        image_bytes = sum(session.image.nbytes for session in self._sessions.values())
+        for sid, session in list(self._sessions.items()):
+            if count <= self.max_sessions and image_bytes <= self.memory_bytes:
+                break
+            if sid == keep or session.active:
+                continue
+            del self._sessions[sid]
+            count -= 1
+            image_bytes -= session.image.nbytes
+            self.stats['evicted'] += 1
+
+    def open(self, image, options):
+        """Shu rasm va sozlamalar uchun mavjud sessiya yoki yangisi"""
+        session_id = result_cache_key(image, options)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = AnalysisSession(session_id, image, options)
+                self.stats['created'] += 1
+            else:
+                self.stats['reused'] += 1
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            self._purge(keep=session_id)
+            return session
+
+    def get(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+            self._purge(keep=session_id)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+            return session
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def info(self):
+        with self._lock:
+            image_bytes = sum(session.image.nbytes for session in self._sessions.values())
+            return dict(self.stats, current=len(self._sessions), image_mb=round(image_bytes / 1024 / 1024, 1),
+                        ttl_s=self.ttl, max_sessions=self.max_sessions)
+
+
+analysis_sessions = AnalysisSessionStore(ANALYSIS_SESSION_MAX, ANALYSIS_SESSION_TTL_SECONDS,
+                                         ANALYSIS_SESSION_MEMORY_MB * 1024 * 1024)
+
+def detect_materials_in_session(session, cache_options, **kwargs):
+    """Sessiya natijasi + session_id (javob uchun nusxa)"""
+    return dict(session.detection(cache_options, **kwargs), session_id=session.id)
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Sessiya holati; ``result=true`` bo'lsa saqlangan natija bilan"""
+    session = analysis_sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Sessiya topilmadi yoki muddati o\'tgan'}), 404
+    data = dict(session.summary(), success=True)
+    if str(request.args.get('result', 'false')).lower() in ('1', 'true', 'yes') and session.result is not None:
+        data['result'] = session.result
+        data['derived'] = session.derived
+    return jsonify(data)
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not analysis_sessions.remove(session_id):
+        return jsonify({'success': False, 'error': 'Sessiya topilmadi'}), 404
+    return jsonify({'success': True, 'session_id': session_id})
 
 @app.route('/detect_materials', methods=['POST'])
 def detect_materials():
     try:
         print("Запуск ультра-продвинутого определения материалов...")
+        deadline = get_request_deadline()
         
         # Получение изображения
-        image = None
-        
-        # Проверяем тип контента
-        content_type = request.content_type or ''
-        print(f"Content-Type: {content_type}")
-        
-        if 'multipart/form-data' in content_type and 'file' in request.files:
-            print("Обработка multipart/form-data файла...")
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'success': False, 'error': 'Файл не выбран'}), 400
-            image_bytes = file.read()
-            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
-            
-        elif request.is_json:
-            print("Обработка JSON запроса...")
-            if 'image_url' in request.json:
-                image_url = request.json['image_url']
-                response = requests.get(image_url)
-                image = Image.open(BytesIO(response.content))
-                image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            elif 'image_base64' in request.json:
-                image_data = base64.b64decode(request.json['image_base64'])
-                image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
-        else:
-            return jsonify({'success': False, 'error': 'Неподдерживаемый тип контента'}), 400
-
-        if image is None:
-            return jsonify({'success': False, 'error': 'Не удалось загрузить изображение'}), 400
+        image, error_response = load_request_image()
+        if error_response:
+            return error_response
         
         print("Изображение успешно загружено")
         
-        # Ультра-продвинутая предобработка
-        processed_images = ultra_advanced_preprocessing(image)
-        print(f"Создано {len(processed_images)} обработанных версий")
-        
-        # Извлечение текста из всех обработанных изображений
-        all_texts = []
-        for i, proc_img in enumerate(processed_images):
-            print(f"Обработка варианта изображения {i+1}/{len(processed_images)}")
-            text = extract_text_with_all_engines(proc_img)
-            if text.strip():
-                all_texts.append(text)
-        
-        combined_text = '\n'.join(all_texts)
-        print(f"Извлечение текста завершено. Длина: {len(combined_text)}")
-        
-        # Улучшенный анализ BLIP
-        print("Запуск улучшенного анализа BLIP...")
-        blip_results = enhanced_blip_analysis(image)
-        
-        # Классификация на основе CLIP
-        print("Запуск классификации CLIP...")
-        clip_results = clip_based_classification(image)
-        
-        # Продвинутое обнаружение YOLO
-        print("Запуск продвинутого обнаружения YOLO...")
-        yolo_objects = advanced_yolo_detection(image)
-        
-        # Интеллектуальное извлечение материалов
-        print("Запуск интеллектуального извлечения материалов...")
-        materials, is_kolodets_scheme = intelligent_material_extraction(
-            combined_text, blip_results, clip_results, yolo_objects
-        )
-        
-        # Расчет общей уверенности
-        overall_confidence = calculate_overall_confidence(materials, combined_text, blip_results, clip_results)
-        
-        # Генерация рекомендаций
-        recommendations = generate_recommendations(materials, is_kolodets_scheme, overall_confidence)
-        
-        print(f"Обнаружение завершено! Найдено {len(materials)} материалов с уверенностью {overall_confidence:.1%}")
-        
-        return jsonify({
-            'success': True,
-            'materials': materials,
-            'is_kolodets_scheme': is_kolodets_scheme,
-            'overall_confidence': overall_confidence,
-            'recommendations': recommendations,
-            'analysis_results': {
-                'detected_text': combined_text,
-                'blip_analysis': blip_results,
-                'clip_classification': clip_results,
-                'yolo_objects': yolo_objects,
-                'total_materials': len(materials),
-                'processing_info': {
-                    'processed_images': len(processed_images),
-                    'text_length': len(combined_text),
-                    'blip_caption': blip_results.get('caption', ''),
-                    'clip_top_class': clip_results[0]['label'] if clip_results else 'unknown',
-                    'yolo_detections': len(yolo_objects)
-                }
-            }
-        })
+        session = analysis_sessions.open(image, get_detection_options())
+        return jsonify(detect_materials_in_session(session, get_cache_options(), deadline=deadline))
         
+    except InvalidRequestOption as e:
+        return invalid_request_option(e)
     except Exception as e:
         print(f"Ошибка в определении материалов: {e}")
         return jsonify({
@@ -725,6 +3670,528 @@ def detect_materials():
             'error_type': type(e).__name__
         }), 500
 
+def format_stream_event(event, payload, stream_format):
+    data = json.dumps(payload, ensure_ascii=False, default=str)
+    if stream_format == 'ndjson':
+        return data + '\n'
+    return f"event: {event}\ndata: {data}\n\n"
+
+@app.route('/detect_materials/stream', methods=['POST'])
+def detect_materials_stream():
+    """/detect_materials bilan bir xil kirish, natijalar stage-stage SSE yoki NDJSON bilan.
+
+    Hodisalar: preprocessing, ocr_text (har bir variant), ocr, gating, clip,
+    yolo, blip, extraction, keyin result (yoki error). Har birida stage_ms va
+    so'rov boshidan elapsed_ms bor. Mijoz ulanishni yopsa pipeline qolgan
+    stage'larni boshlamaydi va OCR navbatini bekor qiladi.
+    """
+    deadline = get_request_deadline()
+    image, error_response = load_request_image()
+    if error_response:
+        return error_response
+    stream_format = get_request_option('format', 'sse')
+    session = analysis_sessions.open(image, get_detection_options())
+    cache_options = get_cache_options()
+    started = time.perf_counter()
+    events = queue.Queue()
+    cancel_event = threading.Event()
+
+    def on_event(event, data, stage_ms=None):
+        events.put((event, {
+            'event': event,
+            'stage_ms': stage_ms,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+            'data': data
+        }))
+
+    def worker():
+        try:
+            result = detect_materials_in_session(session, cache_options, on_event=on_event, cancel_event=cancel_event,
+                                                 deadline=deadline)
+            on_event('result', result)
+        except PipelineCancelled:
+            print("Stream yopildi, tahlil to'xtatildi")
+        except Exception as e:
+            print(f"Ошибка в потоковом определении материалов: {e}")
+            on_event('error', {'success': False, 'error': str(e), 'error_type': type(e).__name__})
+        finally:
+            events.put(None)
+
+    def generate():
+        threading.Thread(target=worker, name='stream', daemon=True).start()
+        try:
+            while True:
+                try:
+                    item = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n' if stream_format == 'sse' else '\n'
+                    continue
+                if item is None:
+                    break
+                yield format_stream_event(item[0], item[1], stream_format)
+        finally:
+            # GeneratorExit (mijoz uzildi) yoki oxiri: qolgan ishni to'xtatish
+            cancel_event.set()
+
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/event-stream'
+    return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+class JobQueueFull(RuntimeError):
+    """Navbatda JOB_MAX_PENDING'dan ko'p job bor"""
+
+
+class JobManager:
+    """Fon job'lari: yuborilganda darhol id qaytadi, natija keyinroq olinadi.
+
+    Job'lar HTTP thread'laridan alohida ``workers`` ta thread'da bajariladi.
+    Tugagan job'lar (natija yoki xato bilan) ``retention`` soniya saqlanadi,
+    keyin navbatdagi murojaatda o'chiriladi.
+    """
+
+    def __init__(self, workers=None, retention=None, max_pending=None):
+        self.workers = workers or JOB_WORKERS
+        self.retention = JOB_RETENTION_SECONDS if retention is None else retention
+        self.max_pending = max_pending or JOB_MAX_PENDING
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'done': 0, 'failed': 0, 'cancelled': 0, 'expired': 0}
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        return self._executor
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished'] is not None and now - job['finished'] > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self.stats['expired'] += len(expired)
+
+    def submit(self, fn, *args, kind='detect_materials'):
+        with self._lock:
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Navbat to'la: {pending} ta job kutmoqda")
+            job_id = uuid.uuid4().hex
+            job = {'id': job_id, 'kind': kind, 'status': 'queued', 'created': time.time(),
+                   'started': None, 'finished': None, 'result': None, 'error': None, 'future': None}
+            self._jobs[job_id] = job
+            self.stats['submitted'] += 1
+            job['future'] = self._get_executor().submit(self._run, job, fn, args)
+            return job
+
+    def _run(self, job, fn, args):
+        # Holat va hisoblagichlar faqat _lock ostida o'zgaradi; fn o'zi lock'siz bajariladi
+        with self._lock:
+            job['status'] = 'running'
+            job['started'] = time.time()
+        try:
+            result, error, status = fn(*args), None, 'done'
+        except Exception as e:
+            print(f"Job {job['id']} xatolik: {e}")
+            result, error, status = None, {'error': str(e), 'error_type': type(e).__name__}, 'failed'
+        with self._lock:
+            job['result'] = result
+            job['error'] = error
+            job['status'] = status
+            job['finished'] = time.time()
+            self.stats[status] += 1
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Navbatdagi job'ni bekor qiladi; tugaganini o'chiradi. Ishlayotgan bo'lsa False"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'running':
+                return False
+            if job['status'] == 'queued':
+                if not job['future'].cancel():
+                    return False
+                self.stats['cancelled'] += 1
+            del self._jobs[job_id]
+            return True
+
+    def view(self, job):
+        """Job'ning JSON ko'rinishi (natija faqat tugaganda)"""
+        now = time.time()
+        data = {
+            'job_id': job['id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'created': job['created'],
+            'queued_s': round((job['started'] or now) - job['created'], 2),
+            'running_s': round((job['finished'] or now) - job['started'], 2) if job['started'] else None,
+        }
+        if job['finished'] is not None:
+            data['expires_at'] = job['finished'] + self.retention
+        if job['status'] == 'done':
+            data['result'] = job['result']
+        elif job['status'] == 'failed':
+            data.update(job['error'])
+        return data
+
+    def info(self):
+        with self._lock:
+            statuses = defaultdict(int)
+            for job in self._jobs.values():
+                statuses[job['status']] += 1
+            stats = dict(self.stats)
+        return dict(stats, workers=self.workers, retention_s=self.retention, current=dict(statuses))
+
+
+job_manager = JobManager()
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """/detect_materials bilan bir xil kirish; darhol 202 va job id qaytaradi"""
+    try:
+        image, error_response = load_request_image()
+        if error_response:
+            return error_response
+        # Job'ni mijoz kutmaydi: byudjet faqat aniq berilganda (time_budget_s)
+        session = analysis_sessions.open(image, get_detection_options())
+        job = job_manager.submit(partial(detect_materials_in_session, deadline=get_request_deadline(default=0)),
+                                 session, get_cache_options())
+        print(f"Job {job['id']} navbatga qo'yildi")
+        return jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}"
+        }), 202
+    except JobQueueFull as e:
+        return jsonify({'success': False, 'error': str(e), 'error_type': 'JobQueueFull'}), 503
+    except InvalidRequestOption as e:
+        return invalid_request_option(e)
+    except Exception as e:
+        print(f"Job yaratishda xatolik: {e}")
+        return jsonify({'success': False, 'error': str(e), 'error_type': type(e).__name__}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job holati; tugagan bo'lsa natija bilan"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job topilmadi yoki muddati o\'tgan'}), 404
+    return jsonify(dict(job_manager.view(job), success=job['status'] != 'failed'))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Navbatdagi job'ni bekor qilish yoki tugagan job natijasini o'chirish"""
+    removed = job_manager.cancel(job_id)
+    if removed is None:
+        return jsonify({'success': False, 'error': 'Job topilmadi'}), 404
+    if not removed:
+        return jsonify({'success': False, 'error': 'Job bajarilmoqda, bekor qilib bo\'lmaydi'}), 409
+    return jsonify({'success': True, 'job_id': job_id})
+
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+class BatchTooLarge(ValueError):
+    """To'plamdagi rasmlar soni yoki hajmi chegaradan oshdi (413)"""
+
+
+def expand_zip_archive(data, name='archive.zip', max_total_bytes=None):
+    """ZIP ichidagi rasmlar: [(nom, bytes)], papkalar va rasm bo'lmagan fayllar o'tkaziladi.
+
+    Cheklovlar (rasmlar soni, har bir fayl va umumiy ochilgan hajm -
+    ``max_total_bytes``, default BATCH_MAX_TOTAL_MB) markaziy katalogdagi
+    ``file_size`` bo'yicha hech narsa o'qilmasdan tekshiriladi.
+    """
+    max_total_bytes = BATCH_MAX_TOTAL_MB * 1024 * 1024 if max_total_bytes is None else max_total_bytes
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+            and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)
+        ]
+        if len(members) > BATCH_MAX_IMAGES:
+            raise BatchTooLarge(f"{name}: {len(members)} ta rasm, ko'pi bilan {BATCH_MAX_IMAGES}")
+        for info in members:
+            if info.file_size > BATCH_MAX_FILE_MB * 1024 * 1024:
+                raise BatchTooLarge(f"{name}/{info.filename}: fayl {BATCH_MAX_FILE_MB} МБ dan katta")
+        if sum(info.file_size for info in members) > max_total_bytes:
+            raise BatchTooLarge(f"{name}: ochilgan hajm {BATCH_MAX_TOTAL_MB} МБ dan katta")
+        images = [(f"{name}/{info.filename}", archive.read(info)) for info in members]
+    return sorted(images)
+
+
+def load_request_image_batch():
+    """So'rovdan rasmlar ro'yxati: ([(nom, bytes yoki url)], None) yoki (None, xato javobi).
+
+    multipart: ``files`` (bir nechta) va/yoki ``file``, .zip fayllar ochiladi;
+    application/zip body; JSON: ``images_base64`` yoki ``image_urls`` ro'yxati.
+    Barcha manbalar (fayllar, ZIP ichidagi rasmlar, base64) uchun bitta umumiy
+    BATCH_MAX_TOTAL_MB hisobi yuritiladi; oshsa BatchTooLarge (413).
+    """
+    sources = []
+    limit = BATCH_MAX_TOTAL_MB * 1024 * 1024
+    total = 0
+
+    def add(name, data):
+        nonlocal total
+        total += len(data)
+        if total > limit:
+            raise BatchTooLarge(f"To'plam hajmi {BATCH_MAX_TOTAL_MB} МБ dan katta")
+        sources.append((name, data))
+
+    # base64 4/3 marta katta: body shundan ham oshsa o'qimasdan rad etiladi
+    if (request.content_length or 0) > limit * 4 // 3 + 1024 * 1024:
+        raise BatchTooLarge(f"So'rov hajmi {BATCH_MAX_TOTAL_MB} МБ dan katta")
+    content_type = request.content_type or ''
+    if 'multipart/form-data' in content_type:
+        for file in request.files.getlist('files') + request.files.getlist('file'):
+            if not file.filename:
+                continue
+            data = file.read(limit - total + 1)
+            if len(data) > limit - total:
+                raise BatchTooLarge(f"To'plam hajmi {BATCH_MAX_TOTAL_MB} МБ dan katta")
+            if file.filename.lower().endswith('.zip') or zipfile.is_zipfile(BytesIO(data)):
+                for member_name, member in expand_zip_archive(data, file.filename, limit - total):
+                    add(member_name, member)
+            else:
+                if len(data) > BATCH_MAX_FILE_MB * 1024 * 1024:
+                    raise BatchTooLarge(f"{file.filename}: fayl {BATCH_MAX_FILE_MB} МБ dan katta")
+                add(file.filename, data)
+    elif 'zip' in content_type:
+        for member_name, member in expand_zip_archive(request.get_data(), max_total_bytes=limit):
+            add(member_name, member)
+    elif request.is_json:
+        body = request.get_json(silent=True) or {}
+        for i, data in enumerate(body.get('images_base64') or []):
+            add(f"image_{i}", base64.b64decode(data))
+        sources.extend((url, url) for url in body.get('image_urls') or [])
+    else:
+        return None, (jsonify({'success': False, 'error': 'Неподдерживаемый тип контента'}), 400)
+
+    if not sources:
+        return None, (jsonify({'success': False, 'error': 'Изображения не найдены'}), 400)
+    if len(sources) > BATCH_MAX_IMAGES:
+        return None, (jsonify({'success': False, 'error': f'Слишком много изображений: {len(sources)} > {BATCH_MAX_IMAGES}'}), 413)
+    return sources, None
+
+
+def decode_image_source(source):
+    """bytes yoki URL -> BGR rasm (dekodlab bo'lmasa None).
+
+    URL BATCH_URL_TIMEOUT_S bilan yuklanadi va BATCH_MAX_FILE_MB'dan oshsa
+    oqim uziladi (ValueError).
+    """
+    if isinstance(source, str):
+        limit = BATCH_MAX_FILE_MB * 1024 * 1024
+        with requests.get(source, timeout=BATCH_URL_TIMEOUT_S, stream=True) as response:
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > limit:
+                raise ValueError(f"{source}: fayl {BATCH_MAX_FILE_MB} МБ dan katta")
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                content.extend(chunk)
+                if len(content) > limit:
+                    raise ValueError(f"{source}: fayl {BATCH_MAX_FILE_MB} МБ dan katta")
+        return cv2.cvtColor(np.array(Image.open(BytesIO(bytes(content))).convert('RGB')), cv2.COLOR_RGB2BGR)
+    return cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+
+
+def merge_bill_of_materials(image_results):
+    """Rasmlar bo'yicha umumiy ro'yxat: (nom, o'lcham, birlik) bo'yicha birlashtirish.
+
+    Dublikat deb topilgan rasmlar (``duplicate_of``) hisobga olinmaydi,
+    shuning uchun bir sxemaning ikki surati miqdorni ikki barobar oshirmaydi.
+    """
+    merged = OrderedDict()
+    for entry in image_results:
+        if not entry.get('success') or entry.get('duplicate_of') is not None:
+            continue
+        for material in entry['materials']:
+            key = (material['name'].lower(), material['size'], material['unit'])
+            item = merged.get(key)
+            if item is None:
+                item = merged[key] = {
+                    'name': material['name'],
+                    'size': material['size'],
+                    'unit': material['unit'],
+                    'category': material['category'],
+                    'quantity': 0,
+                    'confidence': 0.0,
+                    'images': [],
+                    'sources': set(),
+                }
+            item['quantity'] += material['quantity']
+            item['confidence'] = max(item['confidence'], material['confidence'])
+            if entry['index'] not in item['images']:
+                item['images'].append(entry['index'])
+            item['sources'].update(material.get('sources') or [material.get('source', 'unknown')])
+    bill = []
+    for item in merged.values():
+        item['sources'] = sorted(item['sources'])
+        bill.append(item)
+    bill.sort(key=lambda x: (x['category'], x['name'].lower(), x['size']))
+    return bill
+
+
+def process_image_batch(sources, options, cache_options, details=False, concurrency=None, deadline=None,
+                        per_image_budget=False):
+    """Rasmlar to'plamini tahlil qilish: har bir rasm natijasi va umumiy material ro'yxati.
+
+    Rasmlar ``concurrency`` tadan bir vaqtda ishlanadi, shuning uchun ularning
+    BLIP/CLIP/YOLO chaqiruvlari model_batchers'da bitta batch'ga tushadi va
+    OCR STAGE_RESOURCE_LIMITS bo'yicha navbatlanadi. Piksel'lari bir xil rasm
+    qayta tahlil qilinmaydi: birinchisining natijasi ishlatiladi va
+    ``duplicate_of`` bilan belgilanadi. pHash bo'yicha o'xshashlik faqat
+    ``near_duplicate`` yoqilganda hisobga olinadi: turli kolodets sxemalari
+    ham bir-biriga juda o'xshaydi. ``deadline`` butun to'plam uchun umumiy
+    (sinxron javob), ``per_image_budget=True`` bo'lsa har bir rasm o'z
+    boshlanishidan shuncha byudjet oladi (job'lar).
+    """
+    concurrency = concurrency or BATCH_CONCURRENCY
+    use_phash = cache_options['near_duplicate'] != 'off'
+    max_distance = int((1.0 - cache_options['near_duplicate_similarity']) * 64)
+    seen = []  # (sha1, phash, index, future)
+    seen_lock = threading.Lock()
+    analysed = set()
+    started = time.perf_counter()
+
+    def analyse(index, name, source):
+        entry = {'index': index, 'name': name, 'duplicate_of': None}
+        image_start = time.perf_counter()
+        try:
+            image = decode_image_source(source)
+            if image is None:
+                raise ValueError('Не удалось загрузить изображение')
+            digest = hashlib.sha1(np.ascontiguousarray(image).data).hexdigest()
+            phash = perceptual_hash(image)
+            own = Future()
+            with seen_lock:
+                original = next((item for item in seen if item[0] == digest
+                                 or (use_phash and hamming_distance(item[1], phash) <= max_distance)), None)
+                if original is None:
+                    seen.append((digest, phash, index, own))
+            if original is not None:
+                # Asl rasm boshqa worker'da allaqachon ishlanmoqda: uning natijasini kutamiz
+                entry['duplicate_of'] = original[2]
+                result = original[3].result()
+            else:
+                try:
+                    if deadline is None:
+                        image_deadline = None
+                    elif per_image_budget:
+                        image_deadline = Deadline(deadline.seconds, deadline.reserve)
+                    else:
+                        image_deadline = deadline.child()
+                    session = analysis_sessions.open(image, options)
+                    result = detect_materials_in_session(session, cache_options, deadline=image_deadline)
+                except Exception as e:
+                    own.set_exception(e)
+                    raise
+                own.set_result(result)
+                analysed.add(index)
+            entry.update({
+                'success': True,
+                'session_id': result['session_id'],
+                'partial': result.get('partial', False),
+                'materials': result['materials'],
+                'is_kolodets_scheme': result['is_kolodets_scheme'],
+                'overall_confidence': result['overall_confidence'],
+                'stages_ms': result['analysis_results']['processing_info'].get('stages_ms'),
+                'cache': result['analysis_results']['processing_info'].get('cache'),
+            })
+            if details:
+                entry['result'] = result
+        except Exception as e:
+            print(f"Batch: {name} xatolik: {e}")
+            entry.update({'success': False, 'materials': [], 'error': str(e), 'error_type': type(e).__name__})
+        entry['ms'] = round((time.perf_counter() - image_start) * 1000, 1)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as executor:
+        futures = [executor.submit(analyse, index, name, source) for index, (name, source) in enumerate(sources)]
+        image_results = [future.result() for future in futures]
+
+    # Worker'lar tartibsiz tugaydi: guruhdagi eng kichik indeksli rasm asl deb belgilanadi
+    groups = defaultdict(list)
+    for entry in image_results:
+        if entry['duplicate_of'] is not None:
+            groups[entry['duplicate_of']].append(entry['index'])
+    for original, duplicates in groups.items():
+        canonical = min([original] + duplicates)
+        for index in [original] + duplicates:
+            image_results[index]['duplicate_of'] = None if index == canonical else canonical
+
+    wall_ms = round((time.perf_counter() - started) * 1000, 1)
+    bill = merge_bill_of_materials(image_results)
+    summary = {
+        'images': len(image_results),
+        'analysed': len(analysed),
+        'duplicates': sum(1 for entry in image_results if entry['duplicate_of'] is not None),
+        'failed': sum(1 for entry in image_results if not entry['success']),
+        'partial': sum(1 for entry in image_results if entry.get('partial')),
+        'bill_items': len(bill),
+        'wall_ms': wall_ms,
+        'sum_image_ms': round(sum(image_results[index]['ms'] for index in analysed), 1),
+        'concurrency': concurrency,
+    }
+    print(f"Batch: {summary['images']} rasm, {summary['duplicates']} dublikat, {summary['failed']} xato, {wall_ms} мс")
+    return {'success': True, 'images': image_results, 'bill_of_materials': bill, 'summary': summary}
+
+@app.route('/detect_materials/batch', methods=['POST'])
+def detect_materials_batch():
+    """Bir nechta rasm yoki ZIP: har bir rasm natijasi + umumiy, dublikatsiz material ro'yxati.
+
+    ``async=true`` bo'lsa to'plam job sifatida navbatga qo'yiladi (202, /jobs/<id>).
+    Vaqt byudjeti bilan sinxron so'rovda rasmlar BATCH_CONCURRENCY'dan ko'p
+    bo'lsa ham job'ga yuboriladi: bitta byudjetni bo'lishgan keyingi rasmlar
+    bo'sh partial natija bilan qaytardi. Job'da ``time_budget_s`` har bir
+    rasm uchun alohida. ``details=true`` bo'lsa to'liq natijalar ham qaytariladi.
+    """
+    try:
+        deadline = get_request_deadline()
+        sources, error_response = load_request_image_batch()
+        if error_response:
+            return error_response
+        print(f"Batch: {len(sources)} ta rasm qabul qilindi")
+        details = str(get_request_option('details', 'false')).lower() in ('1', 'true', 'yes')
+        args = (sources, get_detection_options(), get_cache_options(), details)
+        run_async = str(get_request_option('async', 'false')).lower() in ('1', 'true', 'yes')
+        if run_async or (deadline is not None and len(sources) > BATCH_CONCURRENCY):
+            job = job_manager.submit(partial(process_image_batch, deadline=get_request_deadline(default=0),
+                                             per_image_budget=True),
+                                     *args, kind='detect_materials_batch')
+            return jsonify({
+                'success': True,
+                'job_id': job['id'],
+                'status': job['status'],
+                'images': len(sources),
+                'status_url': f"/jobs/{job['id']}"
+            }), 202
+        return jsonify(process_image_batch(*args, deadline=deadline))
+    except BatchTooLarge as e:
+        return jsonify({'success': False, 'error': str(e), 'error_type': 'BatchTooLarge'}), 413
+    except JobQueueFull as e:
+        return jsonify({'success': False, 'error': str(e), 'error_type': 'JobQueueFull'}), 503
+    except (zipfile.BadZipFile, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e), 'error_type': type(e).__name__}), 400
+    except Exception as e:
+        print(f"Ошибка в пакетном определении материалов: {e}")
+        return jsonify({'success': False, 'error': str(e), 'error_type': type(e).__name__}), 500
+
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Kesh yozuvini (key berilsa) yoki butun keshni o'chirish"""
+    key = (request.get_json(silent=True) or {}).get('key') or request.args.get('key')
+    removed = result_cache.invalidate(key)
+    return jsonify({'success': True, 'removed': removed, 'result_cache': result_cache.info()})
+
 def calculate_overall_confidence(materials, text, blip_results, clip_results):
     """Umumiy ishonchlilik darajasini hisoblash"""
     if not materials:
@@ -796,81 +4263,93 @@ def generate_recommendations(materials, is_kolodets, confidence):
     
     return recommendations
 
+def analyze_kolodets_materials(materials, is_kolodets):
+    """Kolodets sxemasi uchun hosilaviy tahlil: turi, o'lchamlari, materiallar to'liqligi"""
+    # Enhanced kolodets-specific analysis
+    kolodets_analysis = {
+        'scheme_type': 'unknown',
+        'depth_estimate': 'не определена',
+        'diameter_estimate': 'не определен',
+        'material_completeness': 0.0,
+        'construction_feasibility': 'unknown',
+        'estimated_cost': 'не рассчитана'
+    }
+    
+    if is_kolodets:
+        # Determine scheme type
+        if any('канализация' in str(m).lower() for m in materials):
+            kolodets_analysis['scheme_type'] = 'канализационный колодец'
+        elif any('водопровод' in str(m).lower() for m in materials):
+            kolodets_analysis['scheme_type'] = 'водопроводный колодец'
+        elif any('дренаж' in str(m).lower() for m in materials):
+            kolodets_analysis['scheme_type'] = 'дренажный колодец'
+        else:
+            kolodets_analysis['scheme_type'] = 'универсальный колодец'
+        
+        # Estimate dimensions from materials
+        rings = [m for m in materials if 'кольцо' in m['name'].lower()]
+        if rings:
+            ring_sizes = [m['size'] for m in rings if m['size'] != 'Стандарт']
+            if ring_sizes:
+                # Parse ring size (e.g., "10-9" means diameter 10, height 9)
+                for size in ring_sizes:
+                    if '-' in size:
+                        diameter, height = size.split('-')
+                        kolodets_analysis['diameter_estimate'] = f"{diameter}0 см"
+                        total_rings = sum(m['quantity'] for m in rings)
+                        kolodets_analysis['depth_estimate'] = f"{int(height) * total_rings} см"
+                        break
+        
+        # Check material completeness
+        essential_categories = ['concrete_rings', 'concrete_covers', 'bottom_plates', 'pipes', 'manholes']
+        found_categories = set(m['category'] for m in materials)
+        completeness = len(found_categories.intersection(essential_categories)) / len(essential_categories)
+        kolodets_analysis['material_completeness'] = completeness
+        
+        # Construction feasibility
+        if completeness > 0.8:
+            kolodets_analysis['construction_feasibility'] = 'высокая'
+        elif completeness > 0.6:
+            kolodets_analysis['construction_feasibility'] = 'средняя'
+        else:
+            kolodets_analysis['construction_feasibility'] = 'низкая'
+    
+    return kolodets_analysis
+
 @app.route('/analyze_kolodets_scheme', methods=['POST'])
 def analyze_kolodets_scheme():
-    """Специализированный анализ схем колодцев"""
+    """Специализированный анализ схем колодцев.
+
+    ``session_id`` berilsa (oldingi /detect_materials javobidan) rasm qayta
+    yuklanmaydi va pipeline qayta ishlamaydi; aks holda rasm /detect_materials
+    kabi qabul qilinadi va o'sha sessiyaga tushadi.
+    """
     try:
-        # Call the main detection function
-        detection_result = detect_materials()
-        
-        if isinstance(detection_result, tuple):
-            response_data, status_code = detection_result
-            if status_code != 200:
-                return detection_result
-            response_data = response_data.get_json()
+        deadline = get_request_deadline()
+        session_id = get_request_option('session_id')
+        if session_id:
+            session = analysis_sessions.get(session_id)
+            if session is None:
+                return jsonify({'success': False, 'error': 'Sessiya topilmadi yoki muddati o\'tgan'}), 404
         else:
-            response_data = detection_result.get_json()
+            image, error_response = load_request_image()
+            if error_response:
+                return error_response
+            session = analysis_sessions.open(image, get_detection_options())
         
+        response_data = detect_materials_in_session(session, get_cache_options(), deadline=deadline)
         if not response_data.get('success'):
             return jsonify(response_data), 400
         
-        materials = response_data['materials']
-        is_kolodets = response_data['is_kolodets_scheme']
-        
-        # Enhanced kolodets-specific analysis
-        kolodets_analysis = {
-            'scheme_type': 'unknown',
-            'depth_estimate': 'не определена',
-            'diameter_estimate': 'не определен',
-            'material_completeness': 0.0,
-            'construction_feasibility': 'unknown',
-            'estimated_cost': 'не рассчитана'
-        }
-        
-        if is_kolodets:
-            # Determine scheme type
-            if any('канализация' in str(m).lower() for m in materials):
-                kolodets_analysis['scheme_type'] = 'канализационный колодец'
-            elif any('водопровод' in str(m).lower() for m in materials):
-                kolodets_analysis['scheme_type'] = 'водопроводный колодец'
-            elif any('дренаж' in str(m).lower() for m in materials):
-                kolodets_analysis['scheme_type'] = 'дренажный колодец'
-            else:
-                kolodets_analysis['scheme_type'] = 'универсальный колодец'
-            
-            # Estimate dimensions from materials
-            rings = [m for m in materials if 'кольцо' in m['name'].lower()]
-            if rings:
-                ring_sizes = [m['size'] for m in rings if m['size'] != 'Стандарт']
-                if ring_sizes:
-                    # Parse ring size (e.g., "10-9" means diameter 10, height 9)
-                    for size in ring_sizes:
-                        if '-' in size:
-                            diameter, height = size.split('-')
-                            kolodets_analysis['diameter_estimate'] = f"{diameter}0 см"
-                            total_rings = sum(m['quantity'] for m in rings)
-                            kolodets_analysis['depth_estimate'] = f"{int(height) * total_rings} см"
-                            break
-            
-            # Check material completeness
-            essential_categories = ['concrete_rings', 'concrete_covers', 'bottom_plates', 'pipes', 'manholes']
-            found_categories = set(m['category'] for m in materials)
-            completeness = len(found_categories.intersection(essential_categories)) / len(essential_categories)
-            kolodets_analysis['material_completeness'] = completeness
-            
-            # Construction feasibility
-            if completeness > 0.8:
-                kolodets_analysis['construction_feasibility'] = 'высокая'
-            elif completeness > 0.6:
-                kolodets_analysis['construction_feasibility'] = 'средняя'
-            else:
-                kolodets_analysis['construction_feasibility'] = 'низкая'
-        
         # Add kolodets analysis to response
-        response_data['kolodets_analysis'] = kolodets_analysis
+        response_data['kolodets_analysis'] = session.derive(
+            'kolodets', lambda result: analyze_kolodets_materials(result['materials'], result['is_kolodets_scheme'])
+        )
         
         return jsonify(response_data)
         
+    except InvalidRequestOption as e:
+        return invalid_request_option(e)
     except Exception as e:
         print(f"Error in kolodets scheme analysis: {e}")
         return jsonify({
@@ -999,19 +4478,40 @@ def get_installation_notes(material):
     
     return notes
 
+def tesseract_available():
+    """Tesseract binary yoki tesserocr mavjudmi"""
+    return tesserocr is not None or shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
 @app.route('/health', methods=['GET'])
 def health_check():
+    """Server holati: modellar haqiqiy yuklanish holati bilan (yuklanayotganda ham 200)"""
+    models = model_registry.info()
+    statuses = {state['status'] for state in models.values()}
+    if statuses == {'ready'}:
+        status = 'healthy'
+    elif 'failed' in statuses:
+        status = 'degraded'
+    else:
+        status = 'loading'
     return jsonify({
-        'status': 'healthy', 
+        'status': status, 
         'message': 'Ultra-Advanced AI Material Detection API is running',
         'version': '2.0.0',
-        'models_loaded': {
-            'easyocr': True,
-            'tesseract': True,
-            'blip': True,
-            'clip': True,
-            'yolo': True
-        },
+        'models_loaded': dict(
+            {name: state['status'] == 'ready' for name, state in models.items()},
+            tesseract=tesseract_available()
+        ),
+        'models': models,
+        'model_bundle': model_bundle_info(),
+        'model_backends': {name: model_registry.get(name)['backend'] if models[name]['status'] == 'ready' else None
+                           for name in ('blip', 'clip', 'yolo')},
+        'model_batching': {name: batcher.info() for name, batcher in model_batchers.items()},
+        'jobs': job_manager.info(),
+        'analysis_sessions': analysis_sessions.info(),
+        'analysis_profiles': {'default': ANALYSIS_PROFILE, 'available': list(ANALYSIS_PROFILES)},
+        'time_budget': {'default_s': PIPELINE_TIME_BUDGET_S, 'reserve_s': DEADLINE_RESERVE_S,
+                        'estimates_ms': stage_time_stats.info()},
+        'result_cache': dict(result_cache.info(), near_duplicate_entries=len(near_duplicate_index)),
         'specialized_features': {
             'kolodets_detection': True,
             'material_specifications': True,
@@ -1031,15 +4531,299 @@ def supported_materials():
         'total_patterns': sum(len(data['patterns']) for data in KOLODETS_MATERIALS.values())
     })
 
-if __name__ == '__main__':
+def _directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def create_model_bundle(output_dir):
+    """Yuklangan modellarni lokal, mmap qilinadigan to'plamga yozadi.
+
+    BLIP/CLIP - safetensors + processor fayllari; YOLO va EasyOCR
+    og'irliklari nusxalanadi (ular torch pickle formatida, kichik).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'pipeline_version': PIPELINE_VERSION, 'models': {}}
+
+    for model_name, model_id in (('blip', BLIP_MODEL_ID), ('clip', CLIP_MODEL_ID)):
+        runtime = model_registry.get(model_name)
+        target = os.path.join(output_dir, model_name)
+        runtime['processor'].save_pretrained(target)
+        runtime['model'].save_pretrained(target, safe_serialization=True)
+        manifest['models'][model_name] = {'source': model_id, 'format': 'safetensors'}
+
+    yolo_dir = os.path.join(output_dir, 'yolo')
+    os.makedirs(yolo_dir, exist_ok=True)
+    yolo = model_registry.get('yolo')['model']
+    shutil.copy2(getattr(yolo, 'ckpt_path', None) or YOLO_WEIGHTS, os.path.join(yolo_dir, os.path.basename(YOLO_WEIGHTS)))
+    manifest['models']['yolo'] = {'source': YOLO_WEIGHTS, 'format': 'torch'}
+
+    easyocr_dir = os.path.join(output_dir, 'easyocr')
+    os.makedirs(easyocr_dir, exist_ok=True)
+    storage = model_registry.get('easyocr').model_storage_directory
+    for name in os.listdir(storage):
+        if name.endswith('.pth'):
+            shutil.copy2(os.path.join(storage, name), os.path.join(easyocr_dir, name))
+    manifest['models']['easyocr'] = {'source': storage, 'format': 'torch'}
+
+    for model_name, entry in manifest['models'].items():
+        entry['size_mb'] = round(_directory_bytes(os.path.join(output_dir, model_name)) / (1024 * 1024), 1)
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def model_bundle_info(bundle_dir=None):
+    """Faol bundle manifest'i (/health uchun) yoki None"""
+    bundle_dir = bundle_dir or MODEL_BUNDLE_DIR
+    if not bundle_dir:
+        return None
+    try:
+        with open(os.path.join(bundle_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return dict(json.load(f), dir=bundle_dir)
+    except (OSError, ValueError):
+        return {'dir': bundle_dir, 'error': 'manifest.json topilmadi'}
+
+
+def export_onnx_encoder(encoder, path, image_size):
+    """Vision encoder'ni dinamik batch o'qi bilan ONNX'ga eksport qiladi"""
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder.eval(), (dummy,), path,
+            input_names=['pixel_values'], output_names=['embeddings'],
+            dynamic_axes={'pixel_values': {0: 'batch'}, 'embeddings': {0: 'batch'}},
+            opset_version=17, do_constant_folding=True
+        )
+
+
+def quantize_onnx_model(source_path, target_path):
+    """ONNX modelini dynamic int8 ga o'tkazadi, metadata (YOLO class nomlari) saqlanadi"""
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source_path, target_path, weight_type=QuantType.QInt8)
+    source = onnx.load(source_path)
+    target = onnx.load(target_path)
+    if source.metadata_props and not target.metadata_props:
+        onnx.helper.set_model_props(target, {prop.key: prop.value for prop in source.metadata_props})
+        onnx.save(target, target_path)
+
+
+def export_models(model_names=('blip', 'clip', 'yolo'), int8=True, export_dir=None):
+    """Offline eksport: <export_dir>/<model>.onnx va (int8=True bo'lsa) <model>_int8.onnx"""
+    export_dir = export_dir or MODEL_EXPORT_DIR
+    os.makedirs(export_dir, exist_ok=True)
+    exported = {}
+    for model_name in model_names:
+        path = model_artifact_path(model_name, 'onnx', export_dir)
+        start = time.perf_counter()
+        if model_name == 'clip':
+            clip_model = model_registry.get('clip')['model']
+            export_onnx_encoder(ClipVisionEncoder(clip_model), path, clip_model.config.vision_config.image_size)
+        elif model_name == 'blip':
+            blip_model = model_registry.get('blip')['model']
+            export_onnx_encoder(BlipVisionEncoder(blip_model), path, blip_model.config.vision_config.image_size)
+        elif model_name == 'yolo':
+            shutil.move(model_registry.get('yolo')['model'].export(format='onnx', imgsz=640, opset=17), path)
+        else:
+            raise ValueError(f"Noma'lum model: {model_name}")
+        exported[model_name] = {'onnx': path}
+
+        if int8:
+            int8_path = model_artifact_path(model_name, 'onnx_int8', export_dir)
+            quantize_onnx_model(path, int8_path)
+            exported[model_name]['onnx_int8'] = int8_path
+        exported[model_name]['seconds'] = round(time.perf_counter() - start, 1)
+        print(f"✅ {model_name}: {exported[model_name]}")
+    return exported
+
+
+def _best_of(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def _clip_agreement(reference, candidate):
+    top1 = sum(1 for a, b in zip(reference, candidate) if a and b and a[0]['label'] == b[0]['label'])
+    overlap = [
+        len({c['label'] for c in a} & {c['label'] for c in b}) / max(len(a), 1)
+        for a, b in zip(reference, candidate)
+    ]
+    return {
+        'top1_agreement': round(top1 / max(len(reference), 1), 3),
+        'top5_overlap': round(sum(overlap) / max(len(overlap), 1), 3),
+    }
+
+
+def _blip_agreement(reference, candidate):
+    captions = sum(1 for a, b in zip(reference, candidate) if a['caption'] == b['caption'])
+    answers = [(x, y) for a, b in zip(reference, candidate) for x, y in zip(a['qa_results'], b['qa_results'])]
+    return {
+        'caption_exact': round(captions / max(len(reference), 1), 3),
+        'answer_exact': round(sum(1 for x, y in answers if x == y) / max(len(answers), 1), 3),
+    }
+
+
+def _yolo_agreement(reference, candidate):
+    matched = 0
+    confidence_diffs = []
+    reference_total = sum(len(objects) for objects in reference)
+    candidate_total = sum(len(objects) for objects in candidate)
+    for expected, actual in zip(reference, candidate):
+        if not expected or not actual:
+            continue
+        iou = pairwise_iou([obj['bbox'] for obj in expected], [obj['bbox'] for obj in actual])
+        for i, obj in enumerate(expected):
+            same_class = [j for j, other in enumerate(actual) if other['class'] == obj['class']]
+            if not same_class:
+                continue
+            best = max(same_class, key=lambda j: iou[i, j])
+            if iou[i, best] >= 0.5:
+                matched += 1
+                confidence_diffs.append(abs(obj['confidence'] - actual[best]['confidence']))
+    return {
+        'recall': round(matched / reference_total, 3) if reference_total else 1.0,
+        'precision': round(matched / candidate_total, 3) if candidate_total else 1.0,
+        'mean_confidence_diff': round(sum(confidence_diffs) / len(confidence_diffs), 4) if confidence_diffs else 0.0,
+    }
+
+
+def model_parity_report(images, backends=('torch_int8', 'onnx', 'onnx_int8'), model_names=('blip', 'clip', 'yolo'),
+                        repeat=3, export_dir=None):
+    """Har bir backend'ni eager torch bilan tezlik va natija mosligi bo'yicha solishtirish"""
+    runners = {
+        'blip': (lambda image, runtime: enhanced_blip_analysis(image, runtime=runtime), _blip_agreement),
+        'clip': (lambda image, runtime: clip_based_classification(image, runtime=runtime), _clip_agreement),
+        'yolo': (lambda image, runtime: advanced_yolo_detection(image, detector=runtime['detector']), _yolo_agreement),
+    }
+    report = {'images': len(images), 'repeat': repeat, 'models': {}}
+    for model_name in model_names:
+        run, agreement = runners[model_name]
+        results = {}
+        reference = None
+        reference_ms = None
+        for backend in ('torch',) + tuple(b for b in backends if b != 'torch'):
+            if resolve_model_backend(model_name, backend, export_dir) != backend:
+                results[backend] = {'available': False}
+                continue
+            runtime = build_model_runtime(model_name, backend, model_registry.get(model_name), export_dir)
+            outputs = []
+            total = 0.0
+            for image in images:
+                output, seconds = _best_of(lambda: run(image, runtime), repeat)
+                outputs.append(output)
+                total += seconds
+            entry = {'available': True, 'ms_per_image': round(total / max(len(images), 1) * 1000, 1)}
+            if reference is None:
+                reference, reference_ms = outputs, entry['ms_per_image']
+            else:
+                entry['speedup'] = round(reference_ms / max(entry['ms_per_image'], 1e-9), 2)
+                entry['agreement'] = agreement(reference, outputs)
+            results[backend] = entry
+        report['models'][model_name] = results
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI Material Detection API')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='API serverini ishga tushirish (default)')
+    bench = subparsers.add_parser('benchmark_tesseract', help='Tesseract backend\'larini solishtirish')
+    bench.add_argument('image', help='Sinov uchun rasm fayli')
+    bench.add_argument('--repeat', type=int, default=3)
+    bench_matcher = subparsers.add_parser('benchmark_matcher', help='Material parser\'larini katta OCR matnida solishtirish')
+    bench_matcher.add_argument('--text', help='OCR matni fayli (berilmasa sintetik matn)')
+    bench_matcher.add_argument('--lines', type=int, default=50000)
+    bench_matcher.add_argument('--repeat', type=int, default=3)
+    bundle = subparsers.add_parser('bundle_models', help='Modellarni MODEL_BUNDLE_DIR uchun lokal to\'plamga yozish')
+    bundle.add_argument('--output', default=MODEL_BUNDLE_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'bundle'))
+    export = subparsers.add_parser('export_models', help='BLIP/CLIP/YOLO ni ONNX (va int8) ga eksport qilish')
+    export.add_argument('--models', nargs='+', default=['blip', 'clip', 'yolo'], choices=['blip', 'clip', 'yolo'])
+    export.add_argument('--no-int8', action='store_true', help='int8 kvantlangan nusxalarni yaratmaslik')
+    export.add_argument('--output', help=f'Artefaktlar papkasi (default: {MODEL_EXPORT_DIR})')
+    bench_profiles = subparsers.add_parser('benchmark_profiles', help='Tahlil profillarining kechikishi va recall\'ini solishtirish')
+    bench_profiles.add_argument('images', nargs='+', help='Sinov uchun rasm fayllari')
+    bench_profiles.add_argument('--profiles', nargs='+', choices=list(ANALYSIS_PROFILES))
+    bench_profiles.add_argument('--repeat', type=int, default=1)
+    parity = subparsers.add_parser('model_parity', help='Backend\'larni eager torch bilan solishtirish')
+    parity.add_argument('images', nargs='+', help='Sinov uchun rasm fayllari')
+    parity.add_argument('--backends', nargs='+', default=['torch_int8', 'onnx', 'onnx_int8'], choices=MODEL_BACKEND_CHOICES)
+    parity.add_argument('--models', nargs='+', default=['blip', 'clip', 'yolo'], choices=['blip', 'clip', 'yolo'])
+    parity.add_argument('--output', help=f'Artefaktlar papkasi (default: {MODEL_EXPORT_DIR})')
+    parity.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'bundle_models':
+        manifest = create_model_bundle(args.output)
+        print(json.dumps(manifest, indent=2, ensure_ascii=False))
+        print(f"✅ MODEL_BUNDLE_DIR={args.output} bilan ishga tushiring")
+        return
+
+    if args.command == 'export_models':
+        export_models(args.models, int8=not args.no_int8, export_dir=args.output)
+        return
+
+    if args.command == 'model_parity':
+        images = []
+        for path in args.images:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                print(f"❌ Rasmni o'qib bo'lmadi: {path}")
+                sys.exit(1)
+            images.append(image)
+        report = model_parity_report(images, args.backends, args.models, args.repeat, args.output)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    if args.command == 'benchmark_profiles':
+        images = []
+        for path in args.images:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                print(f"❌ Rasmni o'qib bo'lmadi: {path}")
+                sys.exit(1)
+            images.append(image)
+        report = benchmark_analysis_profiles(images, args.profiles, args.repeat)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        print(format_profile_benchmark(report))
+        return
+
+    if args.command == 'benchmark_matcher':
+        if args.text:
+            with open(args.text, 'r', encoding='utf-8') as f:
+                text = f.read()
+        else:
+            text = synthetic_ocr_dump(args.lines)
+        print(json.dumps(benchmark_material_matcher(text, args.repeat), indent=2, ensure_ascii=False))
+        return
+
+    if args.command == 'benchmark_tesseract':
+        image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"❌ Rasmni o'qib bo'lmadi: {args.image}")
+            sys.exit(1)
+        print(json.dumps(benchmark_tesseract_backends(image, args.repeat), indent=2, ensure_ascii=False))
+        return
+
     print("🚀 Ultra-Advanced AI Material Detection API starting...")
     print("🎯 Specialized for Kolodets (Well) Construction Schemes")
     print("🧠 Enhanced with CLIP, Advanced YOLO, and Intelligent Processing")
+    print(f"🔤 Tesseract backend: {resolve_tesseract_backend()}")
+    
+    # Modellar: server port'ni darhol ochadi, yuklash holati /health'da
+    if MODEL_WARMUP == 'eager':
+        model_registry.warm_up(wait=True)
+    elif MODEL_WARMUP == 'background':
+        model_registry.warm_up()
+    print(f"🧠 Model warm-up: {MODEL_WARMUP}")
     
     # Windows uchun maxsus sozlamalar
-    import sys
     if sys.platform == "win32":
-        import os
         os.system('title Python AI Material Detection API')
     
     try:
@@ -1048,5 +4832,5 @@ if __name__ == '__main__':
         print(f"❌ Server ishga tushirishda xatolik: {e}")
         input("Press Enter to exit...")
 
-
-
+if __name__ == '__main__':
+    main()
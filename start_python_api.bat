@@ -15,7 +15,7 @@ echo 📦 Checking dependencies...
 pip show flask >nul 2>&1
 if %errorlevel% neq 0 (
     echo 📥 Installing dependencies...
-    pip install flask opencv-python pytesseract pillow requests easyocr torch transformers ultralytics numpy
+    pip install -r "%~dp0requirements.txt"
 )
 
 REM Start the API
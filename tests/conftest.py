@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Modul import paytida sozlamalarni o'qiydi: testlar uchun izolyatsiya qilingan muhit
+os.environ.setdefault('OCR_EXECUTOR', 'thread')
+os.environ.setdefault('MODEL_WARMUP', 'lazy')
+os.environ.setdefault('RESULT_CACHE_DIR', tempfile.mkdtemp(prefix='detect_materials_test_'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
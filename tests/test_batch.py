@@ -0,0 +1,106 @@
+import base64
+import io
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+import material_detection_api as api
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_expand_zip_archive_skips_non_images():
+    data = make_zip({'b.png': b'1', 'a/c.jpg': b'2', 'readme.txt': b'x', '__MACOSX/a/._c.jpg': b'y'})
+    assert api.expand_zip_archive(data, 'set.zip') == [('set.zip/a/c.jpg', b'2'), ('set.zip/b.png', b'1')]
+
+
+def test_expand_zip_archive_rejects_too_many_images(monkeypatch):
+    monkeypatch.setattr(api, 'BATCH_MAX_IMAGES', 2)
+    with pytest.raises(api.BatchTooLarge):
+        api.expand_zip_archive(make_zip({f'{i}.png': b'0' for i in range(3)}))
+
+
+def test_expand_zip_archive_rejects_large_member(monkeypatch):
+    monkeypatch.setattr(api, 'BATCH_MAX_FILE_MB', 1)
+    with pytest.raises(api.BatchTooLarge):
+        api.expand_zip_archive(make_zip({'big.png': b'\0' * (1024 * 1024 + 1)}))
+
+
+def test_expand_zip_archive_rejects_total_before_reading(monkeypatch):
+    monkeypatch.setattr(api, 'BATCH_MAX_TOTAL_MB', 1)
+    reads = []
+    monkeypatch.setattr(zipfile.ZipFile, 'read', lambda self, *args: reads.append(args))
+    with pytest.raises(api.BatchTooLarge):
+        api.expand_zip_archive(make_zip({f'{i}.png': b'\0' * 600 * 1024 for i in range(2)}))
+    assert reads == []
+
+
+def test_batch_total_is_shared_across_archives(monkeypatch):
+    monkeypatch.setattr(api, 'BATCH_MAX_TOTAL_MB', 1)
+    archive = make_zip({'s.png': b'\0' * 600 * 1024})
+    client = api.app.test_client()
+    response = client.post('/detect_materials/batch', data={
+        'files': [(io.BytesIO(archive), 'one.zip'), (io.BytesIO(archive), 'two.zip')],
+    }, content_type='multipart/form-data')
+    assert response.status_code == 413
+
+
+def test_batch_total_counts_base64_images(monkeypatch):
+    monkeypatch.setattr(api, 'BATCH_MAX_TOTAL_MB', 1)
+    image = base64.b64encode(b'\0' * 600 * 1024).decode()
+    response = api.app.test_client().post('/detect_materials/batch', json={'images_base64': [image, image]})
+    assert response.status_code == 413
+
+
+def scheme(label):
+    image = np.full((600, 800, 3), 255, dtype=np.uint8)
+    cv2.circle(image, (400, 300), 200, (0, 0, 0), 3)
+    cv2.rectangle(image, (150, 500), (650, 560), (0, 0, 0), 2)
+    cv2.putText(image, label, (170, 545), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def fake_detection(session, cache_options, deadline=None):
+    material = {'name': f"ring-{session.id[:8]}", 'size': None, 'unit': 'шт', 'category': 'rings', 'quantity': 1, 'confidence': 0.9}
+    return {
+        'session_id': session.id, 'partial': False, 'materials': [material], 'is_kolodets_scheme': True,
+        'overall_confidence': 0.9, 'analysis_results': {'processing_info': {}},
+    }
+
+
+def test_similar_distinct_schemes_are_not_deduplicated_by_default(monkeypatch):
+    monkeypatch.setattr(api, 'detect_materials_in_session', fake_detection)
+    first, second = scheme('KC 10-9  2 pcs'), scheme('KC 15-9  1 pcs')
+    decode = lambda data: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    distance = api.hamming_distance(api.perceptual_hash(decode(first)), api.perceptual_hash(decode(second)))
+    cache_options = {'cache': 'bypass', 'near_duplicate': 'off', 'near_duplicate_similarity': 0.9}
+    assert distance <= int((1.0 - cache_options['near_duplicate_similarity']) * 64)
+
+    options = api.build_detection_options('fast')
+    report = api.process_image_batch([('s1.png', first), ('s2.png', second)], options, cache_options)
+
+    assert [entry['duplicate_of'] for entry in report['images']] == [None, None]
+    assert report['summary']['analysed'] == 2
+    assert len(report['bill_of_materials']) == 2
+
+    grouped = api.process_image_batch([('s1.png', first), ('s2.png', second)], options,
+                                      dict(cache_options, near_duplicate='seed'))
+    assert grouped['images'][1]['duplicate_of'] == 0
+
+
+def test_identical_images_are_deduplicated(monkeypatch):
+    monkeypatch.setattr(api, 'detect_materials_in_session', fake_detection)
+    image = scheme('KC 10-9  2 pcs')
+    cache_options = {'cache': 'bypass', 'near_duplicate': 'off', 'near_duplicate_similarity': 0.9}
+    report = api.process_image_batch([('a.png', image), ('b.png', image)], api.build_detection_options('fast'),
+                                     cache_options)
+    assert report['summary']['duplicates'] == 1
+    assert report['bill_of_materials'][0]['quantity'] == 1
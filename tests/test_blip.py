@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import material_detection_api as api
+
+
+def fake_runtime(offset):
+    tokenizer = lambda text: {'input_ids': [101] + [offset + len(word) for word in text.split()] + [102]}
+    return {
+        'model': SimpleNamespace(config=SimpleNamespace(text_config=SimpleNamespace(bos_token_id=30522))),
+        'processor': SimpleNamespace(tokenizer=tokenizer),
+    }
+
+
+def test_group_decode_items_by_prompt_length_and_max_length():
+    items = [('e', (1,), 100), ('e', (1, 2), 80), ('e', (1, 3), 80), ('e', (1, 2, 3), 80), ('e', (1, 4), 100)]
+    assert sorted(api.group_decode_items(items)) == [(80, [1, 2]), (80, [3]), (100, [0]), (100, [4])]
+
+
+def test_blip_question_prompts_are_cached_per_tokenizer():
+    questions = ('what is this', 'how many rings')
+    first, second = fake_runtime(0), fake_runtime(1000)
+    assert api.blip_question_prompts(questions, first) == ((30522, 4, 2, 4), (30522, 3, 4, 5))
+    assert api.blip_question_prompts(questions, second) == ((30522, 1004, 1002, 1004), (30522, 1003, 1004, 1005))
+    assert api.blip_question_prompts(list(questions), first) is api.blip_question_prompts(questions, first)
+
+
+def test_enhanced_blip_analysis_decodes_one_batch_per_group(monkeypatch):
+    runtime = fake_runtime(0)
+    batches = []
+    monkeypatch.setattr(api, 'blip_encode_image', lambda image, runtime=None: 'embeds')
+    monkeypatch.setattr(api, 'blip_decode_items', lambda items, runtime=None: batches.append(items) or
+                        [f"{len(prompt)}:{max_length}" for _, prompt, max_length in items])
+    result = api.enhanced_blip_analysis(np.zeros((8, 8, 3), np.uint8), runtime, ['a b', 'c d', 'e f g'])
+    assert result['caption'] == '1:100'
+    assert result['qa_results'] == ['3:80', '3:80', '4:80']
+    assert sorted(len(batch) for batch in batches) == [1, 1, 2]
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import pytest
+
+import material_detection_api as api
+
+
+def test_deadline_remaining_respects_reserve():
+    deadline = api.Deadline(10, reserve=2)
+    assert 7.5 < deadline.remaining() <= 8
+    assert deadline.allows(5)
+    assert not deadline.allows(9)
+
+
+def test_deadline_child_shares_end_and_records_skips():
+    deadline = api.Deadline(10, reserve=0)
+    child = deadline.child()
+    assert child.end == deadline.end
+    child.skip('yolo', 'budget')
+    info = child.info()
+    assert info['partial'] is True
+    assert info['skipped'] == [{'item': 'yolo', 'reason': 'budget'}]
+    assert deadline.info()['partial'] is False
+
+
+def test_stage_time_stats_defaults_and_ema():
+    stats = api.StageTimeStats(alpha=0.5, defaults={'yolo': 1.0})
+    assert stats.estimate('yolo') == 1.0
+    assert stats.estimate('unknown') == 0.0
+    stats.record('yolo', 2.0)
+    stats.record('yolo', 4.0)
+    assert stats.estimate('yolo') == pytest.approx(3.0)
+    assert stats.info() == {'yolo': 3000.0}
+
+
+def test_stage_time_stats_scales_by_megapixels():
+    stats = api.StageTimeStats(defaults={})
+    stats.record('ocr_step', 0.5, megapixels=0.25)
+    assert stats.estimate('ocr_step') == pytest.approx(2.0)
+    assert stats.estimate('ocr_step', 12) == pytest.approx(24.0)
+
+
+def test_cold_server_runs_ocr_on_large_photo(monkeypatch):
+    monkeypatch.setattr(api, 'stage_time_stats', api.StageTimeStats())
+    monkeypatch.setattr(api, 'get_ocr_executor', lambda: None)
+    monkeypatch.setattr(api, 'run_tesseract', lambda image, config, backend=None: ['КС 10-9 2 шт'])
+    options = api.build_detection_options('exhaustive')
+    options.update({'easyocr': False, 'variants': ['gray', 'clahe'], 'text_regions': 'off', 'tiling': 'off'})
+    image = np.full((3000, 4000, 3), 255, dtype=np.uint8)
+
+    variant_texts, ocr_info = api.run_ocr_stage(image, options, deadline=api.Deadline(50))
+
+    assert ocr_info['steps_run'] >= 1
+    assert any(text.strip() for text in variant_texts)
+    assert 'ocr_step' in api.stage_time_stats.info()
+
+
+def test_cascade_stops_at_deadline_after_first_wave(monkeypatch):
+    monkeypatch.setattr(api, 'stage_time_stats', api.StageTimeStats())
+    monkeypatch.setattr(api, 'get_ocr_executor', lambda: None)
+
+    def slow_tesseract(image, config, backend=None):
+        time.sleep(0.05)
+        return []
+
+    monkeypatch.setattr(api, 'run_tesseract', slow_tesseract)
+    image = np.full((100, 100, 3), 255, dtype=np.uint8)
+    jobs = [('tesseract', config) for config in api.TESSERACT_CONFIGS[:4]]
+
+    _, info = api.cascade_extract_text(image, variant_names=['gray', 'clahe'], jobs=jobs, patience=100,
+                                       confidence_target=0, deadline=api.Deadline(0.12, reserve=0))
+
+    assert info['stopped_by'] == 'deadline'
+    assert 1 <= info['steps_run'] < info['steps_total']
+
+
+def test_broken_pool_fallback_still_runs_first_variant(monkeypatch):
+    class BrokenExecutor:
+        def submit(self, *args, **kwargs):
+            raise api.BrokenProcessPool('pool died')
+
+        def shutdown(self, wait=False, **kwargs):
+            pass
+
+    monkeypatch.setattr(api, 'stage_time_stats', api.StageTimeStats())
+    monkeypatch.setattr(api, 'get_ocr_executor', lambda: BrokenExecutor())
+    monkeypatch.setattr(api, '_reset_ocr_executor', lambda executor: None)
+    monkeypatch.setattr(api, 'run_tesseract', lambda image, config, backend=None: ['КС 10-9'])
+    image = np.full((1000, 1000, 3), 255, dtype=np.uint8)
+
+    texts, info = api.cascade_extract_text(image, variant_names=['gray', 'clahe'], jobs=[('tesseract', '--psm 6')],
+                                           deadline=api.Deadline(0.01, reserve=0))
+
+    assert info['fallback'] == 'pool died' and info['stopped_by'] == 'deadline'
+    assert info['steps_run'] == 1
+    assert 'КС 10-9' in texts[0] and texts[1] == ''
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+import material_detection_api as api
+
+
+def wait_finished(manager, job_id, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        job = manager.get(job_id)
+        if job is None or job['finished'] is not None:
+            return job
+        time.sleep(0.01)
+    pytest.fail('job tugamadi')
+
+
+def test_job_done_and_failed():
+    manager = api.JobManager(workers=2, retention=60, max_pending=10)
+    done = manager.submit(lambda x: {'value': x * 2}, 21)
+    failed = manager.submit(lambda: 1 / 0)
+    assert manager.view(wait_finished(manager, done['id']))['result'] == {'value': 42}
+    view = manager.view(wait_finished(manager, failed['id']))
+    assert view['status'] == 'failed' and view['error_type'] == 'ZeroDivisionError'
+    info = manager.info()
+    assert (info['submitted'], info['done'], info['failed']) == (2, 1, 1)
+    assert info['current'] == {'done': 1, 'failed': 1}
+
+
+def test_queue_full_cancel_and_running_job():
+    manager = api.JobManager(workers=1, retention=60, max_pending=2)
+    release = threading.Event()
+    running = manager.submit(release.wait)
+    queued = manager.submit(lambda: 'x')
+    with pytest.raises(api.JobQueueFull):
+        manager.submit(lambda: 'y')
+    while manager.get(running['id'])['status'] != 'running':
+        time.sleep(0.01)
+    assert manager.cancel(running['id']) is False
+    assert manager.cancel(queued['id']) is True
+    assert manager.get(queued['id']) is None
+    assert manager.cancel('missing') is None
+    release.set()
+    wait_finished(manager, running['id'])
+    assert manager.info()['cancelled'] == 1
+    assert manager.cancel(running['id']) is True
+
+
+def test_finished_jobs_expire_after_retention():
+    manager = api.JobManager(workers=1, retention=0, max_pending=10)
+    job = manager.submit(lambda: 'ok')
+    job['future'].result()
+    time.sleep(0.01)
+    assert manager.get(job['id']) is None
+    assert manager.info()['expired'] == 1
+
+
+def test_stats_are_exact_under_concurrency():
+    manager = api.JobManager(workers=8, retention=60, max_pending=1000)
+    jobs = [manager.submit(lambda i: i, i) for i in range(200)]
+    for job in jobs:
+        job['future'].result()
+    info = manager.info()
+    assert (info['submitted'], info['done']) == (200, 200)
@@ -0,0 +1,51 @@
+import random
+
+import material_detection_api as api
+
+LINES = [
+    'Кольцо КС 15-9 - 4 шт',
+    'кс-20.6 количество: 3',
+    'ЖБИ кольцо 10-9, к-во 2',
+    'бетонное кольцо 1500x900',
+    'Concrete ring 15-9 qty 2',
+    '2 ring 10-6 pieces',
+    'Ø110 труба ПЭ 6 м',
+    'd 160 pipe, 3 pc',
+    'Люк чугунный, крышка колодца 1 комплект',
+    'днище ПН-15 1 дона',
+    'просто текст без материалов',
+    'x',
+    '',
+]
+
+
+def corpus(seed, count=300):
+    rng = random.Random(seed)
+    words = [keyword for data in api.KOLODETS_MATERIALS.values() for keyword in data['keywords']]
+    words += ['шт', 'дона', 'мм', 'ø', 'd', 'количество', 'qty', '-', 'x', 'и', 'схема']
+    numbers = ['1', '2', '10', '15-9', '20.6', '110', '1500x900']
+    lines = list(LINES)
+    for _ in range(count):
+        lines.append(' '.join(rng.choice(words + numbers) for _ in range(rng.randint(1, 7))))
+    return '\n'.join(lines)
+
+
+def test_matcher_matches_reference_parser():
+    for seed in range(3):
+        text = corpus(seed)
+        assert api.extract_materials_from_enhanced_text(text, api.KOLODETS_MATERIALS) == \
+            api._extract_materials_reference(text, api.KOLODETS_MATERIALS)
+
+
+def test_matcher_with_unanchored_pattern_matches_reference():
+    source = {
+        'sizes': {'patterns': [r'(\d+)x(\d+)', r'труба\s*(\d+)'], 'keywords': ['Труба', 'лист'], 'unit': 'м'},
+    }
+    text = '\n'.join(['лист 2x3', '1500x900 мм', 'труба 110 - 5 шт', 'ТРУБА 50', 'пусто'])
+    compiled = api.MaterialMatcher(source).extract(text)
+    assert compiled == api._extract_materials_reference(text, source)
+    assert {material['name'] for material in compiled} >= {'2X3', '1500X900', 'Труба 110', 'Лист'}
+
+
+def test_get_material_matcher_compiles_once():
+    assert api.get_material_matcher(api.KOLODETS_MATERIALS) is api.get_material_matcher(api.KOLODETS_MATERIALS)
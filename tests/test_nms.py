@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import material_detection_api as api
+
+
+def iou(a, b):
+    width = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def reference_nms(boxes, scores, threshold):
+    order = sorted(range(len(boxes)), key=lambda i: -scores[i])
+    keep = []
+    for i in order:
+        if all(iou(boxes[i], boxes[j]) <= threshold for j in keep):
+            keep.append(i)
+    return keep
+
+
+def test_pairwise_iou():
+    boxes = [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30], [0, 0, 0, 0]]
+    expected = [[iou(a, b) for b in boxes] for a in boxes]
+    assert np.allclose(api.pairwise_iou(boxes, boxes), expected)
+    assert api.pairwise_iou([], boxes).shape == (0, 4)
+
+
+def test_nms_indices_empty():
+    assert api.nms_indices(np.zeros((0, 4)), np.zeros(0), 0.5).tolist() == []
+
+
+@pytest.mark.parametrize('threshold', [0.0, 0.3, 0.5, 0.7])
+def test_nms_indices_matches_reference(threshold):
+    rng = np.random.default_rng(int(threshold * 10))
+    for _ in range(20):
+        count = int(rng.integers(1, 40))
+        corners = rng.uniform(0, 100, (count, 2))
+        boxes = np.hstack([corners, corners + rng.uniform(5, 40, (count, 2))])
+        scores = rng.uniform(0, 1, count)
+        assert api.nms_indices(boxes, scores, threshold).tolist() == reference_nms(boxes.tolist(), scores.tolist(), threshold)
+
+
+def test_nms_indices_keeps_first_of_equal_scores():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [50, 50, 60, 60]], dtype=float)
+    assert api.nms_indices(boxes, np.array([0.8, 0.8, 0.1]), 0.5).tolist() == [0, 2]
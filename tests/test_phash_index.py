@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import material_detection_api as api
+
+
+def brute_force(entries, phash, max_distance):
+    return sorted((api.hamming_distance(h, phash), value) for h, value in entries
+                  if api.hamming_distance(h, phash) <= max_distance)
+
+
+def random_near(rng, phash, bits):
+    for bit in rng.sample(range(64), bits):
+        phash ^= 1 << bit
+    return phash
+
+
+@pytest.fixture
+def entries():
+    rng = random.Random(7)
+    base = [rng.getrandbits(64) for _ in range(50)]
+    hashes = base + [random_near(rng, rng.choice(base), rng.randint(0, 14)) for _ in range(450)]
+    return [(phash, (f'key{i}', 'fp')) for i, phash in enumerate(hashes)]
+
+
+@pytest.mark.parametrize('max_distance', [0, 3, 6, 10, 12])
+def test_query_matches_brute_force(entries, max_distance):
+    index = api.PerceptualHashIndex()
+    for phash, value in entries:
+        index.add(phash, value)
+    rng = random.Random(max_distance)
+    for phash, _ in rng.sample(entries, 40):
+        probe = random_near(rng, phash, rng.randint(0, max_distance))
+        assert index.query(probe, max_distance) == brute_force(entries, probe, max_distance)
+
+
+def test_remove_and_compaction_keep_query_exact(entries, tmp_path):
+    path = str(tmp_path / 'phash.tsv')
+    index = api.PerceptualHashIndex(path)
+    for phash, value in entries:
+        index.add(phash, value)
+    removed = {value for _, value in entries[::3]}
+    index.remove(removed)
+    index.remove([('missing', 'fp')])
+    live = [(phash, value) for phash, value in entries if value not in removed]
+    assert len(index) == len(live)
+    reloaded = api.PerceptualHashIndex(path)
+    assert len(reloaded) == len(live)
+    for phash, _ in entries[:60]:
+        assert index.query(phash, 8) == brute_force(live, phash, 8)
+        assert reloaded.query(phash, 8) == brute_force(live, phash, 8)
+
+
+def test_stale_near_duplicate_lookup_is_not_a_miss(monkeypatch, tmp_path):
+    image = api.np.zeros((64, 64, 3), api.np.uint8)
+    image[16:48, 16:48] = 255
+    options = api.build_detection_options('fast')
+    index = api.PerceptualHashIndex()
+    cache = api.ResultCache(4)
+    monkeypatch.setattr(api, 'near_duplicate_index', index)
+    monkeypatch.setattr(api, 'result_cache', cache)
+    api.remember_near_duplicate(image, options, 'evicted-key')
+    assert api.find_near_duplicate(image, options, similarity=0.9) == (None, None)
+    assert cache.info()['misses'] == 0
+    assert len(index) == 0
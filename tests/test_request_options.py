@@ -0,0 +1,72 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+import material_detection_api as api
+
+
+def image_base64():
+    ok, encoded = cv2.imencode('.png', np.full((32, 32, 3), 255, np.uint8))
+    return base64.b64encode(encoded.tobytes()).decode()
+
+
+@pytest.mark.parametrize('value, cast, bounds', [
+    ('abc', float, (0.0, 1.0)),
+    (None, int, (1, 10)),
+    ('nan', float, (0.0, 1.0)),
+    ('1.5', float, (0.0, 1.0)),
+    ('0', int, (1, 10)),
+])
+def test_parse_number_option_rejects(value, cast, bounds):
+    with pytest.raises(api.InvalidRequestOption):
+        api.parse_number_option('x', value, cast, *bounds)
+
+
+def test_parse_number_option_casts_in_range():
+    assert api.parse_number_option('x', '0.5', float, 0.0, 1.0) == 0.5
+    assert api.parse_number_option('x', '10', int, 1, 10) == 10
+
+
+def test_parse_choice_option():
+    assert api.parse_choice_option('cache', 'refresh', api.CACHE_MODES) == 'refresh'
+    with pytest.raises(api.InvalidRequestOption):
+        api.parse_choice_option('cache', 'reuse', api.CACHE_MODES)
+
+
+def test_build_detection_options_rejects_unknown_values():
+    with pytest.raises(api.InvalidRequestOption):
+        api.build_detection_options('balanced', lambda name, default: 'bogus' if name == 'ocr_mode' else default)
+    with pytest.raises(api.InvalidRequestOption):
+        api.build_detection_options('no-such-profile')
+
+
+@pytest.mark.parametrize('query', ['ocr_mode=bogus', 'cache=reuse', 'near_duplicate=yes', 'near_duplicate_similarity=2'])
+def test_detect_materials_answers_400_for_bad_option(monkeypatch, query):
+    monkeypatch.setattr(api, 'run_detection_pipeline', lambda *args, **kwargs: pytest.fail('pipeline ishga tushmasligi kerak'))
+    response = api.app.test_client().post(f'/detect_materials?{query}', json={'image_base64': image_base64()})
+    assert response.status_code == 400
+    assert response.get_json()['error_type'] == 'InvalidRequestOption'
+
+
+def test_build_detection_options_rejects_unknown_tiling():
+    assert api.build_detection_options('fast', lambda name, default: 'off' if name == 'tiling' else default)['tiling'] == 'off'
+    with pytest.raises(api.InvalidRequestOption):
+        api.build_detection_options('fast', lambda name, default: 'on' if name == 'tiling' else default)
+
+
+def test_build_detection_options_rejects_unknown_text_regions():
+    options = api.build_detection_options('balanced', lambda name, default: 'morphology' if name == 'text_regions' else default)
+    assert options['text_regions'] == 'morphology'
+    with pytest.raises(api.InvalidRequestOption):
+        api.build_detection_options('balanced', lambda name, default: 'east' if name == 'text_regions' else default)
+
+
+def test_gating_defaults_and_validation():
+    assert api.build_detection_options('exhaustive')['gating'] == 'off'
+    assert api.build_detection_options('fast')['gating'] == 'off'
+    explicit = api.build_detection_options('exhaustive', lambda name, default: 'auto' if name == 'gating' else default)
+    assert explicit['gating'] == 'auto'
+    with pytest.raises(api.InvalidRequestOption):
+        api.build_detection_options('balanced', lambda name, default: 'on' if name == 'gating' else default)
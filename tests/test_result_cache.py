@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+import material_detection_api as api
+
+
+def test_memory_lru_eviction_and_copies():
+    cache = api.ResultCache(2)
+    cache.put('a', {'value': 1})
+    cache.put('b', {'value': 2})
+    assert cache.get('a') == ({'value': 1}, 'memory')
+    cache.put('c', {'value': 3})
+    assert cache.get('b') == (None, None)
+    hit, _ = cache.get('a')
+    hit['value'] = 99
+    assert cache.get('a')[0] == {'value': 1}
+    info = cache.info()
+    assert (info['memory_hits'], info['misses'], info['evictions'], info['memory_entries']) == (3, 1, 1, 2)
+
+
+def test_disk_tier_survives_memory_eviction_and_restart(tmp_path):
+    cache = api.ResultCache(1, str(tmp_path), 1024 * 1024)
+    cache.put('a', {'value': 'первый'})
+    cache.put('b', {'value': 2})
+    assert cache.get('a') == ({'value': 'первый'}, 'disk')
+    assert cache.get('a') == ({'value': 'первый'}, 'memory')
+    restarted = api.ResultCache(1, str(tmp_path), 1024 * 1024)
+    assert restarted.info()['disk_entries'] == 2
+    assert restarted.get('b') == ({'value': 2}, 'disk')
+
+
+def test_disk_budget_evicts_oldest(tmp_path):
+    payload = {'text': 'x' * 100}
+    size = len(api.json.dumps(payload).encode())
+    cache = api.ResultCache(1, str(tmp_path), size * 2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, payload)
+    assert sorted(os.listdir(tmp_path)) == ['b.json', 'c.json']
+    assert cache.info()['disk_bytes'] == size * 2
+    cache.put('huge', {'text': 'x' * size * 3})
+    assert not os.path.exists(tmp_path / 'huge.json')
+    assert cache.get('huge')[1] == 'memory'
+
+
+def test_corrupt_disk_entry_is_dropped(tmp_path):
+    cache = api.ResultCache(1, str(tmp_path), 1024 * 1024)
+    cache.put('a', {'value': 1})
+    cache.put('b', {'value': 2})
+    (tmp_path / 'a.json').write_text('{broken', encoding='utf-8')
+    assert cache.get('a') == (None, None)
+    assert not os.path.exists(tmp_path / 'a.json')
+    assert cache.info()['disk_entries'] == 1
+
+
+def test_invalidate(tmp_path):
+    cache = api.ResultCache(4, str(tmp_path), 1024 * 1024)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, {'key': key})
+    assert cache.invalidate('a') == 1
+    assert cache.invalidate('a') == 0
+    assert cache.get('a') == (None, None)
+    assert cache.invalidate() == 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_result_cache_key_depends_on_pixels_and_options():
+    image = np.zeros((16, 16, 3), np.uint8)
+    fast = api.build_detection_options('fast')
+    key = api.result_cache_key(image, fast)
+    assert api.result_cache_key(image.copy(), dict(fast, memory_budget_mb=64)) == key
+    assert api.result_cache_key(image, api.build_detection_options('balanced')) != key
+    changed = image.copy()
+    changed[0, 0, 0] = 1
+    assert api.result_cache_key(changed, fast) != key
@@ -0,0 +1,99 @@
+import threading
+
+import numpy as np
+
+import material_detection_api as api
+
+
+OPTIONS = {'profile': 'fast'}
+
+
+def image(value, size=20):
+    return np.full((size, size, 3), value, dtype=np.uint8)
+
+
+def fake_result(status='miss', partial=False):
+    return {'partial': partial, 'materials': [],
+            'analysis_results': {'processing_info': {'cache': {'status': status}}}}
+
+
+def test_store_reuses_session_for_same_image():
+    store = api.AnalysisSessionStore(4, 3600, 1 << 20)
+    first = store.open(image(1), OPTIONS)
+    assert store.open(image(1), OPTIONS) is first
+    assert store.info()['reused'] == 1
+
+
+def test_store_evicts_oldest_over_count():
+    store = api.AnalysisSessionStore(2, 3600, 1 << 20)
+    a, b, c = (store.open(image(value), OPTIONS) for value in (1, 2, 3))
+    assert store.get(a.id) is None
+    assert store.get(b.id) is b and store.get(c.id) is c
+    assert store.info()['evicted'] == 1
+
+
+def test_store_never_evicts_session_being_opened():
+    store = api.AnalysisSessionStore(2, 3600, 100)
+    session = store.open(image(1), OPTIONS)
+    assert store.get(session.id) is session
+
+
+def test_store_keeps_active_sessions():
+    store = api.AnalysisSessionStore(1, 3600, 1 << 20)
+    busy = store.open(image(1), OPTIONS)
+    busy.active = 1
+    other = store.open(image(2), OPTIONS)
+    assert store.get(busy.id) is busy
+    busy.active = 0
+    store.open(image(3), OPTIONS)
+    assert store.get(busy.id) is None and store.get(other.id) is None
+
+
+def test_store_expires_idle_sessions(monkeypatch):
+    store = api.AnalysisSessionStore(4, 10, 1 << 20)
+    session = store.open(image(1), OPTIONS)
+    session.last_used -= 60
+    assert store.get(session.id) is None
+    assert store.info()['expired'] == 1
+
+
+def test_session_hit_returns_copy_without_mutating_stored_result(monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, 'detect_materials_in_image',
+                        lambda image, options, cache_options, **kwargs: calls.append(1) or fake_result())
+    session = api.AnalysisSession('key', image(1), OPTIONS)
+    first = session.detection({'cache': 'use'})
+    hit = session.detection({'cache': 'use'})
+    assert len(calls) == 1
+    assert hit['analysis_results']['processing_info']['cache'] == {'key': 'key', 'status': 'session_hit'}
+    assert first['analysis_results']['processing_info']['cache'] == {'status': 'miss'}
+    assert session.result is first
+
+
+def test_partial_session_result_is_recomputed(monkeypatch):
+    results = [fake_result(partial=True), fake_result()]
+    monkeypatch.setattr(api, 'detect_materials_in_image', lambda *args, **kwargs: results.pop(0))
+    session = api.AnalysisSession('key', image(1), OPTIONS)
+    session.detection({'cache': 'use'})
+    assert session.detection({'cache': 'use'})['partial'] is False
+
+
+def test_derive_does_not_wait_for_running_pipeline(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_detection(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return fake_result()
+
+    monkeypatch.setattr(api, 'detect_materials_in_image', slow_detection)
+    session = api.AnalysisSession('key', image(1), OPTIONS)
+    session.result = fake_result(partial=True)
+    worker = threading.Thread(target=session.detection, args=({'cache': 'use'},))
+    worker.start()
+    assert started.wait(5)
+    assert session.derive('kolodets', lambda result: 'done') == 'done'
+    assert session.active == 1
+    release.set()
+    worker.join(5)
+    assert session.active == 0 and session.derived == {}